@@ -0,0 +1,23 @@
+"""
+ASGI config for geodjango project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Run it with an ASGI server, e.g. ``uvicorn geodjango.asgi:application``, to serve
+the async endpoints below /api/async/ (see webmap/async_views.py).
+
+For more information on this file, see
+https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+from webmap.db import use_async_pools
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'geodjango.settings')
+
+application = get_asgi_application()
+
+# The server keeps one event loop per worker, so the async endpoints can pool connections on it
+use_async_pools()
@@ -58,6 +58,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'geodjango.wsgi.application'
+ASGI_APPLICATION = 'geodjango.asgi.application'
 
 # Database
 DATABASES = {
@@ -69,14 +70,108 @@ DATABASES = {
         'HOST': os.getenv('POSTGRES_HOST', 'postgis'),
         'PORT': os.getenv('POSTGRES_PORT', '5432'),
         'OPTIONS': {
-            'options': '-c search_path=public,postgis',
+            # search_path is a role default (migration 0011), not a per-connection option
             'client_encoding': 'UTF8',
             'connect_timeout': 10,
+            # Bind parameters on the server so psycopg can prepare repeated ORM queries
+            'server_side_binding': os.getenv('DB_SERVER_SIDE_BINDING', 'False') == 'True',
         },
-        'CONN_MAX_AGE': 60 * 10,  # 10 minutes connection persistence
+        # 10 minutes connection persistence for WSGI workers. Set DB_CONN_MAX_AGE=0 when running
+        # under ASGI: the async endpoints use the pool below and sync code runs in short-lived threads.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60 * 10)),
     }
 }
 
+# Bounded psycopg_pool pool used by the async endpoints (see webmap/db.py), one per event loop
+DB_POOL = {
+    'MIN_SIZE': int(os.getenv('DB_POOL_MIN_SIZE', 1)),
+    'MAX_SIZE': int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+    'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', 10)),  # Seconds to wait for a free connection
+    'MAX_IDLE': 5 * 60,
+    'MAX_LIFETIME': 60 * 60,
+}
+
+# Use Django's own psycopg pool for the sync views instead of persistent connections.
+# Connection setup then only happens when the pool opens a new connection.
+if os.getenv('DB_DJANGO_POOL', 'False') == 'True':
+    DATABASES['default']['OPTIONS']['pool'] = {
+        'min_size': DB_POOL['MIN_SIZE'],
+        'max_size': DB_POOL['MAX_SIZE'],
+        'timeout': DB_POOL['TIMEOUT'],
+        'max_idle': DB_POOL['MAX_IDLE'],
+        'max_lifetime': DB_POOL['MAX_LIFETIME'],
+    }
+    DATABASES['default']['CONN_MAX_AGE'] = 0  # Pooling and persistent connections are exclusive
+
+# Run the hot queries (layer data, bbox + at, tiles) as prepared statements (see webmap/db.py).
+# Disable behind a connection pooler in transaction mode, which cannot keep prepared statements.
+DB_PREPARE_HOT_QUERIES = os.getenv('DB_PREPARE_HOT_QUERIES', 'True') == 'True'
+
+# Cache used for precompressed API responses (see webmap/compression.py)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'kartzeit-default',
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
+    }
+}
+
+PRECOMPRESS_CACHE_ALIAS = 'default'
+PRECOMPRESS_CACHE_TIMEOUT = 60 * 60  # 1 hour, keys include the layer version
+PRECOMPRESS_MIN_SIZE = 1024  # Smaller payloads are served uncompressed
+PRECOMPRESS_GZIP_LEVEL = 9
+PRECOMPRESS_BROTLI_QUALITY = 11
+
+# Baked layer snapshots (see `manage.py bake_snapshots`)
+SNAPSHOT_ROOT = os.getenv('SNAPSHOT_ROOT', os.path.join(BASE_DIR, 'snapshots'))
+SNAPSHOT_TIME_STEPS = os.getenv('SNAPSHOT_TIME_STEPS', '')  # e.g. '1800,1850,1900'
+SNAPSHOT_ZOOM_BANDS = os.getenv('SNAPSHOT_ZOOM_BANDS', '0-5,6-9,10-12')
+
+# Live change stream (/api/async/events/, see webmap/notifications.py)
+SSE_KEEPALIVE = 15  # Seconds between keepalive comments on idle streams
+SSE_QUEUE_SIZE = 1000  # Undelivered events per client before it is told to resync
+
+# Raster XYZ tiles (/api/layers/{id}/raster/{z}/{x}/{y}/, see webmap/rasters.py)
+RASTER_ROOT = os.getenv('RASTER_ROOT', os.path.join(BASE_DIR, 'rasters'))  # GeoData.raster_path is relative to it
+RASTER_TILE_WORKERS = int(os.getenv('RASTER_TILE_WORKERS', 0)) or None  # Threads for GDAL reads, default: CPU count
+
+# Two-tier cache of vector and raster tiles (see webmap/tilecache.py, `manage.py seed_tiles`)
+TILE_CACHE = {
+    'MEMORY_BYTES': int(os.getenv('TILE_CACHE_MEMORY_MB', 64)) * 1024 ** 2,  # In-process LRU, per worker
+    'ROOT': os.getenv('TILE_CACHE_ROOT', os.path.join(BASE_DIR, 'tilecache')),  # '' disables the disk tier
+    'DISK_BYTES': int(os.getenv('TILE_CACHE_DISK_MB', 1024)) * 1024 ** 2,  # Shared by all workers
+}
+
+# Maximum number of layers per /api/scenes/ request
+SCENE_MAX_LAYERS = 50
+
+# Nearest-neighbour queries (`near=` on /api/features/)
+KNN_MAX_K = 1000
+KNN_OVERSAMPLE = 4  # Candidates fetched per result before re-ranking by geography distance
+
+# Layers whose packed keyframes are kept in memory for /api/layers/{id}/trajectories/
+TRAJECTORY_CACHE_LAYERS = 32
+
+# Layers kept as NumPy columns and pre-encoded features for `at=`/`in_bbox=` requests (see webmap/columnar.py)
+COLUMNAR_STORE_LAYERS = 32
+COLUMNAR_STORE_MAX_FEATURES = 200000  # Larger layers are always queried in PostGIS
+COLUMNAR_STORE_MAX_BYTES = int(os.getenv('COLUMNAR_STORE_MAX_MB', 512)) * 1024 ** 2  # All stores of a worker
+
+# Most frames per /api/layers/{id}/frames/ request
+FRAMES_MAX_STEPS = 1000
+
+# Spatial search (POST /api/features/search/)
+SPATIAL_SEARCH_MAX_POINTS = 100000
+SPATIAL_SEARCH_SUBDIVIDE_VERTICES = 256  # Query geometries are split into pieces of this size
+
+# Partitioning of the features table (see webmap/partitioning.py), applied by migration 0012
+# or later with `manage.py partition_features --convert`. '' keeps a single table.
+FEATURES_PARTITIONING = os.getenv('FEATURES_PARTITIONING', '')  # '', 'list' or 'hash'
+FEATURES_PARTITION_MODULUS = int(os.getenv('FEATURES_PARTITION_MODULUS', 8))  # Partitions of the hash strategy
+FEATURES_PARTITION_ERAS = os.getenv('FEATURES_PARTITION_ERAS', '')  # Sub-partitions by time_from, e.g. '1800,1900'
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
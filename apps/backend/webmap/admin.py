@@ -1,10 +1,11 @@
 from django.contrib import admin
-from django.contrib.gis.admin import GISModelAdmin
+from django.contrib.gis.admin import GISModelAdmin, GeoModelAdminMixin
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.urls import reverse
 import json
-from .models import Layer, GeoData, Feature
+from .models import Layer, GeoData, Feature, FeatureKeyframe
+from .search import search_features
 
 @admin.register(Layer)
 class LayerAdmin(admin.ModelAdmin):
@@ -196,12 +197,25 @@ class GeoDataAdmin(admin.ModelAdmin):
     layer_name.short_description = 'Layer'
 
 
+class FeatureKeyframeInline(GeoModelAdminMixin, admin.StackedInline):
+    """Keyframes of moving features, interpolated by /api/layers/{id}/trajectories/."""
+    model = FeatureKeyframe
+    extra = 0
+    fields = ('time', 'geometry')
+    classes = ('collapse',)
+
+
 @admin.register(Feature)
 class FeatureAdmin(GISModelAdmin):
-    list_display = ('name', 'geodata_name', 'geometry_type', 'time_from', 'time_to', 'created_at')
-    list_filter = ('geodata__layer__name', 'created_at', 'time_from', 'time_to')
-    search_fields = ('name', 'description', '_attributes')
-    readonly_fields = ('created_at', 'updated_at', 'geometry_type', 'get_attributes_display')
+    inlines = (FeatureKeyframeInline,)
+    list_display = ('name', 'geodata_name', 'geometry_type', 'num_points', 'area_m2', 'time_from', 'time_to', 'created_at')
+    list_filter = ('geodata__layer__name', 'geom_type', 'geometry_repaired', 'created_at', 'time_from', 'time_to')
+    list_select_related = ('geodata',)
+    search_fields = ('search_vector',)  # Full-text search, see get_search_results
+    readonly_fields = (
+        'created_at', 'updated_at', 'geometry_type', 'get_attributes_display',
+        'num_points', 'area_m2', 'length_m', 'geometry_repaired',
+    )
 
     fieldsets = (
         ('Core Information', {
@@ -215,6 +229,10 @@ class FeatureAdmin(GISModelAdmin):
             'fields': ('time_from', 'time_to', 'zoom_range'),
             'classes': ('collapse',)
         }),
+        ('Geometry Properties (Computed)', {
+            'fields': ('geometry_type', 'num_points', 'area_m2', 'length_m', 'geometry_repaired'),
+            'classes': ('collapse',)
+        }),
         ('Additional Attributes (Read-Only)', {
             'fields': ('get_attributes_display', '_attributes'),
             'classes': ('collapse', 'wide'),
@@ -225,6 +243,10 @@ class FeatureAdmin(GISModelAdmin):
         }),
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        """Use the full-text index instead of ICONTAINS lookups."""
+        return search_features(queryset, search_term), False
+
     def geodata_name(self, obj):
         return obj.geodata.name
     geodata_name.short_description = 'GeoData'
@@ -233,6 +255,7 @@ class FeatureAdmin(GISModelAdmin):
     def geometry_type(self, obj):
         return obj.get_geometry_type()
     geometry_type.short_description = 'Geometry Type'
+    geometry_type.admin_order_field = 'geom_type'
 
     def get_attributes_display(self, obj):
         """Show formatted attributes for display."""
@@ -0,0 +1,219 @@
+"""
+Async versions of the hot read endpoints, for deployment behind ASGI (geodjango/asgi.py).
+
+They answer the same queries as LayerViewSet.data, FeatureViewSet.list and
+LayerViewSet.tile, but run them on psycopg3's async driver through the pool in
+webmap/db.py. The connection is returned to the pool as soon as the rows are
+fetched; serialization and compression then run in worker threads, so a burst
+of scene-change requests needs far fewer database connections than sync workers.
+Single-layer requests are answered from the in-memory layer stores (webmap/columnar.py).
+
+Responses are byte-identical to the sync endpoints and share their cache entries (tiles: webmap/tilecache.py).
+
+`feature_events` streams live feature changes as Server-Sent Events (webmap/notifications.py);
+under ASGI an open stream costs a queue and no thread or database connection.
+"""
+import asyncio
+import json
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+
+from .columnar import aget_layer_store, is_storable
+from .compression import aprecompressed_response, layer_data_cache_key
+from .db import fetch_all, fetch_one
+from .filters import parse_at
+from .notifications import get_listener
+from .queries import LAYER_SQL, build_features_query, layer_info_from_row, render_feature_collection
+from .renderers import MVTRenderer
+from .serializers import can_render_rows
+from .tilecache import aget_time_bucket, atile_response, tile_key
+from .tiles import build_tile_query, is_valid_tile
+
+
+def validation_error(field, message):
+    """Error response in the same shape as DRF's ValidationError."""
+    return JsonResponse({field: [message]}, status=400)
+
+
+def get_at(request, param='at'):
+    """Return (at, error_response) for the `at=` parameter (or another time parameter such as `as_of=`)."""
+    value = request.GET.get(param)
+    if not value:
+        return None, None
+    try:
+        return parse_at(value), None
+    except ValueError as exc:
+        return None, validation_error(param, str(exc))
+
+
+def get_bbox(request):
+    """Return (bbox tuple, error_response) for the `in_bbox=` parameter."""
+    value = request.GET.get('in_bbox')
+    if not value:
+        return None, None
+    try:
+        bbox = tuple(float(part) for part in value.split(','))
+    except ValueError:
+        bbox = ()
+    if len(bbox) != 4:
+        return None, validation_error('in_bbox', 'Expected <west>,<south>,<east>,<north>.')
+    return bbox, None
+
+
+def get_layer_id_filter(request):
+    """Return (layer_id, error_response) for the `geodata__layer=` parameter."""
+    value = request.GET.get('geodata__layer')
+    if not value:
+        return None, None
+    try:
+        return int(value), None
+    except ValueError:
+        return None, validation_error('geodata__layer', 'Select a valid choice.')
+
+
+def get_layer_ids(request):
+    """Return (layer IDs, error_response) for the comma-separated `layers=` parameter."""
+    value = request.GET.get('layers')
+    if not value:
+        return (), None
+    try:
+        return tuple(int(part) for part in value.split(',') if part.strip()), None
+    except ValueError:
+        return None, validation_error('layers', 'Expected comma-separated layer IDs.')
+
+
+def is_compact(request):
+    return request.GET.get('compact', '').lower() in ('1', 'true', 'yes')
+
+
+async def get_layer_info(layer_id):
+    """Fetch the layer row together with its geodata ID and data version, or raise Http404."""
+    row = await fetch_one(LAYER_SQL, {'layer_id': layer_id})
+    if row is None:
+        raise Http404("Layer not found.")
+    if row['geodata_id'] is None:
+        raise Http404("Layer has no geodata.")
+    return layer_info_from_row(row)
+
+
+async def layer_data(request, layer_id):
+    """Async counterpart of /api/layers/{id}/data/, supports `at=`, `as_of=` and `compact=true`."""
+    at, error = get_at(request)
+    if error:
+        return error
+    as_of, error = get_at(request, 'as_of')
+    if error:
+        return error
+    compact = is_compact(request)
+    layer = await get_layer_info(layer_id)
+
+    async def render():
+        if as_of is None and not compact and is_storable(layer['count']):
+            store = await aget_layer_store(layer_id, layer['geodata_id'], layer['version'])
+            return store.render(at=at)
+        geojson = can_render_rows(compact)
+        rows = await fetch_all(
+            *build_features_query(geodata_id=layer['geodata_id'], at=at, as_of=as_of, geojson=geojson)
+        )
+        return await asyncio.to_thread(render_feature_collection, rows, compact, geojson)
+
+    cache_key = layer_data_cache_key(layer_id, layer['version'], at, compact, as_of)
+    return await aprecompressed_response(request, cache_key, render)
+
+
+async def feature_list(request):
+    """
+    Async counterpart of /api/features/ for the map's hot filters:
+    `geodata__layer`, `at`, `in_bbox` (features contained in the box, like InBBoxFilter) and `compact=true`.
+    All other filters are only available on the sync endpoint.
+    """
+    layer_id, error = get_layer_id_filter(request)
+    if error:
+        return error
+    at, error = get_at(request)
+    if error:
+        return error
+    bbox, error = get_bbox(request)
+    if error:
+        return error
+
+    if layer_id is not None and not is_compact(request):
+        layer = await fetch_one(LAYER_SQL, {'layer_id': layer_id})
+        if layer is not None and layer['geodata_id'] is not None and is_storable(layer['count']):
+            layer = layer_info_from_row(layer)
+            store = await aget_layer_store(layer_id, layer['geodata_id'], layer['version'])
+            return HttpResponse(store.render(at=at, bbox=bbox), content_type='application/json')
+
+    geojson = can_render_rows(is_compact(request))
+    rows = await fetch_all(*build_features_query(layer_id=layer_id, at=at, bbox=bbox, geojson=geojson))
+    content = await asyncio.to_thread(render_feature_collection, rows, is_compact(request), geojson)
+    return HttpResponse(content, content_type='application/json')
+
+
+async def layer_tile(request, layer_id, z, x, y):
+    """Async counterpart of /api/layers/{id}/tiles/{z}/{x}/{y}/, supports `at=`."""
+    if not is_valid_tile(z, x, y):
+        raise Http404("Tile coordinates out of range.")
+    at, error = get_at(request)
+    if error:
+        return error
+    layer = await get_layer_info(layer_id)
+
+    async def render():
+        sql, params = build_tile_query(layer['geodata_id'], z, x, y, at=at, layer_name=f"layer_{layer_id}")
+        row = await fetch_one(sql, params)
+        return bytes(row['tile']) if row and row['tile'] is not None else b''
+
+    bucket = await aget_time_bucket(layer['geodata_id'], layer['version'], at)
+    key = tile_key('vector', layer_id, layer['version'], z, x, y, bucket)
+    return await atile_response(request, key, render, content_type=MVTRenderer.media_type)
+
+
+def format_event(event):
+    """Encode an event dict as a Server-Sent Event."""
+    return f"event: {event['type']}\ndata: {json.dumps(event, separators=(',', ':'))}\n\n"
+
+
+async def feature_events(request):
+    """
+    Server-Sent Events of feature changes, limited to some layers with `layers=1,2`.
+    `change` events carry layer_id, geodata_id, feature_id and operation (insert, update, delete
+    or reload for a whole dataset); after a `resync` event clients should reload their layers.
+    """
+    layer_ids, error = get_layer_ids(request)
+    if error:
+        return error
+    keepalive = getattr(settings, 'SSE_KEEPALIVE', 15)
+    queue = asyncio.Queue(maxsize=getattr(settings, 'SSE_QUEUE_SIZE', 1000))
+    loop = asyncio.get_running_loop()
+
+    def enqueue(event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client cannot keep up: drop its backlog, it has to reload anyway
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({'type': 'resync'})
+
+    async def stream():
+        listener = get_listener()
+        subscriber = listener.subscribe(lambda event: loop.call_soon_threadsafe(enqueue, event), layer_ids)
+        try:
+            await asyncio.to_thread(listener.ready.wait, keepalive)
+            yield f"retry: {keepalive * 1000}\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'  # Keeps proxies from closing an idle stream
+                    continue
+                yield format_event(event)
+        finally:
+            listener.unsubscribe(subscriber)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Disable response buffering in nginx
+    return response
@@ -0,0 +1,273 @@
+"""
+Columnar in-memory copies of hot layers for time-slider and bbox requests.
+
+All features of a layer are serialized once per layer version with FeatureRowSerializer
+(the regular FeatureSerializer without orjson) and kept as one byte buffer with offsets,
+next to NumPy columns of feature IDs, time_from/time_to (int64 microseconds since the
+epoch) and bounding boxes. An `at=`/`in_bbox=` request is then answered by a few
+vectorized comparisons and by joining the pre-encoded features, without a database query
+or a serializer pass: scrubbing the time slider only costs the masks and a byte copy per request.
+
+The output is byte-identical to rendering FEATURES_SQL rows (queries.py). Bounding boxes
+are rounded outwards to float4 like the index boxes of PostGIS, so `in_bbox` selects
+exactly the features the `@` operator would. With Shapely installed, bbox requests on
+larger layers look up candidates in an STRtree over the boxes, built on the first bbox
+request, instead of comparing every box. Compact responses (`compact=true`), past versions
+(`as_of`) and layers above COLUMNAR_STORE_MAX_FEATURES still go to PostGIS; all stores of a
+process together stay below COLUMNAR_STORE_MAX_BYTES, least recently used layers are dropped.
+"""
+import asyncio
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import shapely
+except ImportError:  # Shapely is optional, bbox requests then scan all boxes
+    shapely = None
+
+from .db import execute_all, fetch_all
+from .queries import build_features_query, features_from_rows
+from .serializers import FeatureRowSerializer, FeatureSerializer, can_render_rows
+
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+ALWAYS_FROM = np.iinfo(np.int64).min  # time_from IS NULL
+ALWAYS_TO = np.iinfo(np.int64).max  # time_to IS NULL
+SPATIAL_INDEX_MIN_FEATURES = 1000  # Below this a scan of all boxes is as fast as the tree
+SPATIAL_INDEX_BYTES_PER_FEATURE = 200  # Rough size of a box polygon and its tree node
+
+
+def to_microseconds(value):
+    """Microseconds since the epoch as int, exact for aware datetimes of any year."""
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def float4_box(minx, miny, maxx, maxy):
+    """Round float64 box bounds outwards to float32, as PostGIS does for its index boxes."""
+    def down(values):
+        values = np.asarray(values, dtype=np.float64)
+        rounded = values.astype(np.float32)
+        return np.where(rounded > values, np.nextafter(rounded, np.float32(-np.inf)), rounded)
+
+    def up(values):
+        values = np.asarray(values, dtype=np.float64)
+        rounded = values.astype(np.float32)
+        return np.where(rounded < values, np.nextafter(rounded, np.float32(np.inf)), rounded)
+
+    return down(minx), down(miny), up(maxx), up(maxy)
+
+
+def collection_frame():
+    """The bytes before and after the features of a rendered FeatureCollection."""
+    empty = JSONRenderer().render({'type': 'FeatureCollection', 'features': []})
+    head, _, tail = empty.rpartition(b'[]')
+    return head + b'[', b']' + tail
+
+
+class LayerStore:
+    """The features of one layer as NumPy columns and pre-encoded GeoJSON features."""
+
+    def __init__(self, rows, geojson=False):
+        """
+        `rows` are FEATURES_SQL rows without time or bbox filter, ordered by ID, of a `geojson=True`
+        query if `geojson` is set (see build_features_query).
+        """
+        if geojson:
+            serializer = FeatureRowSerializer()
+            encoded = [serializer.encode(row) for row in rows]
+            records = [
+                (
+                    row['id'], None if row['xmin'] is None else (row['xmin'], row['ymin'], row['xmax'], row['ymax']),
+                    row['time_from'], row['time_to'],
+                )
+                for row in rows
+            ]
+        else:
+            renderer = JSONRenderer()
+            features = features_from_rows(rows)
+            encoded = [renderer.render(FeatureSerializer(feature).data) for feature in features]
+            records = [
+                (
+                    feature.pk, None if feature.geometry.empty else feature.geometry.extent,
+                    feature.time_from, feature.time_to,
+                )
+                for feature in features
+            ]
+
+        offsets = [0]
+        boxes = np.full((len(records), 4), np.nan)
+        time_from = np.full(len(records), ALWAYS_FROM, dtype=np.int64)
+        time_to = np.full(len(records), ALWAYS_TO, dtype=np.int64)
+        for index, (data, (_, box, start, end)) in enumerate(zip(encoded, records)):
+            offsets.append(offsets[-1] + len(data))
+            if box is not None:
+                boxes[index] = box  # Empty geometries have no box and never match
+            if start is not None:
+                time_from[index] = to_microseconds(start)
+            if end is not None:
+                time_to[index] = to_microseconds(end)
+
+        self.buffer = b''.join(encoded)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.feature_ids = np.array([record[0] for record in records], dtype=np.int64)
+        self.time_from = time_from
+        self.time_to = time_to
+        self.minx, self.miny, self.maxx, self.maxy = float4_box(*boxes.T)
+        self.head, self.tail = collection_frame()
+        self._tree = None
+        self._tree_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.feature_ids)
+
+    @property
+    def nbytes(self):
+        """Approximate memory use, including the spatial index it will build."""
+        columns = (
+            self.offsets, self.feature_ids, self.time_from, self.time_to, self.minx, self.miny, self.maxx, self.maxy
+        )
+        tree = len(self) * SPATIAL_INDEX_BYTES_PER_FEATURE if self.uses_spatial_index() else 0
+        return len(self.buffer) + sum(column.nbytes for column in columns) + tree
+
+    def uses_spatial_index(self):
+        return shapely is not None and len(self) >= SPATIAL_INDEX_MIN_FEATURES
+
+    def get_tree(self):
+        """The STRtree over the feature boxes, built on first use."""
+        with self._tree_lock:
+            if self._tree is None:
+                boxes = shapely.box(self.minx, self.miny, self.maxx, self.maxy)
+                boxes[np.isnan(self.minx)] = None  # Not indexed
+                self._tree = shapely.STRtree(boxes)
+            return self._tree
+
+    def select(self, at=None, bbox=None):
+        """Indices of the features visible at `at` and contained in the (west, south, east, north) bbox."""
+        if bbox is not None:
+            west, south, east, north = float4_box(*bbox)
+        if bbox is not None and self.uses_spatial_index():
+            # Only boxes intersecting the query box can be contained in it
+            candidates = np.sort(self.get_tree().query(shapely.box(west, south, east, north)))
+        else:
+            candidates = np.arange(len(self))
+        mask = np.ones(len(candidates), dtype=bool)
+        if at is not None:
+            t = to_microseconds(at)
+            mask &= (self.time_from[candidates] <= t) & (self.time_to[candidates] >= t)
+        if bbox is not None:
+            # Comparisons with NaN are False, so features without a box drop out
+            mask &= (
+                (self.minx[candidates] >= west) & (self.maxx[candidates] <= east)
+                & (self.miny[candidates] >= south) & (self.maxy[candidates] <= north)
+            )
+        return candidates[mask]
+
+    def render(self, at=None, bbox=None):
+        """The JSON bytes of the FeatureCollection, same as render_feature_collection of the filtered rows."""
+        indices = self.select(at, bbox)
+        starts = self.offsets[indices].tolist()
+        ends = self.offsets[indices + 1].tolist()
+        buffer = memoryview(self.buffer)
+        return self.head + b','.join(buffer[start:end] for start, end in zip(starts, ends)) + self.tail
+
+
+def time_columns(rows):
+    """Feature IDs and time_from/time_to columns from FEATURE_TIMES_SQL rows."""
+    feature_ids = np.array([row['id'] for row in rows], dtype=np.int64)
+    time_from = np.array(
+        [ALWAYS_FROM if row['time_from'] is None else to_microseconds(row['time_from']) for row in rows], dtype=np.int64
+    )
+    time_to = np.array(
+        [ALWAYS_TO if row['time_to'] is None else to_microseconds(row['time_to']) for row in rows], dtype=np.int64
+    )
+    return feature_ids, time_from, time_to
+
+
+def frame_times(start, end, steps):
+    """`steps` evenly spaced times from `start` to `end` (both included) as epoch microseconds."""
+    start, end = to_microseconds(start), to_microseconds(end)
+    if steps == 1:
+        return [start]
+    return [start + (end - start) * step // (steps - 1) for step in range(steps)]
+
+
+def visibility_runs(time_from, time_to, times):
+    """
+    Run-length encode the features visible at each time: alternating lengths of hidden
+    and visible features in column order, always starting with a (possibly empty) hidden run.
+    """
+    frames = []
+    for t in times:
+        visible = (time_from <= t) & (time_to >= t)
+        changes = np.flatnonzero(visible[1:] != visible[:-1]) + 1
+        bounds = np.concatenate(([0], changes, [len(visible)]))
+        runs = np.diff(bounds).tolist() if len(visible) else []
+        frames.append([0] + runs if len(visible) and visible[0] else runs)
+    return frames
+
+
+def from_microseconds(value):
+    return EPOCH + timedelta(microseconds=value)
+
+
+def is_storable(count):
+    """Whether a layer with `count` features is small enough to be kept in memory."""
+    return count <= getattr(settings, 'COLUMNAR_STORE_MAX_FEATURES', 200000)
+
+
+_layer_stores = OrderedDict()
+_layer_stores_lock = threading.Lock()
+
+
+def _cached_store(layer_id, version):
+    with _layer_stores_lock:
+        entry = _layer_stores.get(layer_id)
+        if entry is not None and entry[0] == version:
+            _layer_stores.move_to_end(layer_id)
+            return entry[1]
+    return None
+
+
+def _store(layer_id, version, store):
+    max_layers = getattr(settings, 'COLUMNAR_STORE_LAYERS', 32)
+    max_bytes = getattr(settings, 'COLUMNAR_STORE_MAX_BYTES', 512 * 1024 ** 2)
+    with _layer_stores_lock:
+        _layer_stores[layer_id] = (version, store)
+        _layer_stores.move_to_end(layer_id)
+        # The newest store is kept even if it alone exceeds the cap
+        while len(_layer_stores) > 1 and (
+            len(_layer_stores) > max_layers
+            or sum(entry[1].nbytes for entry in _layer_stores.values()) > max_bytes
+        ):
+            _layer_stores.popitem(last=False)
+    return store
+
+
+def get_layer_store(layer_id, geodata_id, version):
+    """Return the store of a layer, rebuilt only when its data `version` changes (LRU over layers)."""
+    store = _cached_store(layer_id, version)
+    if store is None:
+        geojson = can_render_rows()
+        rows = execute_all(*build_features_query(geodata_id=geodata_id, geojson=geojson))
+        store = _store(layer_id, version, LayerStore(rows, geojson))
+    return store
+
+
+async def aget_layer_store(layer_id, geodata_id, version):
+    """Async variant of get_layer_store, reading through the async pool and encoding in a worker thread."""
+    store = _cached_store(layer_id, version)
+    if store is None:
+        geojson = can_render_rows()
+        rows = await fetch_all(*build_features_query(geodata_id=geodata_id, geojson=geojson))
+        store = _store(layer_id, version, await asyncio.to_thread(LayerStore, rows, geojson))
+    return store
+
+
+def clear_layer_stores():
+    with _layer_stores_lock:
+        _layer_stores.clear()
@@ -0,0 +1,157 @@
+"""
+Precompressed response cache.
+
+Cacheable payloads (layer data, tiles, exports) are compressed once with gzip
+and, if available, Brotli. All variants are stored next to the raw bytes, so
+each request only has to pick the encoding its Accept-Encoding header allows.
+"""
+import asyncio
+import gzip
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional, gzip is always available
+    brotli = None
+
+
+# Preferred order when the client accepts several encodings equally
+ENCODING_PREFERENCE = ('br', 'gzip', 'identity')
+
+PRECOMPRESSED_TYPES = ('image/png', 'image/webp')
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def compress_payload(raw):
+    """Return a dict mapping content-coding names to the encoded payload."""
+    variants = {'identity': raw}
+    if len(raw) < _setting('PRECOMPRESS_MIN_SIZE', 1024):
+        return variants
+
+    variants['gzip'] = gzip.compress(raw, compresslevel=_setting('PRECOMPRESS_GZIP_LEVEL', 9), mtime=0)
+    if brotli is not None:
+        variants['br'] = brotli.compress(raw, quality=_setting('PRECOMPRESS_BROTLI_QUALITY', 11))
+    return variants
+
+
+def parse_accept_encoding(header):
+    """Parse an Accept-Encoding header into a dict of coding -> q-value."""
+    accepted = {}
+    for part in (header or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def negotiate_encoding(header, available):
+    """Pick the best available content-coding for an Accept-Encoding header."""
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get('*')
+
+    def quality(coding):
+        if coding in accepted:
+            return accepted[coding]
+        if coding == 'identity':
+            # identity is acceptable unless explicitly excluded
+            return 0.0 if wildcard == 0.0 else 0.001
+        return wildcard or 0.0
+
+    best, best_q = 'identity', 0.0
+    for coding in ENCODING_PREFERENCE:
+        if coding not in available:
+            continue
+        q = quality(coding)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def build_cache_key(prefix, *parts):
+    """Build a cache key from a prefix and arbitrary parts (e.g. layer version, query params)."""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+    return f"precompressed:{prefix}:{digest}"
+
+
+def layer_data_cache_key(layer_id, version, at=None, compact=False, as_of=None):
+    """Cache key of a layer data response, shared by the sync and async layer data views."""
+    return build_cache_key('layer-data', layer_id, version, at, compact, as_of)
+
+
+def build_entry(raw, content_type='application/json'):
+    """Build the cache entry (ETag and all encodings) for a raw payload."""
+    return {
+        'content_type': content_type,
+        'etag': '"%s"' % hashlib.sha1(raw).hexdigest(),
+        # Already compressed formats gain nothing from gzip or Brotli
+        'variants': {'identity': raw} if content_type in PRECOMPRESSED_TYPES else compress_payload(raw),
+    }
+
+
+def get_or_compress(cache_key, render, content_type='application/json'):
+    """
+    Return the cached entry for `cache_key`, rendering and compressing it on a miss.
+    `render` must return the raw payload as bytes.
+    """
+    cache = caches[_setting('PRECOMPRESS_CACHE_ALIAS', 'default')]
+    entry = cache.get(cache_key)
+    if entry is None:
+        entry = build_entry(render(), content_type)
+        cache.set(cache_key, entry, _setting('PRECOMPRESS_CACHE_TIMEOUT', 60 * 60))
+    return entry
+
+
+async def aget_or_compress(cache_key, render, content_type='application/json'):
+    """
+    Async variant of get_or_compress for async views. `render` is a coroutine function
+    returning the raw payload; compression runs in a worker thread so it does not block the event loop.
+    """
+    cache = caches[_setting('PRECOMPRESS_CACHE_ALIAS', 'default')]
+    entry = await cache.aget(cache_key)
+    if entry is None:
+        raw = await render()
+        entry = await asyncio.to_thread(build_entry, raw, content_type)
+        await cache.aset(cache_key, entry, _setting('PRECOMPRESS_CACHE_TIMEOUT', 60 * 60))
+    return entry
+
+
+def response_for_entry(request, entry):
+    """Build an HttpResponse serving the best encoding of a cached entry."""
+    if request.META.get('HTTP_IF_NONE_MATCH') == entry['etag']:
+        response = HttpResponse(status=304)
+    else:
+        encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING'), entry['variants'])
+        response = HttpResponse(entry['variants'][encoding], content_type=entry['content_type'])
+        if encoding != 'identity':
+            response['Content-Encoding'] = encoding
+        response['Content-Length'] = str(len(response.content))
+    response['ETag'] = entry['etag']
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def precompressed_response(request, cache_key, render, content_type='application/json'):
+    """Serve `render()` from the precompressed cache, honouring Accept-Encoding."""
+    return response_for_entry(request, get_or_compress(cache_key, render, content_type))
+
+
+async def aprecompressed_response(request, cache_key, render, content_type='application/json'):
+    """Async variant of precompressed_response, `render` is a coroutine function."""
+    return response_for_entry(request, await aget_or_compress(cache_key, render, content_type))
@@ -0,0 +1,162 @@
+"""
+Direct psycopg3 access for the hot read paths.
+
+The async endpoints (see webmap/async_views.py) do not go through Django's
+connection handling. They borrow connections from a bounded `psycopg_pool`
+pool, run their query and hand the connection back before the response is
+serialized or written, so idle requests never hold on to a database connection.
+Pools are only kept under ASGI (see use_async_pools); elsewhere each query opens
+and closes its own connection.
+
+Hot queries (see webmap/queries.py and webmap/tiles.py) run as server-side
+prepared statements: they are parsed and planned once per connection and then
+only executed with new parameters. This only pays off on long-lived connections,
+i.e. the async pool, Django's pool (DB_DJANGO_POOL) or CONN_MAX_AGE.
+Disable it with DB_PREPARE_HOT_QUERIES=False behind a transaction-mode PgBouncer.
+"""
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+
+import psycopg
+from django.conf import settings
+from django.db import connections
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg.types.json import JsonbLoader, JsonLoader
+from psycopg_pool import AsyncConnectionPool
+
+
+# One pool per event loop: connections are bound to the loop that opened them
+_async_pools = weakref.WeakKeyDictionary()
+# Enabled by geodjango/asgi.py: only an ASGI server keeps its event loop for the life of the
+# process. Under runserver or WSGI each async request runs in a new loop (async_to_sync), and
+# a pool would be opened and abandoned with every one of them.
+_use_pools = False
+
+
+def use_async_pools(enabled=True):
+    """Keep a connection pool per event loop, for processes serving through a long-lived ASGI loop."""
+    global _use_pools
+    _use_pools = enabled
+
+
+def get_conninfo(alias='default'):
+    """Build a libpq connection string from a Django DATABASES entry."""
+    database = settings.DATABASES[alias]
+    options = database.get('OPTIONS', {})
+    params = {
+        'dbname': database.get('NAME'),
+        'user': database.get('USER'),
+        'password': database.get('PASSWORD'),
+        'host': database.get('HOST'),
+        'port': database.get('PORT'),
+    }
+    # Server-wide settings such as search_path are stored on the role (see migration 0011),
+    # so new connections need no per-connection setup
+    for key in ('options', 'client_encoding', 'connect_timeout', 'sslmode', 'application_name'):
+        if key in options:
+            params[key] = options[key]
+    return make_conninfo(**{key: value for key, value in params.items() if value not in (None, '')})
+
+
+def get_pool_settings():
+    """Return the keyword arguments of the async pool from `DB_POOL`."""
+    config = getattr(settings, 'DB_POOL', {})
+    return {
+        'min_size': config.get('MIN_SIZE', 1),
+        'max_size': config.get('MAX_SIZE', 10),
+        'timeout': config.get('TIMEOUT', 10),
+        'max_idle': config.get('MAX_IDLE', 300),
+        'max_lifetime': config.get('MAX_LIFETIME', 3600),
+    }
+
+
+async def get_async_pool():
+    """Return the pool of the running event loop, opening it on first use."""
+    loop = asyncio.get_running_loop()
+    pool = _async_pools.get(loop)
+    if pool is None:
+        pool = AsyncConnectionPool(
+            get_conninfo(),
+            kwargs={'autocommit': True, 'row_factory': dict_row},
+            open=False,
+            name='webmap-async',
+            **get_pool_settings(),
+        )
+        _async_pools[loop] = pool
+    # Opening an already open pool is a no-op, so concurrent first requests are fine
+    await pool.open()
+    return pool
+
+
+def get_prepare_flag(prepare=None):
+    """`prepare` argument for psycopg: True for hot queries unless disabled in settings."""
+    if prepare is None:
+        prepare = getattr(settings, 'DB_PREPARE_HOT_QUERIES', True)
+    return bool(prepare)
+
+
+@asynccontextmanager
+async def async_connection():
+    """A connection from the pool of the running loop, or a connection of its own without pools."""
+    if not _use_pools:
+        async with await psycopg.AsyncConnection.connect(
+            get_conninfo(), autocommit=True, row_factory=dict_row
+        ) as conn:
+            yield conn
+        return
+    pool = await get_async_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+
+async def fetch_all(sql, params=None, prepare=None):
+    """Run a query on a pooled connection and return all rows as dicts."""
+    async with async_connection() as conn:
+        cursor = await conn.execute(sql, params, prepare=get_prepare_flag(prepare))
+        return await cursor.fetchall()
+
+
+async def fetch_one(sql, params=None, prepare=None):
+    """Run a query on a pooled connection and return the first row as a dict, or None."""
+    async with async_connection() as conn:
+        cursor = await conn.execute(sql, params, prepare=get_prepare_flag(prepare))
+        return await cursor.fetchone()
+
+
+def prepared_cursor(using='default'):
+    """
+    Return a server-side binding psycopg cursor on Django's own connection.
+    Django's cursors interpolate parameters on the client, which rules out prepared
+    statements; this cursor shares the connection and transaction of the ORM instead.
+    """
+    connection = connections[using]
+    connection.ensure_connection()
+    cursor = psycopg.Cursor(connection.connection, row_factory=dict_row)
+    # Django loads json/jsonb as text and decodes it in the model field; raw rows need
+    # the dicts psycopg returns on the async pool, so override this cursor's loaders only
+    cursor.adapters.register_loader('jsonb', JsonbLoader)
+    cursor.adapters.register_loader('json', JsonLoader)
+    return cursor
+
+
+def execute_all(sql, params=None, prepare=None, using='default'):
+    """Run a hot query on Django's connection and return all rows as dicts."""
+    with prepared_cursor(using) as cursor:
+        cursor.execute(sql, params, prepare=get_prepare_flag(prepare))
+        return cursor.fetchall()
+
+
+def execute_one(sql, params=None, prepare=None, using='default'):
+    """Run a hot query on Django's connection and return the first row as a dict, or None."""
+    with prepared_cursor(using) as cursor:
+        cursor.execute(sql, params, prepare=get_prepare_flag(prepare))
+        return cursor.fetchone()
+
+
+async def close_async_pools():
+    """Close all pools, e.g. on ASGI lifespan shutdown or at the end of a test."""
+    for pool in list(_async_pools.values()):
+        await pool.close()
+    _async_pools.clear()
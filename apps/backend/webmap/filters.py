@@ -0,0 +1,274 @@
+import json
+import math
+import re
+from datetime import date, datetime, timezone as dt_timezone
+
+import django_filters
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db.models import F, Lookup, Q, Subquery, Value
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend, SearchFilter
+
+from .models import Feature
+from .search import search_features
+from .spatial import GeographyDistance, GeographyKNNDistance, geometry_value
+
+
+def parse_at(value):
+    """
+    Parse a point in time as used by the `at=` parameter.
+    Accepts full ISO datetimes, ISO dates and plain years (e.g. '1800').
+    Naive values are interpreted as UTC. Raises ValueError on invalid input.
+    """
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, date):
+        parsed = datetime(value.year, value.month, value.day)
+    else:
+        value = (value or '').strip()
+        if value.isdigit():
+            parsed = datetime(int(value), 1, 1)
+        else:
+            parsed = parse_datetime(value)
+            if parsed is None:
+                parsed_date = parse_date(value)
+                if parsed_date is None:
+                    raise ValueError(f"Invalid time value: {value!r}")
+                parsed = datetime(parsed_date.year, parsed_date.month, parsed_date.day)
+
+    if timezone.is_naive(parsed):
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return parsed
+
+
+def get_at_param(request, param='at'):
+    """Return the parsed `at=` query parameter of a request, or None if it is not given."""
+    value = request.query_params.get(param)
+    if not value:
+        return None
+    try:
+        return parse_at(value)
+    except ValueError as exc:
+        raise ValidationError({param: str(exc)})
+
+
+class FeatureFilterSet(django_filters.FilterSet):
+    """
+    Filters for the feature endpoint.
+    `at` returns the features visible at a point in time, e.g. ?at=1800 or ?at=1800-06-01.
+    """
+    at = django_filters.CharFilter(method='filter_at', label='Visible at (year, ISO date or datetime)')
+
+    class Meta:
+        model = Feature
+        fields = {
+            'geodata__layer': ['exact'],
+            'time_from': ['gte', 'lte', 'exact'],
+            'time_to': ['gte', 'lte', 'exact'],
+        }
+
+    def filter_at(self, queryset, name, value):
+        try:
+            at = parse_at(value)
+        except ValueError as exc:
+            raise ValidationError({name: str(exc)})
+        return queryset.visible_at(at)
+
+
+class JSONPathExists(Lookup):
+    """
+    `jsonb @? jsonpath`. GIN jsonb_path_ops indexes only serve paths of the form
+    `accessor == constant`; comparisons, like_regex and `!= null` scan the rows.
+    """
+    lookup_name = 'path_exists'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} @? ({rhs})::jsonpath", (*lhs_params, *rhs_params)
+
+
+class AttributeFilterBackend(BaseFilterBackend):
+    """
+    Filters features on typed values in `_attributes`.
+
+    Parameters have the form `attr.<key>[__<op>]=<value>`, nested keys are separated by dots:
+        ?attr.type=capital
+        ?attr.population__gte=1000000
+        ?attr.style.color__in=#ff0000,#00ff00
+
+    Equality and `in` compile to JSONB containment (`@>`), which the GIN jsonb_path_ops index
+    on `_attributes` serves. All other operators compile to JSONPath predicates (`@?`) that
+    the index cannot serve, so combine them with an indexed filter (layer, bbox, equality).
+    Values are typed: numbers, true/false and null are matched as JSON values,
+    wrap a value in double quotes to force a string.
+    """
+    param_prefix = 'attr.'
+    field_name = '_attributes'
+    key_pattern = re.compile(r'^[A-Za-z0-9_\-]+$')
+    comparison_operators = {'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+    operators = ('exact', 'ne', 'in', 'contains', 'icontains', 'exists', 'isnull', *comparison_operators)
+
+    def filter_queryset(self, request, queryset, view):
+        for param in request.query_params:
+            if not param.startswith(self.param_prefix):
+                continue
+            path, operator = self.parse_param(param)
+            for value in request.query_params.getlist(param):
+                queryset = queryset.filter(self.build_condition(path, operator, value))
+        return queryset
+
+    def parse_param(self, param):
+        """Split `attr.a.b__op` into (['a', 'b'], 'op')."""
+        key, sep, operator = param[len(self.param_prefix):].rpartition('__')
+        if not sep or operator not in self.operators:
+            key, operator = param[len(self.param_prefix):], 'exact'
+        path = key.split('.')
+        if not all(self.key_pattern.match(part) and '__' not in part for part in path):
+            raise ValidationError({param: 'Invalid attribute key.'})
+        return path, operator
+
+    @staticmethod
+    def coerce_value(raw):
+        """Convert a query string value into the JSON value it most likely denotes."""
+        if len(raw) >= 2 and raw[0] == raw[-1] == '"':
+            return raw[1:-1]
+        if raw in ('true', 'false', 'null'):
+            return json.loads(raw)
+        for cast in (int, float):
+            try:
+                value = cast(raw)
+            except ValueError:
+                continue
+            # float() also accepts 'nan' and 'inf', which are no JSON numbers
+            return value if math.isfinite(value) else raw
+        return raw
+
+    def build_condition(self, path, operator, raw):
+        if operator in ('exact', 'ne'):
+            condition = self.equals(path, raw)
+            return ~condition if operator == 'ne' else condition
+        if operator == 'in':
+            condition = Q()
+            for part in raw.split(','):
+                condition |= self.equals(path, part)
+            return condition
+        if operator in ('exists', 'isnull'):
+            exists = self.path_exists(self.json_path(path) + ' ? (@ != null)')
+            wants_exists = raw.lower() in ('1', 'true', 'yes')
+            if operator == 'isnull':
+                wants_exists = not wants_exists
+            return exists if wants_exists else ~exists
+
+        value = self.coerce_value(raw)
+        if operator in ('contains', 'icontains'):
+            flag = ' flag "i"' if operator == 'icontains' else ''
+            predicate = f'@ like_regex {json.dumps(re.escape(str(value)))}{flag}'
+        else:
+            if isinstance(value, (bool, type(None))):
+                raise ValidationError({f'{self.param_prefix}{".".join(path)}__{operator}': 'Expected a number or string.'})
+            predicate = f'@ {self.comparison_operators[operator]} {json.dumps(value)}'
+        return self.path_exists(f'{self.json_path(path)} ? ({predicate})')
+
+    def equals(self, path, raw):
+        """Containment match; numeric-looking values also match their string form."""
+        candidates = [self.coerce_value(raw)]
+        if not isinstance(candidates[0], str):
+            candidates.append(raw)
+        condition = Q()
+        for candidate in candidates:
+            for key in reversed(path):
+                candidate = {key: candidate}
+            condition |= Q(**{f'{self.field_name}__contains': candidate})
+        return condition
+
+    def json_path(self, path):
+        return '$' + ''.join(f'.{json.dumps(key)}' for key in path)
+
+    def path_exists(self, json_path):
+        return Q(JSONPathExists(F(self.field_name), Value(json_path)))
+
+
+class FeatureSearchFilter(SearchFilter):
+    """
+    Full-text search on the `search` parameter using the feature's tsvector column.
+    Supports prefix matching (type-ahead) and orders results by relevance
+    unless an explicit `ordering` is requested.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        return search_features(queryset, request.query_params.get(self.search_param, ''))
+
+
+class NearestFilter(BaseFilterBackend):
+    """
+    K-nearest-neighbour search: `near=<lon>,<lat>&k=<n>[&max_distance=<meters>]`.
+
+    Candidates are ordered by their distance on the sphere with the PostGIS `<->`
+    operator on the GiST index of `geometry::geography`, then re-ranked by their
+    distance on the spheroid, which is annotated as `distance_m`. All other filters (e.g. `at=`) still apply.
+    Must be the last filter backend because it slices the queryset.
+    """
+    near_param = 'near'
+    k_param = 'k'
+    max_distance_param = 'max_distance'
+    default_k = 10
+
+    def get_point(self, request):
+        value = request.query_params.get(self.near_param)
+        if not value:
+            return None
+        try:
+            lon, lat = (float(part) for part in value.split(','))
+        except ValueError:
+            raise ValidationError({self.near_param: 'Expected <lon>,<lat>.'})
+        if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+            raise ValidationError({self.near_param: 'Coordinates out of range.'})
+        return Point(lon, lat, srid=4326)
+
+    def get_k(self, request):
+        max_k = getattr(settings, 'KNN_MAX_K', 1000)
+        try:
+            k = int(request.query_params.get(self.k_param, self.default_k))
+        except ValueError:
+            raise ValidationError({self.k_param: 'Expected an integer.'})
+        if not 1 <= k <= max_k:
+            raise ValidationError({self.k_param: f'Must be between 1 and {max_k}.'})
+        return k
+
+    def get_max_distance(self, request):
+        value = request.query_params.get(self.max_distance_param)
+        if not value:
+            return None
+        try:
+            max_distance = float(value)
+        except ValueError:
+            raise ValidationError({self.max_distance_param: 'Expected a distance in meters.'})
+        if max_distance < 0:
+            raise ValidationError({self.max_distance_param: 'Must not be negative.'})
+        return max_distance
+
+    def filter_queryset(self, request, queryset, view):
+        point = self.get_point(request)
+        if point is None:
+            return queryset
+        k = self.get_k(request)
+        max_distance = self.get_max_distance(request)
+
+        # Sphere and spheroid distances differ by less than 1%, so a few extra candidates
+        # by sphere distance contain the k nearest on the spheroid
+        oversample = getattr(settings, 'KNN_OVERSAMPLE', 4)
+        candidates = (
+            queryset.annotate(knn_distance=GeographyKNNDistance('geometry', geometry_value(point)))
+            .order_by('knn_distance')
+            .values('pk')[:max(k * oversample, k + 50)]
+        )
+        queryset = queryset.filter(pk__in=Subquery(candidates)).annotate(
+            distance_m=GeographyDistance('geometry', geometry_value(point))
+        )
+        if max_distance is not None:
+            queryset = queryset.filter(distance_m__lte=max_distance)
+        return queryset.order_by('distance_m', 'pk')[:k]
@@ -0,0 +1,220 @@
+import copy
+import hashlib
+import shutil
+
+from django.conf import settings
+from django.contrib.gis.db.models import Extent
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from webmap.compression import compress_payload
+from webmap.filters import parse_at
+from webmap.models import Layer
+from webmap.serializers import FeatureSerializer
+from webmap.snapshots import get_snapshot_root, load_manifest, write_manifest, write_variants
+from webmap.tiles import MAX_LATITUDE, render_vector_tile, tiles_for_bbox
+
+
+# Layer types that have no vector features to bake
+NON_VECTOR_LAYER_TYPES = ('raster', 'tile')
+
+
+def parse_zoom_bands(value):
+    """Parse '0-5,6-9,10' into [(0, 5), (6, 9), (10, 10)]."""
+    bands = []
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        low, _, high = part.partition('-')
+        try:
+            low = int(low)
+            high = int(high) if high else low
+        except ValueError:
+            raise CommandError(f"Invalid zoom band: {part!r}")
+        if low > high:
+            raise CommandError(f"Invalid zoom band: {part!r}")
+        bands.append((low, high))
+    return bands
+
+
+def simplify_tolerance(zoom):
+    """Geometry tolerance in degrees, roughly one 256px tile pixel at the given zoom."""
+    return 360.0 / (256 * 2 ** zoom)
+
+
+class Command(BaseCommand):
+    help = (
+        'Renders layers for a set of time steps and zoom bands into static files '
+        '(GeoJSON, MVT and precompressed variants) and writes a manifest keyed by layer version.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--layer', action='append', type=int, dest='layers',
+            help='ID of a layer to bake. Can be given multiple times. Defaults to all vector layers.'
+        )
+        parser.add_argument(
+            '--steps', default=getattr(settings, 'SNAPSHOT_TIME_STEPS', ''),
+            help="Comma-separated time steps (years or ISO dates), e.g. '1800,1850,1900'. "
+                 "Without steps a single 'all' snapshot ignoring time is baked."
+        )
+        parser.add_argument(
+            '--zoom-bands', default=getattr(settings, 'SNAPSHOT_ZOOM_BANDS', '0-5,6-9,10-12'),
+            help="Comma-separated zoom bands, e.g. '0-5,6-9,10-12'."
+        )
+        parser.add_argument(
+            '--formats', default='geojson,mvt',
+            help="Comma-separated output formats: geojson, mvt."
+        )
+        parser.add_argument(
+            '--max-tiles', type=int, default=5000,
+            help='Maximum number of vector tiles per layer and time step.'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Re-bake layers even if the manifest already holds their current version.'
+        )
+        parser.add_argument(
+            '--prune', action='store_true',
+            help='Remove files of older layer versions after baking.'
+        )
+
+    def handle(self, *args, **options):
+        formats = {fmt.strip() for fmt in options['formats'].split(',') if fmt.strip()}
+        unknown = formats - {'geojson', 'mvt'}
+        if unknown:
+            raise CommandError(f"Unknown formats: {', '.join(sorted(unknown))}")
+
+        bands = parse_zoom_bands(options['zoom_bands'])
+        steps = self.parse_steps(options['steps'])
+
+        layers = Layer.objects.select_related('geodata').exclude(layer_type__in=NON_VECTOR_LAYER_TYPES)
+        if options['layers']:
+            layers = layers.filter(pk__in=options['layers'])
+
+        manifest = load_manifest()
+        for layer in layers:
+            if not hasattr(layer, 'geodata'):
+                self.stdout.write(self.style.WARNING(f"Skipping {layer.name}: no geodata."))
+                continue
+
+            version = layer.get_data_version()
+            entry = manifest['layers'].setdefault(str(layer.pk), {'versions': {}})
+            if entry.get('version') == version and not options['force']:
+                self.stdout.write(f"{layer.name} is up to date ({version}).")
+                continue
+
+            self.stdout.write(f"Baking {layer.name} ({version})...")
+            entry['name'] = layer.name
+            entry['version'] = version
+            entry['versions'][version] = self.bake_layer(layer, version, steps, bands, formats, options['max_tiles'])
+
+            if options['prune']:
+                self.prune_versions(entry)
+
+            # Write after each layer so a partial run still leaves a usable manifest
+            write_manifest(manifest)
+
+        self.stdout.write(self.style.SUCCESS('Snapshots baked.'))
+
+    def parse_steps(self, value):
+        """Return a list of (key, datetime or None) tuples."""
+        if not value:
+            return [('all', None)]
+        steps = []
+        for part in value.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                at = parse_at(part)
+            except ValueError as exc:
+                raise CommandError(str(exc))
+            steps.append((at.date().isoformat(), at))
+        return steps
+
+    def bake_layer(self, layer, version, steps, bands, formats, max_tiles):
+        """Bake all steps and bands of a layer and return its manifest entry."""
+        version_dir = f"layer_{layer.pk}/{hashlib.sha1(version.encode('utf-8')).hexdigest()[:12]}"
+        root = get_snapshot_root() / version_dir
+        files = {}
+
+        for key, at in steps:
+            step_files = files.setdefault(key, {})
+            features = layer.geodata.features.select_related('geodata__layer')
+            if at is not None:
+                features = features.visible_at(at)
+
+            if 'geojson' in formats:
+                features = list(features)
+                for low, high in bands:
+                    band = f"{low}-{high}"
+                    payload = self.render_geojson(features, low, high)
+                    write_variants(root / key / f"{band}.geojson", compress_payload(payload))
+                    step_files[band] = f"{key}/{band}.geojson"
+
+            if 'mvt' in formats:
+                count = self.bake_tiles(layer, at, bands, root / key / 'tiles', max_tiles)
+                step_files['tiles'] = f"{key}/tiles/{{z}}/{{x}}/{{y}}.mvt"
+                self.stdout.write(f"  {key}: {count} tiles")
+
+        return {
+            'path': version_dir,
+            'baked_at': timezone.now().isoformat(),
+            'steps': [key for key, _ in steps],
+            'zoom_bands': [f"{low}-{high}" for low, high in bands],
+            'files': files,
+        }
+
+    def render_geojson(self, features, zoom_from, zoom_to):
+        """Render features visible in a zoom band, simplified for the band's most detailed zoom."""
+        tolerance = simplify_tolerance(zoom_to)
+        visible = []
+        for feature in features:
+            if not feature.is_visible_at_zoom(zoom_from, zoom_to):
+                continue
+            if feature.geometry and feature.geometry.geom_type != 'Point':
+                # Simplify a copy, the original geometry is needed for the next band
+                feature = copy.copy(feature)
+                feature.geometry = feature.geometry.simplify(tolerance, preserve_topology=True)
+            visible.append(feature)
+
+        serializer = FeatureSerializer(visible, many=True)
+        return JSONRenderer().render({
+            'type': 'FeatureCollection',
+            'features': serializer.data
+        })
+
+    def bake_tiles(self, layer, at, bands, tiles_dir, max_tiles):
+        """Render vector tiles covering the layer extent for every zoom of every band."""
+        extent = layer.geodata.features.aggregate(extent=Extent('geometry'))['extent']
+        if extent is None:
+            return 0
+        west, south, east, north = extent
+        bbox = (west, max(south, -MAX_LATITUDE), east, min(north, MAX_LATITUDE))
+
+        count = 0
+        for low, high in bands:
+            for z in range(low, high + 1):
+                for x, y in tiles_for_bbox(bbox, z):
+                    if count >= max_tiles:
+                        self.stdout.write(self.style.WARNING(
+                            f"  Tile limit of {max_tiles} reached for {layer.name}, stopping at zoom {z}."
+                        ))
+                        return count
+                    tile = render_vector_tile(layer, z, x, y, at=at)
+                    if tile:
+                        write_variants(tiles_dir / str(z) / str(x) / f"{y}.mvt", compress_payload(tile))
+                    count += 1
+        return count
+
+    def prune_versions(self, entry):
+        """Drop all but the current version from a manifest entry and delete their files."""
+        root = get_snapshot_root()
+        for version in list(entry['versions']):
+            if version == entry['version']:
+                continue
+            shutil.rmtree(root / entry['versions'][version]['path'], ignore_errors=True)
+            del entry['versions'][version]
@@ -0,0 +1,123 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.gis.db.models import Extent
+from django.db import connection
+from django.db.models import Count
+
+from webmap.db import execute_all
+from webmap.filters import parse_at
+from webmap.models import Layer
+from webmap.queries import build_features_query
+from webmap.tiles import build_tile_query, lonlat_to_tile
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the hot queries (layer data, bbox + at, vector tile) '
+        'executed as prepared statements against the same queries planned on every execution.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--layer', type=int, help='ID of the layer to query. Defaults to the largest vector layer.')
+        parser.add_argument('--iterations', type=int, default=200, help='Measured executions per query and mode.')
+        parser.add_argument('--warmup', type=int, default=10, help='Unmeasured executions before each run.')
+        parser.add_argument('--at', default='1900', help='Time used for the `at=` queries.')
+        parser.add_argument('--zoom', type=int, default=8, help='Zoom level of the benchmarked tile.')
+        parser.add_argument(
+            '--force-generic-plan', action='store_true',
+            help='Set plan_cache_mode=force_generic_plan, so prepared statements skip planning from the first run.'
+        )
+
+    def handle(self, *args, **options):
+        layer = self.get_layer(options['layer'])
+        try:
+            at = parse_at(options['at'])
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        extent = layer.geodata.features.aggregate(extent=Extent('geometry'))['extent']
+        if extent is None:
+            raise CommandError(f"Layer {layer.name} has no features.")
+        west, south, east, north = extent
+        # A quarter of the layer extent around its center, like a zoomed-in map view
+        center_lon, center_lat = (west + east) / 2, (south + north) / 2
+        bbox = (
+            center_lon - (east - west) / 4, center_lat - (north - south) / 4,
+            center_lon + (east - west) / 4, center_lat + (north - south) / 4,
+        )
+        x, y = lonlat_to_tile(center_lon, center_lat, options['zoom'])
+
+        queries = {
+            'layer data': build_features_query(geodata_id=layer.geodata.pk),
+            'layer data + at': build_features_query(geodata_id=layer.geodata.pk, at=at),
+            'bbox + at': build_features_query(layer_id=layer.pk, at=at, bbox=bbox),
+            'tile + at': build_tile_query(
+                layer.geodata.pk, options['zoom'], x, y, at=at, layer_name=f"layer_{layer.pk}"
+            ),
+        }
+
+        if options['force_generic_plan']:
+            with connection.cursor() as cursor:
+                cursor.execute("SET plan_cache_mode = force_generic_plan")
+
+        self.stdout.write(f"Layer {layer.name} (id {layer.pk}), {options['iterations']} iterations per mode\n")
+        self.stdout.write(
+            f"{'query':<18}{'plan ms':>9}{'unprepared p50':>16}{'p95':>9}"
+            f"{'prepared p50':>14}{'p95':>9}{'speedup':>9}"
+        )
+        for name, (sql, params) in queries.items():
+            planning = self.planning_time(sql, params)
+            unprepared = self.measure(sql, params, False, options['iterations'], options['warmup'])
+            prepared = self.measure(sql, params, True, options['iterations'], options['warmup'])
+            speedup = statistics.median(unprepared) / statistics.median(prepared)
+            self.stdout.write(
+                f"{name:<18}{planning:>9.2f}"
+                f"{statistics.median(unprepared):>16.2f}{self.percentile(unprepared, 95):>9.2f}"
+                f"{statistics.median(prepared):>14.2f}{self.percentile(prepared, 95):>9.2f}"
+                f"{speedup:>8.2f}x"
+            )
+
+    def get_layer(self, layer_id):
+        layers = Layer.objects.select_related('geodata').filter(geodata__isnull=False)
+        if layer_id is not None:
+            try:
+                return layers.get(pk=layer_id)
+            except Layer.DoesNotExist:
+                raise CommandError(f"Layer {layer_id} not found or without geodata.")
+        layer = (
+            layers.exclude(layer_type__in=('raster', 'tile'))
+            .annotate(num_features=Count('geodata__features'))
+            .order_by('-num_features')
+            .first()
+        )
+        if layer is None:
+            raise CommandError("No vector layer found, load some data first.")
+        return layer
+
+    def planning_time(self, sql, params):
+        """Planning time of the query in milliseconds, as reported by EXPLAIN."""
+        rows = execute_all('EXPLAIN (SUMMARY, FORMAT JSON) ' + sql, params, prepare=False)
+        plan = next(iter(rows[0].values()))
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0].get('Planning Time', 0.0)
+
+    def measure(self, sql, params, prepare, iterations, warmup):
+        """Return the wall-clock time of each execution in milliseconds."""
+        for _ in range(warmup):
+            execute_all(sql, params, prepare=prepare)
+        timings = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            execute_all(sql, params, prepare=prepare)
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings
+
+    @staticmethod
+    def percentile(values, percent):
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
@@ -505,7 +505,8 @@ class Command(BaseCommand):
             layer=layer,
             name="Digital Elevation Model (DEM)",
             description="Elevation data for Germany with 30m resolution.",
-            source_url="https://www.bkg.bund.de/"
+            source_url="https://www.bkg.bund.de/",
+            raster_path="germany_dem.tif",  # Served as XYZ tiles once placed in RASTER_ROOT
         )
         
         # Create a point feature representing the raster data source
@@ -553,7 +554,8 @@ class Command(BaseCommand):
             layer=layer,
             name="Sentinel-2 Satellite Imagery",
             description="High-resolution satellite imagery from the Copernicus Sentinel-2 mission.",
-            source_url="https://www.sentinel-hub.com/"
+            source_url="https://www.sentinel-hub.com/",
+            raster_path="sentinel2_germany.tif",
         )
         
         # Create a point feature representing the satellite data source
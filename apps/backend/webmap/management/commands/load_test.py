@@ -0,0 +1,330 @@
+import http.client
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode, urlsplit
+
+import psycopg
+from django.core.management.base import BaseCommand, CommandError
+
+from webmap.db import get_conninfo
+from webmap.models import Layer
+from webmap.tiles import lonlat_to_tile
+
+
+# Germany, the extent of the sample data
+GERMANY = (5.87, 47.27, 15.04, 55.06)
+
+SCENARIOS = ('scrub', 'pan', 'switch', 'storymap')
+
+CONNECTIONS_SQL = """
+SELECT
+    count(*) AS total,
+    count(*) FILTER (WHERE state = 'active') AS active,
+    count(*) FILTER (WHERE state = 'idle') AS idle,
+    count(*) FILTER (WHERE state LIKE 'idle in transaction%') AS idle_in_transaction,
+    current_setting('max_connections')::int AS max_connections
+FROM pg_stat_activity
+WHERE datname = current_database() AND backend_type = 'client backend' AND pid <> pg_backend_pid()
+"""
+
+
+def parse_weights(value):
+    """Parse 'scrub=4,pan=3,switch=1,storymap=2' into a dict of scenario weights."""
+    weights = {}
+    for part in value.split(','):
+        name, _, weight = part.strip().partition('=')
+        if name not in SCENARIOS:
+            raise CommandError(f"Unknown scenario: {name!r}, expected one of {', '.join(SCENARIOS)}")
+        try:
+            weights[name] = float(weight or 1)
+        except ValueError:
+            raise CommandError(f"Invalid weight: {part!r}")
+    return weights
+
+
+class Stats:
+    """Latencies and errors per endpoint, shared by all virtual users."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.statuses = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, milliseconds, status):
+        with self.lock:
+            self.latencies[endpoint].append(milliseconds)
+            self.statuses[status] += 1
+            if status is None or status >= 400:
+                self.errors[endpoint] += 1
+
+
+class ConnectionSampler(threading.Thread):
+    """Samples the database connections of all clients (not only this process) from pg_stat_activity."""
+
+    def __init__(self, interval):
+        super().__init__(name='load-test-connection-sampler', daemon=True)
+        self.interval = interval
+        self.samples = []
+        self.error = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            with psycopg.connect(get_conninfo(), autocommit=True) as conn:
+                while not self._stopped.is_set():
+                    row = conn.execute(CONNECTIONS_SQL).fetchone()
+                    keys = ('total', 'active', 'idle', 'idle_in_transaction', 'max')
+                    self.samples.append(dict(zip(keys, row)))
+                    self._stopped.wait(self.interval)
+        except psycopg.Error as exc:
+            self.error = exc
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+class VirtualUser:
+    """One map visitor: a persistent HTTP connection working through randomly chosen sessions."""
+
+    def __init__(self, base_url, layers, stats, rng, options):
+        parts = urlsplit(base_url)
+        self.connection_class = (
+            http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        )
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.layers = layers
+        self.stats = stats
+        self.rng = rng
+        self.think_time = options['think_time'] / 1000
+        self.years = (options['from_year'], options['to_year'])
+        self.use_async = options['use_async']
+        self.connection = None
+
+    def get(self, endpoint, path, params=None):
+        url = f"{self.prefix}/{path}"
+        if params:
+            url += '?' + urlencode(params)
+        headers = {'Accept': 'application/json', 'Accept-Encoding': 'br, gzip'}
+        start = time.perf_counter()
+        status = None
+        try:
+            if self.connection is None:
+                self.connection = self.connection_class(self.netloc, timeout=30)
+            self.connection.request('GET', url, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            # Dropped connections count as errors, the next request reconnects
+            self.close()
+        self.stats.record(endpoint, (time.perf_counter() - start) * 1000, status)
+        if self.think_time:
+            time.sleep(self.rng.uniform(0.5, 1.5) * self.think_time)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def data_path(self, layer):
+        return f"async/layers/{layer['id']}/data/" if self.use_async else f"layers/{layer['id']}/data/"
+
+    def tile_path(self, layer, z, x, y):
+        if self.use_async:
+            return f"async/layers/{layer['id']}/tiles/{z}/{x}/{y}/"
+        return f"layers/{layer['id']}/tiles/{z}/{x}/{y}/"
+
+    @staticmethod
+    def view_bbox(lon, lat, zoom):
+        """A bbox of about one screen (4x3 tiles) at `zoom` around a point, as an `in_bbox` value."""
+        width, height = 4 * 360 / 2 ** zoom, 3 * 170 / 2 ** zoom
+        bbox = (lon - width / 2, lat - height / 2, lon + width / 2, lat + height / 2)
+        return ','.join(f"{value:.5f}" for value in bbox)
+
+    def random_point(self):
+        west, south, east, north = GERMANY
+        return self.rng.uniform(west, east), self.rng.uniform(south, north)
+
+    def scrub(self):
+        """Drag the time slider over a layer: many `at=` requests a few years apart."""
+        layer = self.rng.choice(self.layers)
+        year = self.rng.randint(*self.years)
+        step = self.rng.choice((1, 2, 5, 10)) * self.rng.choice((-1, 1))
+        for _ in range(self.rng.randint(10, 30)):
+            year = min(max(year + step, self.years[0]), self.years[1])
+            self.get('layer data + at', self.data_path(layer), {'at': year})
+
+    def pan(self):
+        """Pan and zoom across Germany: the visible tiles plus the features in view."""
+        layer = self.rng.choice(self.layers)
+        zoom = self.rng.randint(6, 10)
+        year = self.rng.randint(*self.years)
+        lon, lat = self.random_point()
+        for _ in range(self.rng.randint(3, 8)):
+            lon += self.rng.uniform(-2, 2) * 360 / 2 ** zoom
+            lat += self.rng.uniform(-1.5, 1.5) * 170 / 2 ** zoom
+            zoom = min(max(zoom + self.rng.choice((-1, 0, 0, 1)), 5), 12)
+            x, y = lonlat_to_tile(lon, lat, zoom)
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    self.get('tile + at', self.tile_path(layer, zoom, x + dx, y + dy), {'at': year})
+            self.get('features bbox + at', 'async/features/' if self.use_async else 'features/', {
+                'geodata__layer': layer['id'], 'at': year, 'in_bbox': self.view_bbox(lon, lat, zoom),
+            })
+
+    def switch(self):
+        """Open the layer list and toggle a few layers on, loading each one completely."""
+        self.get('layer list', 'layers/')
+        for layer in self.rng.sample(self.layers, min(len(self.layers), self.rng.randint(1, 4))):
+            self.get('layer detail', f"layers/{layer['id']}/")
+            self.get('layer data', self.data_path(layer))
+
+    def storymap(self):
+        """Step through the scenes of a story: several layers at increasing times and changing views."""
+        count = min(len(self.layers), self.rng.randint(2, 4))
+        layer_ids = ','.join(str(layer['id']) for layer in self.rng.sample(self.layers, count))
+        year = self.rng.randint(*self.years)
+        for _ in range(self.rng.randint(4, 10)):
+            zoom = self.rng.randint(5, 9)
+            self.get('scene', 'scenes/', {
+                'layers': layer_ids, 'at': year, 'zoom': zoom, 'compact': 'true',
+                'in_bbox': self.view_bbox(*self.random_point(), zoom),
+            })
+            year = min(year + self.rng.randint(10, 50), self.years[1])
+
+    def run(self, weights, deadline):
+        scenarios = list(weights)
+        try:
+            while time.monotonic() < deadline:
+                getattr(self, self.rng.choices(scenarios, [weights[name] for name in scenarios])[0])()
+        finally:
+            self.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulates concurrent map visitors against a running server (runserver, gunicorn or uvicorn) '
+        'and reports throughput, latency percentiles and errors per endpoint plus database connection usage.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/api/', help='Base URL of the API.')
+        parser.add_argument('--users', type=int, default=20, help='Concurrent virtual users.')
+        parser.add_argument('--duration', type=float, default=60, help='Seconds to run.')
+        parser.add_argument('--ramp-up', type=float, default=5, help='Seconds over which the users start.')
+        parser.add_argument(
+            '--think-time', type=float, default=100,
+            help='Average pause between requests of one user in milliseconds, 0 for none.'
+        )
+        parser.add_argument(
+            '--scenarios', default='scrub=4,pan=3,switch=1,storymap=2',
+            help='Weights of the sessions: scrub (time slider), pan, switch (layers) and storymap (scenes).'
+        )
+        parser.add_argument('--from-year', type=int, default=1000, help='Earliest time on the slider.')
+        parser.add_argument('--to-year', type=int, default=2020, help='Latest time on the slider.')
+        parser.add_argument(
+            '--async', action='store_true', dest='use_async',
+            help='Request the /api/async/ variants of layer data, tiles and features.'
+        )
+        parser.add_argument(
+            '--sample-interval', type=float, default=1.0,
+            help='Seconds between samples of pg_stat_activity, 0 to skip connection sampling.'
+        )
+        parser.add_argument('--seed', type=int, help='Random seed, for repeatable sessions.')
+
+    def handle(self, *args, **options):
+        weights = parse_weights(options['scenarios'])
+        if options['from_year'] > options['to_year']:
+            raise CommandError("--from-year must not be after --to-year.")
+        layers = list(
+            Layer.objects.filter(geodata__isnull=False).exclude(layer_type__in=('raster', 'tile'))
+            .order_by('pk').values('id', 'name')
+        )
+        if not layers:
+            raise CommandError("No vector layer found, load some data first.")
+
+        stats = Stats()
+        sampler = ConnectionSampler(options['sample_interval']) if options['sample_interval'] > 0 else None
+        if sampler is not None:
+            sampler.start()
+
+        self.stdout.write(
+            f"{options['users']} users against {options['url']} for {options['duration']:.0f}s, "
+            f"{len(layers)} layers, scenarios {options['scenarios']}"
+        )
+        seed = random.Random(options['seed'])
+        start = time.monotonic()
+        deadline = start + options['ramp_up'] + options['duration']
+        threads = []
+        for index in range(options['users']):
+            user = VirtualUser(options['url'], layers, stats, random.Random(seed.random()), options)
+            thread = threading.Thread(
+                target=self.run_user, args=(user, weights, deadline, index * options['ramp_up'] / options['users']),
+                name=f'load-test-user-{index}', daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - start
+        if sampler is not None:
+            sampler.stop()
+
+        self.report(stats, elapsed, sampler)
+
+    @staticmethod
+    def run_user(user, weights, deadline, delay):
+        time.sleep(delay)
+        user.run(weights, deadline)
+
+    def report(self, stats, elapsed, sampler):
+        total = sum(len(latencies) for latencies in stats.latencies.values())
+        errors = sum(stats.errors.values())
+        self.stdout.write(
+            f"\n{total} requests in {elapsed:.1f}s: {total / elapsed:.1f} req/s, "
+            f"{errors} errors ({errors / max(total, 1):.1%})\n"
+        )
+        self.stdout.write(
+            f"{'endpoint':<22}{'requests':>9}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+            f"{'max ms':>9}{'errors':>8}"
+        )
+        for endpoint in sorted(stats.latencies):
+            latencies = stats.latencies[endpoint]
+            self.stdout.write(
+                f"{endpoint:<22}{len(latencies):>9}{len(latencies) / elapsed:>8.1f}"
+                f"{statistics.median(latencies):>9.1f}{self.percentile(latencies, 95):>9.1f}"
+                f"{self.percentile(latencies, 99):>9.1f}{max(latencies):>9.1f}"
+                f"{stats.errors[endpoint] / len(latencies):>8.1%}"
+            )
+        statuses = ', '.join(
+            f"{status or 'failed'}: {count}"
+            for status, count in sorted(stats.statuses.items(), key=lambda item: item[0] or 0)
+        )
+        self.stdout.write(f"\nStatus codes: {statuses}")
+
+        if sampler is None:
+            return
+        if sampler.error is not None:
+            self.stdout.write(self.style.WARNING(f"Database connections were not sampled: {sampler.error}"))
+        elif sampler.samples:
+            samples = sampler.samples
+            self.stdout.write(
+                f"Database connections ({len(samples)} samples, max_connections {samples[-1]['max']}): "
+                f"total max {max(sample['total'] for sample in samples)} "
+                f"avg {statistics.mean(sample['total'] for sample in samples):.1f}, "
+                f"active max {max(sample['active'] for sample in samples)}, "
+                f"idle max {max(sample['idle'] for sample in samples)}, "
+                f"idle in transaction max {max(sample['idle_in_transaction'] for sample in samples)}"
+            )
+
+    @staticmethod
+    def percentile(values, percent):
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[index]
@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from webmap.models import GeoData
+from webmap.partitioning import (
+    DEFAULT_PARTITION, FEATURES_TABLE, STRATEGIES, PartitioningError, add_layer_partition, drop_layer_partition,
+    get_partition_tree, get_strategy, layer_partition_name, parse_eras, partition_features, swap_layer_partition,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Manages the partitioning of the features table by dataset (see webmap/partitioning.py). '
+        'Without options the current partitions are listed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--convert', action='store_true',
+            help='Convert the features table into a partitioned table (locks the table while copying).'
+        )
+        parser.add_argument(
+            '--strategy', choices=STRATEGIES, default=getattr(settings, 'FEATURES_PARTITIONING', '') or 'list',
+            help='Partitioning strategy for --convert: one partition per dataset (list) or a fixed number (hash).'
+        )
+        parser.add_argument(
+            '--modulus', type=int, default=getattr(settings, 'FEATURES_PARTITION_MODULUS', 8),
+            help='Number of partitions of the hash strategy.'
+        )
+        parser.add_argument(
+            '--eras', default=getattr(settings, 'FEATURES_PARTITION_ERAS', ''),
+            help="Comma-separated time_from boundaries to sub-partition by, e.g. '1800,1871,1945'."
+        )
+        parser.add_argument(
+            '--sync', action='store_true',
+            help='List strategy: create partitions for new datasets and drop empty ones of deleted datasets.'
+        )
+        parser.add_argument(
+            '--swap', type=int, metavar='GEODATA_ID',
+            help='Replace all features of a dataset with the rows of --source-table in a partition swap.'
+        )
+        parser.add_argument(
+            '--source-table',
+            help='Table holding the new features for --swap (needs a geometry column).'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if options['convert']:
+                self.convert(options)
+            if options['sync']:
+                self.sync()
+            if options['swap'] is not None:
+                self.swap(options['swap'], options['source_table'])
+        except PartitioningError as exc:
+            raise CommandError(str(exc))
+        self.show_status()
+
+    def convert(self, options):
+        eras = parse_eras(options['eras'])
+        if options['modulus'] < 1:
+            raise CommandError("The modulus must be at least 1.")
+        self.stdout.write(f"Partitioning features by geodata_id ({options['strategy']})...")
+        partition_features(strategy=options['strategy'], modulus=options['modulus'], eras=eras)
+        self.stdout.write(self.style.SUCCESS('Features table partitioned.'))
+
+    def sync(self):
+        with connection.cursor() as cursor:
+            if get_strategy(cursor) != 'list':
+                raise CommandError("--sync requires the list strategy.")
+            partitions = {partition['name'] for partition in get_partition_tree(cursor) if partition['level'] == 1}
+
+        geodata_ids = set(GeoData.objects.values_list('pk', flat=True))
+        for geodata_id in sorted(geodata_ids):
+            if layer_partition_name(geodata_id) not in partitions and add_layer_partition(geodata_id):
+                self.stdout.write(f"Created partition {layer_partition_name(geodata_id)}.")
+
+        prefix = f"{FEATURES_TABLE}_g"
+        for name in sorted(partitions - {DEFAULT_PARTITION}):
+            suffix = name[len(prefix):]
+            if name.startswith(prefix) and suffix.isdigit() and int(suffix) not in geodata_ids:
+                if drop_layer_partition(int(suffix)):
+                    self.stdout.write(f"Dropped partition {name} of a deleted dataset.")
+                else:
+                    self.stdout.write(self.style.WARNING(f"Partition {name} of a deleted dataset still holds rows."))
+
+    def swap(self, geodata_id, source_table):
+        if not source_table:
+            raise CommandError("--swap requires --source-table.")
+        if not GeoData.objects.filter(pk=geodata_id).exists():
+            raise CommandError(f"GeoData {geodata_id} does not exist.")
+        count = swap_layer_partition(geodata_id, source_table)
+        self.stdout.write(self.style.SUCCESS(f"Swapped in {count} features for geodata {geodata_id}."))
+
+    def show_status(self):
+        with connection.cursor() as cursor:
+            strategy = get_strategy(cursor)
+            if strategy is None:
+                self.stdout.write("The features table is not partitioned.")
+                return
+            partitions = get_partition_tree(cursor)
+
+        self.stdout.write(f"features is partitioned by geodata_id ({strategy}), {len(partitions)} partitions:")
+        for partition in partitions:
+            indent = '  ' * partition['level']
+            rows = max(partition['estimated_rows'], 0)
+            self.stdout.write(
+                f"{indent}{partition['name']:<32} {partition['bound']:<60} "
+                f"~{rows} rows, {partition['size'] // 1024} kB"
+            )
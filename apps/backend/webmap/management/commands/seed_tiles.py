@@ -0,0 +1,176 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from webmap.compression import build_entry
+from webmap.filters import parse_at
+from webmap.management.commands.bake_snapshots import NON_VECTOR_LAYER_TYPES, parse_zoom_bands
+from webmap.models import Layer
+from webmap.rasters import RasterTileError, get_raster_path, get_raster_version, render_raster_tile
+from webmap.renderers import MVTRenderer
+from webmap.tilecache import get_tile_cache, get_time_bucket, tile_key
+from webmap.tiles import MAX_LATITUDE, render_vector_tile, tiles_for_bbox
+
+
+# Germany, the extent of the sample data
+DEFAULT_BBOX = '5.87,47.27,15.04,55.06'
+
+
+def parse_bbox(value):
+    try:
+        west, south, east, north = (float(part) for part in value.split(','))
+    except ValueError:
+        raise CommandError(f"Invalid bbox: {value!r}, expected west,south,east,north")
+    if west >= east or south >= north:
+        raise CommandError(f"Invalid bbox: {value!r}, expected west,south,east,north")
+    return west, max(south, -MAX_LATITUDE), east, min(north, MAX_LATITUDE)
+
+
+class Command(BaseCommand):
+    help = (
+        'Pre-renders vector and raster tiles of zoom ranges over a bbox into the tile cache '
+        '(TILE_CACHE), so the first visitors of a view do not wait for ST_AsMVT or a GDAL warp.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--layer', action='append', type=int, dest='layers',
+            help='ID of a layer to seed. Can be given multiple times. Defaults to all layers.'
+        )
+        parser.add_argument(
+            '--bbox', default=DEFAULT_BBOX,
+            help=f"Area to seed as west,south,east,north in EPSG:4326. Defaults to Germany ({DEFAULT_BBOX})."
+        )
+        parser.add_argument(
+            '--zoom', default='0-8',
+            help="Zoom range(s) to seed, e.g. '0-8' or '0-5,10'."
+        )
+        parser.add_argument(
+            '--at', default='',
+            help="Comma-separated times (years or ISO dates) to seed vector tiles for, e.g. '1800,1900'. "
+                 "Without times the tiles ignoring time are seeded."
+        )
+        parser.add_argument(
+            '--format', choices=['png', 'webp'], default='png',
+            help='Image format of raster tiles.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Tiles rendered in parallel, each worker holds one database connection.'
+        )
+        parser.add_argument(
+            '--max-tiles', type=int, default=20000,
+            help='Maximum number of tiles per layer.'
+        )
+
+    def handle(self, *args, **options):
+        bbox = parse_bbox(options['bbox'])
+        zooms = sorted({z for low, high in parse_zoom_bands(options['zoom']) for z in range(low, high + 1)})
+        times = self.parse_times(options['at'])
+        workers = max(options['workers'], 1)
+
+        layers = Layer.objects.select_related('geodata').order_by('pk')
+        if options['layers']:
+            layers = layers.filter(pk__in=options['layers'])
+
+        cache = get_tile_cache()
+        for layer in layers:
+            if not hasattr(layer, 'geodata'):
+                self.stdout.write(self.style.WARNING(f"Skipping {layer.name}: no geodata."))
+                continue
+
+            if layer.layer_type in NON_VECTOR_LAYER_TYPES:
+                jobs = self.raster_jobs(layer, options['format'])
+            else:
+                jobs = self.vector_jobs(layer, times)
+            if jobs is None:
+                continue
+
+            tiles = []
+            for key_for, content_type, render in jobs:
+                for z in zooms:
+                    for x, y in tiles_for_bbox(bbox, z):
+                        tiles.append((key_for(z, x, y), content_type, render, z, x, y))
+            tiles = list({tile[0]: tile for tile in tiles}.values())  # Times in one bucket share tiles
+            if len(tiles) > options['max_tiles']:
+                self.stdout.write(self.style.WARNING(
+                    f"  {len(tiles)} tiles for {layer.name}, seeding only the first {options['max_tiles']}."
+                ))
+                tiles = tiles[:options['max_tiles']]
+
+            missing = [tile for tile in tiles if not cache.has(tile[0], tile[1])]
+            self.stdout.write(f"Seeding {layer.name}: {len(missing)} of {len(tiles)} tiles...")
+            failed = self.seed(cache, missing, workers)
+            self.stdout.write(
+                f"  {len(missing) - failed} rendered, {len(tiles) - len(missing)} already cached, {failed} failed"
+            )
+
+        self.stdout.write(self.style.SUCCESS('Tiles seeded.'))
+
+    def parse_times(self, value):
+        if not value:
+            return [None]
+        times = []
+        for part in value.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                times.append(parse_at(part))
+            except ValueError as exc:
+                raise CommandError(str(exc))
+        return times
+
+    def vector_jobs(self, layer, times):
+        """Return (key function, content type, render function) for every time of a vector layer."""
+        version = layer.get_data_version()
+        jobs = []
+        for at in times:
+            bucket = get_time_bucket(layer.geodata.pk, version, at)
+            jobs.append((
+                lambda z, x, y, bucket=bucket: tile_key('vector', layer.pk, version, z, x, y, bucket),
+                MVTRenderer.media_type,
+                lambda z, x, y, at=at: render_vector_tile(layer, z, x, y, at=at),
+            ))
+        return jobs
+
+    def raster_jobs(self, layer, image_format):
+        """Same as vector_jobs for a raster layer, or None if its GeoTIFF is missing."""
+        try:
+            path = get_raster_path(layer.geodata)
+        except RasterTileError as exc:
+            self.stdout.write(self.style.WARNING(f"Skipping {layer.name}: {exc}"))
+            return None
+        # Same key as the raster view
+        version = f"{layer.updated_at.timestamp():.6f}-{get_raster_version(path)}"
+        return [(
+            lambda z, x, y: tile_key('raster', layer.pk, version, z, x, y, image_format=image_format),
+            f"image/{image_format}",
+            lambda z, x, y: render_raster_tile(path, layer.style_config, z, x, y, image_format),
+        )]
+
+    def seed(self, cache, tiles, workers):
+        """Render tiles on `workers` threads, each with a stripe of the tiles. Returns the number of failures."""
+        if workers == 1:
+            return self.render_tiles(cache, tiles)
+
+        def run(stripe):
+            try:
+                return self.render_tiles(cache, stripe)
+            finally:
+                # Django opened a connection for this worker thread
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return sum(executor.map(run, [tiles[index::workers] for index in range(workers)]))
+
+    def render_tiles(self, cache, tiles):
+        failed = 0
+        for key, content_type, render, z, x, y in tiles:
+            try:
+                cache.set(key, build_entry(render(z, x, y), content_type), content_type)
+            except Exception as exc:
+                self.stderr.write(f"  Tile {z}/{x}/{y} failed: {exc}")
+                failed += 1
+        return failed
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 09:12
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webmap', '0006_remove_feature_attributes_feature__attributes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='feature',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['_attributes'], name='features_attrs_path_gin', opclasses=['jsonb_path_ops']),
+        ),
+    ]
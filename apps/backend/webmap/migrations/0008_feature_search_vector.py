@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-19 10:05
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+import webmap.search
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webmap', '0007_feature_attributes_gin_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feature',
+            name='search_vector',
+            field=models.GeneratedField(
+                db_persist=True,
+                expression=(
+                    django.contrib.postgres.search.SearchVector('name', config='german', weight='A')
+                    + django.contrib.postgres.search.SearchVector('name', config='english', weight='A')
+                    + django.contrib.postgres.search.SearchVector('description', config='german', weight='B')
+                    + django.contrib.postgres.search.SearchVector('description', config='english', weight='B')
+                    + webmap.search.AttributesSearchVector('_attributes')
+                ),
+                output_field=django.contrib.postgres.search.SearchVectorField(),
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='feature',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='features_search_gin'),
+        ),
+    ]
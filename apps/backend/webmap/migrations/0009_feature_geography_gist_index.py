@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:20
+
+from django.db import migrations
+
+
+# Nearest-neighbour search orders by `geometry::geography <-> point` (see NearestFilter),
+# which PostGIS only answers from a GiST index on the same expression
+GEOGRAPHY_INDEX_SQL = "CREATE INDEX IF NOT EXISTS features_geography_gist ON features USING gist ((geometry::geography))"
+
+DROP_GEOGRAPHY_INDEX_SQL = "DROP INDEX IF EXISTS features_geography_gist"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webmap', '0008_feature_search_vector'),
+    ]
+
+    operations = [
+        migrations.RunSQL(GEOGRAPHY_INDEX_SQL, DROP_GEOGRAPHY_INDEX_SQL),
+    ]
@@ -0,0 +1,148 @@
+# Generated by Django 5.2.4 on 2026-10-19 11:20
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+# Computes the derived columns on every write, so new and edited features never keep NULL or
+# stale values. infra/trigger.sql carries the same definition.
+GEOMETRY_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION compute_feature_geometry_metrics()
+RETURNS TRIGGER AS $$
+DECLARE
+    dimension integer;
+BEGIN
+    IF NEW.geometry IS NULL THEN
+        NEW.geom_type := '';
+        NEW.num_points := NULL;
+        NEW.bbox := NULL;
+        NEW.centroid := NULL;
+        NEW.label_point := NULL;
+        NEW.area_m2 := NULL;
+        NEW.length_m := NULL;
+        NEW.geometry_repaired := false;
+        RETURN NEW;
+    END IF;
+
+    -- Repair invalid geometries and remember that we did
+    NEW.geometry_repaired := NOT ST_IsValid(NEW.geometry);
+    IF NEW.geometry_repaired THEN
+        NEW.geometry := ST_MakeValid(NEW.geometry);
+    END IF;
+
+    dimension := ST_Dimension(NEW.geometry);
+
+    NEW.geom_type := substr(ST_GeometryType(NEW.geometry), 4);  -- 'ST_Polygon' -> 'Polygon'
+    NEW.num_points := ST_NPoints(NEW.geometry);
+    NEW.bbox := ST_Envelope(NEW.geometry);
+    NEW.centroid := ST_Centroid(NEW.geometry);
+
+    IF NEW.geom_type IN ('Polygon', 'MultiPolygon') THEN
+        -- Pole of inaccessibility: the label stays inside concave polygons
+        NEW.label_point := (ST_MaximumInscribedCircle(NEW.geometry)).center;
+    ELSE
+        NEW.label_point := ST_PointOnSurface(NEW.geometry);
+    END IF;
+
+    IF dimension = 2 THEN
+        NEW.area_m2 := ST_Area(NEW.geometry::geography);
+        NEW.length_m := ST_Perimeter(NEW.geometry::geography);
+    ELSIF dimension = 1 THEN
+        NEW.area_m2 := 0;
+        NEW.length_m := ST_Length(NEW.geometry::geography);
+    ELSE
+        NEW.area_m2 := 0;
+        NEW.length_m := 0;
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS features_geometry_trigger ON features;
+
+CREATE TRIGGER features_geometry_trigger
+BEFORE INSERT OR UPDATE OF geometry ON features
+FOR EACH ROW EXECUTE FUNCTION compute_feature_geometry_metrics();
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS features_geometry_trigger ON features;
+DROP FUNCTION IF EXISTS compute_feature_geometry_metrics();
+"""
+
+# Backfill existing rows; new writes are handled by the trigger above
+BACKFILL_SQL = """
+UPDATE features SET geometry = ST_MakeValid(geometry), geometry_repaired = true
+WHERE NOT ST_IsValid(geometry);
+
+UPDATE features SET
+    geom_type = substr(ST_GeometryType(geometry), 4),
+    num_points = ST_NPoints(geometry),
+    bbox = ST_Envelope(geometry),
+    centroid = ST_Centroid(geometry),
+    label_point = CASE
+        WHEN GeometryType(geometry) IN ('POLYGON', 'MULTIPOLYGON')
+        THEN (ST_MaximumInscribedCircle(geometry)).center
+        ELSE ST_PointOnSurface(geometry)
+    END,
+    area_m2 = CASE WHEN ST_Dimension(geometry) = 2 THEN ST_Area(geometry::geography) ELSE 0 END,
+    length_m = CASE ST_Dimension(geometry)
+        WHEN 2 THEN ST_Perimeter(geometry::geography)
+        WHEN 1 THEN ST_Length(geometry::geography)
+        ELSE 0
+    END
+WHERE geometry IS NOT NULL;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webmap', '0009_feature_geography_gist_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feature',
+            name='geom_type',
+            field=models.CharField(blank=True, editable=False, help_text="Geometry type (e.g. 'Point', 'MultiPolygon')", max_length=30),
+        ),
+        migrations.AddField(
+            model_name='feature',
+            name='num_points',
+            field=models.IntegerField(blank=True, editable=False, help_text='Number of vertices', null=True),
+        ),
+        migrations.AddField(
+            model_name='feature',
+            name='bbox',
+            field=django.contrib.gis.db.models.fields.GeometryField(blank=True, editable=False, help_text='Bounding box of the geometry', null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='feature',
+            name='centroid',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, editable=False, help_text='Centroid of the geometry', null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='feature',
+            name='label_point',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, editable=False, help_text='Label position (pole of inaccessibility for polygons, a point on the geometry otherwise)', null=True, srid=4326),
+        ),
+        migrations.AddField(
+            model_name='feature',
+            name='area_m2',
+            field=models.FloatField(blank=True, editable=False, help_text='Area in square meters', null=True),
+        ),
+        migrations.AddField(
+            model_name='feature',
+            name='length_m',
+            field=models.FloatField(blank=True, editable=False, help_text='Length in meters (perimeter for polygons)', null=True),
+        ),
+        migrations.AddField(
+            model_name='feature',
+            name='geometry_repaired',
+            field=models.BooleanField(default=False, editable=False, help_text='True if the geometry was invalid and has been repaired with ST_MakeValid'),
+        ),
+        migrations.RunSQL(GEOMETRY_TRIGGER_SQL, DROP_TRIGGER_SQL),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
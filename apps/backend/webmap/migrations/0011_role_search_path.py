@@ -0,0 +1,33 @@
+# Generated by Django 5.2.4 on 2026-10-19 14:05
+
+from django.db import migrations
+
+
+SEARCH_PATH = 'public, postgis'
+
+
+def set_search_path(apps, schema_editor):
+    """
+    Store the search_path as a default of the application role in this database,
+    instead of sending `-c search_path=...` with every new connection.
+    """
+    connection = schema_editor.connection
+    database = connection.ops.quote_name(connection.settings_dict['NAME'])
+    schema_editor.execute(f"ALTER ROLE CURRENT_USER IN DATABASE {database} SET search_path = {SEARCH_PATH}")
+
+
+def reset_search_path(apps, schema_editor):
+    connection = schema_editor.connection
+    database = connection.ops.quote_name(connection.settings_dict['NAME'])
+    schema_editor.execute(f"ALTER ROLE CURRENT_USER IN DATABASE {database} RESET search_path")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webmap', '0010_feature_derived_geometry_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(set_search_path, reset_search_path),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-19 15:30
+
+from django.conf import settings
+from django.db import migrations
+
+
+def partition(apps, schema_editor):
+    """Opt-in: only partitions `features` if FEATURES_PARTITIONING is set."""
+    from webmap.partitioning import parse_eras, partition_features
+
+    strategy = getattr(settings, 'FEATURES_PARTITIONING', '')
+    if not strategy:
+        return
+    partition_features(
+        strategy=strategy,
+        modulus=getattr(settings, 'FEATURES_PARTITION_MODULUS', 8),
+        eras=parse_eras(getattr(settings, 'FEATURES_PARTITION_ERAS', '')),
+        connection=schema_editor.connection,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webmap', '0011_role_search_path'),
+    ]
+
+    operations = [
+        # Not reversible automatically: a partitioned table stays partitioned
+        migrations.RunPython(partition, migrations.RunPython.noop),
+    ]
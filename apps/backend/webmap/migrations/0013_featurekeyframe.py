@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-19 16:10
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webmap', '0012_partition_features'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeatureKeyframe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time', models.DateTimeField(help_text='Point in time of this geometry')),
+                ('geometry', django.contrib.gis.db.models.fields.GeometryField(help_text='Geometry at this point in time. Keyframes with the same geometry type and number of vertices are interpolated vertex by vertex, others switch at the next keyframe.', srid=4326)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('feature', models.ForeignKey(db_constraint=False, help_text='The feature that moves', on_delete=django.db.models.deletion.CASCADE, related_name='keyframes', to='webmap.feature')),
+            ],
+            options={
+                'db_table': 'feature_keyframes',
+                'ordering': ['feature', 'time'],
+                'constraints': [models.UniqueConstraint(fields=('feature', 'time'), name='feature_keyframes_feature_time_unique')],
+            },
+        ),
+    ]
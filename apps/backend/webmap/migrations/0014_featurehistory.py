@@ -0,0 +1,98 @@
+# Generated by Django 5.2.4 on 2026-10-19 17:05
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+# Unlike the triggers in infra/trigger.sql this one is installed here: history must not
+# depend on a manual step. infra/trigger.sql carries the same definition for re-installs.
+HISTORY_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION record_feature_history()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Rows moved between partitions (webmap/partitioning.py) are not edits
+    IF current_setting('webmap.skip_history', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN
+        RETURN NULL;
+    END IF;
+
+    -- A feature moved to another dataset is deleted from the old one
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.geodata_id IS DISTINCT FROM NEW.geodata_id) THEN
+        INSERT INTO features_history (feature_id, geodata_id, operation, changed_at, txid, geometry, label_point, data)
+        VALUES (
+            OLD.id, OLD.geodata_id, 'D', transaction_timestamp(), txid_current(), OLD.geometry, OLD.label_point,
+            to_jsonb(OLD) - '{geometry,label_point,bbox,centroid,search_vector}'::text[]
+        );
+    END IF;
+
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO features_history (feature_id, geodata_id, operation, changed_at, txid, geometry, label_point, data)
+        VALUES (
+            NEW.id, NEW.geodata_id,
+            CASE WHEN TG_OP = 'UPDATE' AND OLD.geodata_id = NEW.geodata_id THEN 'U' ELSE 'I' END,
+            transaction_timestamp(), txid_current(), NEW.geometry, NEW.label_point,
+            to_jsonb(NEW) - '{geometry,label_point,bbox,centroid,search_vector}'::text[]
+        );
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS features_history_trigger ON features;
+
+CREATE TRIGGER features_history_trigger
+AFTER INSERT OR UPDATE OR DELETE ON features
+FOR EACH ROW EXECUTE FUNCTION record_feature_history();
+"""
+
+# Existing rows enter the history as inserted at their last update
+SEED_SQL = """
+INSERT INTO features_history (feature_id, geodata_id, operation, changed_at, txid, geometry, label_point, data)
+SELECT
+    f.id, f.geodata_id, 'I', COALESCE(f.updated_at, f.created_at, now()), txid_current(), f.geometry, f.label_point,
+    to_jsonb(f) - '{geometry,label_point,bbox,centroid,search_vector}'::text[]
+FROM features f
+ORDER BY COALESCE(f.updated_at, f.created_at, now()), f.id;
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS features_history_trigger ON features;
+DROP FUNCTION IF EXISTS record_feature_history();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webmap', '0013_featurekeyframe'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeatureHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('feature_id', models.BigIntegerField(help_text='ID of the changed feature')),
+                ('geodata_id', models.BigIntegerField(help_text='Dataset the row version belongs to')),
+                ('operation', models.CharField(choices=[('I', 'Insert'), ('U', 'Update'), ('D', 'Delete')], max_length=1)),
+                ('changed_at', models.DateTimeField(help_text='Start time of the writing transaction')),
+                ('txid', models.BigIntegerField(help_text='ID of the writing transaction')),
+                ('geometry', django.contrib.gis.db.models.fields.GeometryField(blank=True, null=True, srid=4326)),
+                ('label_point', django.contrib.gis.db.models.fields.PointField(blank=True, null=True, srid=4326)),
+                ('data', models.JSONField(help_text='All other columns of the row version')),
+            ],
+            options={
+                'db_table': 'features_history',
+                'indexes': [
+                    django.contrib.postgres.indexes.BrinIndex(fields=['changed_at'], name='features_history_changed_brin'),
+                    models.Index(fields=['geodata_id', 'feature_id', '-changed_at', '-id'], name='features_history_version_idx'),
+                ],
+            },
+        ),
+        migrations.RunSQL(SEED_SQL, migrations.RunSQL.noop),
+        migrations.RunSQL(HISTORY_TRIGGER_SQL, DROP_TRIGGER_SQL),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.4 on 2026-10-19 17:40
+
+from django.db import migrations
+
+
+# Live change events (webmap/notifications.py). infra/trigger.sql carries the same definition.
+NOTIFY_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION notify_feature_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Rows moved between partitions (webmap/partitioning.py) are not edits
+    IF current_setting('webmap.skip_history', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN
+        RETURN NULL;
+    END IF;
+
+    -- A feature moved to another dataset is deleted from the old one
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.geodata_id IS DISTINCT FROM NEW.geodata_id) THEN
+        PERFORM pg_notify('feature_changes', json_build_object(
+            'layer_id', (SELECT layer_id FROM geodata WHERE id = OLD.geodata_id),
+            'geodata_id', OLD.geodata_id,
+            'feature_id', OLD.id,
+            'operation', 'delete'
+        )::text);
+    END IF;
+
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM pg_notify('feature_changes', json_build_object(
+            'layer_id', (SELECT layer_id FROM geodata WHERE id = NEW.geodata_id),
+            'geodata_id', NEW.geodata_id,
+            'feature_id', NEW.id,
+            'operation', CASE WHEN TG_OP = 'UPDATE' AND OLD.geodata_id = NEW.geodata_id THEN 'update' ELSE 'insert' END
+        )::text);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS features_notify_trigger ON features;
+
+CREATE TRIGGER features_notify_trigger
+AFTER INSERT OR UPDATE OR DELETE ON features
+FOR EACH ROW EXECUTE FUNCTION notify_feature_change();
+"""
+
+DROP_TRIGGER_SQL = """
+DROP TRIGGER IF EXISTS features_notify_trigger ON features;
+DROP FUNCTION IF EXISTS notify_feature_change();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webmap', '0014_featurehistory'),
+    ]
+
+    operations = [
+        migrations.RunSQL(NOTIFY_TRIGGER_SQL, DROP_TRIGGER_SQL),
+    ]
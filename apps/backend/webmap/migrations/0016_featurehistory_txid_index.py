@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-19 18:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webmap', '0015_feature_notify_trigger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='featurehistory',
+            index=models.Index(fields=['geodata_id', 'txid'], name='features_history_txid_idx'),
+        ),
+    ]
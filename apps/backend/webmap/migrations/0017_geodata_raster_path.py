@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('webmap', '0016_featurehistory_txid_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='geodata',
+            name='raster_path',
+            field=models.CharField(blank=True, help_text='GeoTIFF served as XYZ tiles for raster layers, relative to RASTER_ROOT', max_length=500),
+        ),
+    ]
@@ -1,8 +1,13 @@
 from django.contrib.gis.db import models as gis_models
+from django.contrib.postgres.indexes import BrinIndex, GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Count, Max, Q
 from django.core.validators import MinValueValidator, MaxValueValidator
 import json
 
+from .search import build_search_vector
+
 
 class Layer(models.Model):
     """
@@ -43,6 +48,34 @@ class Layer(models.Model):
     def __str__(self):
         return f"{self.name} ({self.layer_type})"
 
+    def get_data_version(self):
+        """
+        Return a short token that changes whenever the layer or its features change.
+        Used as part of cache keys so cached payloads are never served stale.
+        """
+        return Layer.get_data_versions([self])[self.pk]
+
+    @staticmethod
+    def get_data_versions(layers):
+        """Return a dict of layer pk -> data version for several layers, using a single query."""
+        stats = {
+            row['geodata__layer']: row
+            for row in Feature.objects.filter(geodata__layer__in=layers)
+            .values('geodata__layer')
+            .annotate(count=Count('id'), last_update=Max('updated_at'))
+        }
+        versions = {}
+        for layer in layers:
+            row = stats.get(layer.pk, {'count': 0, 'last_update': None})
+            versions[layer.pk] = Layer.format_data_version(layer.updated_at, row['count'], row['last_update'])
+        return versions
+
+    @staticmethod
+    def format_data_version(updated_at, count, last_update):
+        """Format a data version from the layer's `updated_at` and the count and latest `updated_at` of its features."""
+        last_update = last_update.timestamp() if last_update else 0
+        return f"{updated_at.timestamp():.6f}-{count}-{last_update:.6f}"
+
 
 class GeoData(models.Model):
     """
@@ -64,6 +97,11 @@ class GeoData(models.Model):
         blank=True,
         help_text="URL of the original data source"
     )
+    raster_path = models.CharField(
+        max_length=500,
+        blank=True,
+        help_text="GeoTIFF served as XYZ tiles for raster layers, relative to RASTER_ROOT"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -76,6 +114,17 @@ class GeoData(models.Model):
         return f"{self.name} (Layer: {self.layer.name})"
 
 
+class FeatureQuerySet(models.QuerySet):
+    """Custom queryset with temporal helpers for features."""
+
+    def visible_at(self, at):
+        """Return features whose validity interval contains `at`. Open ends (NULL) always match."""
+        return self.filter(
+            Q(time_from__isnull=True) | Q(time_from__lte=at),
+            Q(time_to__isnull=True) | Q(time_to__gte=at),
+        )
+
+
 class Feature(gis_models.Model):
     """
     Represents individual geographic features (points, lines, polygons) within a dataset.
@@ -147,9 +196,48 @@ class Feature(gis_models.Model):
         blank=True,
         help_text="Zoom level range where feature is visible (e.g., '5-15')"
     )
+
+    # Derived geometry properties, computed by the database trigger when `geometry` changes
+    # (see infra/trigger.sql). Read-only from Django's point of view.
+    geom_type = models.CharField(
+        max_length=30,
+        blank=True,
+        editable=False,
+        help_text="Geometry type (e.g. 'Point', 'MultiPolygon')"
+    )
+    num_points = models.IntegerField(null=True, blank=True, editable=False, help_text="Number of vertices")
+    bbox = gis_models.GeometryField(null=True, blank=True, editable=False, help_text="Bounding box of the geometry")
+    centroid = gis_models.PointField(null=True, blank=True, editable=False, help_text="Centroid of the geometry")
+    label_point = gis_models.PointField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Label position (pole of inaccessibility for polygons, a point on the geometry otherwise)"
+    )
+    area_m2 = models.FloatField(null=True, blank=True, editable=False, help_text="Area in square meters")
+    length_m = models.FloatField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Length in meters (perimeter for polygons)"
+    )
+    geometry_repaired = models.BooleanField(
+        default=False,
+        editable=False,
+        help_text="True if the geometry was invalid and has been repaired with ST_MakeValid"
+    )
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    # Weighted full-text document, maintained by PostgreSQL (see webmap/search.py)
+    search_vector = models.GeneratedField(
+        expression=build_search_vector(),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
+
+    objects = FeatureQuerySet.as_manager()
     
     class Meta:
         db_table = 'features'
@@ -158,6 +246,9 @@ class Feature(gis_models.Model):
             models.Index(fields=['geodata', 'created_at']),
             models.Index(fields=['time_from', 'time_to']), # Index for temporal queries
             models.Index(fields=['name']),  # For name searches
+            # For attr.<key> equality filters (JSONB containment)
+            GinIndex(fields=['_attributes'], opclasses=['jsonb_path_ops'], name='features_attrs_path_gin'),
+            GinIndex(fields=['search_vector'], name='features_search_gin'),  # Full-text search
         ]
         
     def __init__(self, *args, **kwargs):
@@ -261,11 +352,35 @@ class Feature(gis_models.Model):
         return f"{name} in {self.geodata.name}"
     
     def get_geometry_type(self):
-        """Return the geometry type as a string."""
+        """Return the geometry type as a string, preferring the stored value over parsing the geometry."""
+        if self.geom_type:
+            return self.geom_type
         if self.geometry:
             return self.geometry.geom_type
         return None
     
+    def get_zoom_bounds(self):
+        """Parse `zoom_range` (e.g. '5-15', '5-' or '8') into a (min, max) tuple; None means unbounded."""
+        if not self.zoom_range:
+            return None, None
+        low, sep, high = self.zoom_range.partition('-')
+        try:
+            low = int(low) if low.strip() else None
+            high = int(high) if high.strip() else (None if sep else low)
+        except ValueError:
+            return None, None
+        return low, high
+
+    def is_visible_at_zoom(self, zoom_from, zoom_to=None):
+        """Return True if the feature's zoom range overlaps the given zoom level or band."""
+        zoom_to = zoom_from if zoom_to is None else zoom_to
+        low, high = self.get_zoom_bounds()
+        if low is not None and low > zoom_to:
+            return False
+        if high is not None and high < zoom_from:
+            return False
+        return True
+    
     def get_attributes_display(self):
         """Return formatted attributes for display."""
         attrs = self.attributes
@@ -286,3 +401,75 @@ class Feature(gis_models.Model):
             })
             
         return json.dumps(display_attrs, indent=2, default=str)
+
+
+class FeatureKeyframe(gis_models.Model):
+    """
+    The geometry of a moving feature (e.g. a border or a front line) at one point in time.
+    Between two keyframes the geometry is interpolated, see webmap/trajectories.py.
+    """
+    feature = models.ForeignKey(
+        Feature,
+        on_delete=models.CASCADE,
+        related_name='keyframes',
+        # No database constraint: the features table may be partitioned (see webmap/partitioning.py),
+        # its primary key then also contains geodata_id
+        db_constraint=False,
+        help_text="The feature that moves"
+    )
+    time = models.DateTimeField(help_text="Point in time of this geometry")
+    geometry = gis_models.GeometryField(
+        help_text="Geometry at this point in time. Keyframes with the same geometry type and "
+                  "number of vertices are interpolated vertex by vertex, others switch at the next keyframe."
+    )
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'feature_keyframes'
+        ordering = ['feature', 'time']
+        constraints = [
+            models.UniqueConstraint(fields=['feature', 'time'], name='feature_keyframes_feature_time_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.feature_id} @ {self.time.isoformat()}"
+
+
+class FeatureHistory(gis_models.Model):
+    """
+    Append-only log of every row version of `features`, written by the features_history_trigger
+    (migration 0014, infra/trigger.sql). Used to read layers as of a past transaction time.
+    """
+    OPERATION_CHOICES = [
+        ('I', 'Insert'),
+        ('U', 'Update'),
+        ('D', 'Delete'),
+    ]
+
+    # Plain ids instead of foreign keys: history outlives deleted features and datasets
+    feature_id = models.BigIntegerField(help_text="ID of the changed feature")
+    geodata_id = models.BigIntegerField(help_text="Dataset the row version belongs to")
+    operation = models.CharField(max_length=1, choices=OPERATION_CHOICES)
+    changed_at = models.DateTimeField(help_text="Start time of the writing transaction")
+    txid = models.BigIntegerField(help_text="ID of the writing transaction")
+    geometry = gis_models.GeometryField(null=True, blank=True)
+    label_point = gis_models.PointField(null=True, blank=True)
+    data = models.JSONField(help_text="All other columns of the row version")
+
+    class Meta:
+        db_table = 'features_history'
+        indexes = [
+            # Rows are appended in transaction order, so a tiny BRIN index covers time ranges
+            BrinIndex(fields=['changed_at'], name='features_history_changed_brin'),
+            # Latest version per feature of a dataset (DISTINCT ON in webmap/queries.py)
+            models.Index(
+                fields=['geodata_id', 'feature_id', '-changed_at', '-id'], name='features_history_version_idx'
+            ),
+            # Changes of a dataset since a delta sync cursor (LayerViewSet.changes)
+            models.Index(fields=['geodata_id', 'txid'], name='features_history_txid_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_operation_display()} feature {self.feature_id} @ {self.changed_at.isoformat()}"
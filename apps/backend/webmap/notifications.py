@@ -0,0 +1,155 @@
+"""
+Live feature changes: PostgreSQL notifications fanned out to Server-Sent Event streams.
+
+The features_notify_trigger (migration 0015, infra/trigger.sql) sends a notification
+on the `feature_changes` channel for every written feature row, e.g.
+
+    {"layer_id": 3, "geodata_id": 5, "feature_id": 812, "operation": "update"}
+
+Partition swaps send a single `reload` notification for the whole dataset instead.
+
+Each process holds one dedicated connection that LISTENs on the channel in a background
+thread, no matter how many clients are subscribed. Every notification is parsed once and
+handed to the subscribers whose layer filter matches. Subscribers that may have missed
+changes (the listener reconnected, or their queue overflowed) get a `resync` event and
+should reload their layers.
+"""
+import json
+import logging
+import os
+import threading
+
+import psycopg
+from psycopg import sql
+
+from .db import get_conninfo
+
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'feature_changes'
+
+
+def parse_notification(payload):
+    """Turn a notification payload into a `change` event dict, or None if it is malformed."""
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        return None
+    if not isinstance(event, dict):
+        return None
+    event['type'] = 'change'
+    return event
+
+
+def notify_reload(cursor, geodata_id):
+    """Tell subscribers that all features of a dataset were replaced (sent on commit)."""
+    cursor.execute(
+        "SELECT pg_notify(%s, json_build_object("
+        "'layer_id', (SELECT layer_id FROM geodata WHERE id = %s), 'geodata_id', %s, "
+        "'feature_id', NULL, 'operation', 'reload')::text)",
+        [CHANNEL, geodata_id, geodata_id],
+    )
+
+
+class Subscriber:
+    """A callback receiving the events of some layers (all layers if `layer_ids` is empty)."""
+
+    def __init__(self, callback, layer_ids=None):
+        self.callback = callback
+        self.layer_ids = frozenset(layer_ids or ())
+
+    def wants(self, event):
+        return event['type'] == 'resync' or not self.layer_ids or event.get('layer_id') in self.layer_ids
+
+
+class ChangeListener:
+    """
+    LISTENs on `channel` in a daemon thread and calls the subscribers' callbacks from that thread.
+    Callbacks must not block, e.g. hand the event over with loop.call_soon_threadsafe.
+    """
+
+    def __init__(self, conninfo=None, channel=CHANNEL, poll_interval=1.0, retry_interval=5.0):
+        self.conninfo = conninfo
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.ready = threading.Event()
+        self._stopped = threading.Event()
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def subscribe(self, callback, layer_ids=None):
+        subscriber = Subscriber(callback, layer_ids)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='webmap-change-listener', daemon=True)
+                self._thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self, event):
+        with self._lock:
+            subscribers = [subscriber for subscriber in self._subscribers if subscriber.wants(event)]
+        for subscriber in subscribers:
+            try:
+                subscriber.callback(event)
+            except Exception:
+                # E.g. the event loop of a disconnected client is closed
+                logger.exception("Dropping change subscriber after a failed delivery")
+                self.unsubscribe(subscriber)
+
+    def run(self):
+        connected_before = False
+        while not self._stopped.is_set():
+            try:
+                with psycopg.connect(self.conninfo or get_conninfo(), autocommit=True) as conn:
+                    conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+                    self.ready.set()
+                    if connected_before:
+                        self.publish({'type': 'resync'})
+                    connected_before = True
+                    while not self._stopped.is_set():
+                        for notify in conn.notifies(timeout=self.poll_interval):
+                            event = parse_notification(notify.payload)
+                            if event is not None:
+                                self.publish(event)
+            except psycopg.Error:
+                logger.exception("Change listener lost its connection, reconnecting")
+            finally:
+                self.ready.clear()
+            self._stopped.wait(self.retry_interval)
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def get_listener():
+    """Return the change listener of this process (a new one after a fork)."""
+    global _listener, _listener_pid
+    with _listener_lock:
+        if _listener is None or _listener_pid != os.getpid():
+            _listener = ChangeListener()
+            _listener_pid = os.getpid()
+        return _listener
+
+
+def stop_listener(timeout=None):
+    """Stop the listener of this process and close its connection, e.g. at the end of a test."""
+    global _listener
+    with _listener_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop(timeout)
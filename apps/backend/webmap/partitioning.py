@@ -0,0 +1,403 @@
+"""
+Declarative partitioning of the `features` table by `geodata_id`.
+
+Partitioning is opt-in, see `manage.py partition_features` and migration 0012:
+
+    list  one partition per dataset (`features_g<geodata_id>`) plus `features_default`
+          for datasets created since the last `--sync`. Reloading a dataset is a
+          partition swap: the new rows are loaded and indexed in a staging table,
+          which then replaces the old partition in one short transaction.
+    hash  a fixed number of partitions (`features_h<n>`), no maintenance needed.
+
+Either way partitions can be sub-partitioned by `time_from` eras. All indexes,
+constraints and triggers of the original table are re-created on the partitioned
+table, so every partition gets its own GiST, temporal and GIN indexes. Queries
+filtering on `geodata_id` are pruned to a single partition by the planner.
+
+The primary key becomes (id, geodata_id), since keys of a partitioned table must
+contain the partition key; ids still come from a single sequence. With eras it would
+also need `time_from`, which is nullable, so each era partition gets its own primary
+key on `id` instead and the partitioned table has none.
+"""
+from django.db import connection as default_connection, transaction
+
+from .filters import parse_at
+from .notifications import notify_reload
+
+
+FEATURES_TABLE = 'features'
+DEFAULT_PARTITION = 'features_default'
+STRATEGIES = ('list', 'hash')
+
+
+class PartitioningError(Exception):
+    pass
+
+
+def layer_partition_name(geodata_id):
+    return f"{FEATURES_TABLE}_g{int(geodata_id)}"
+
+
+def is_partitioned(cursor, table=FEATURES_TABLE):
+    cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", [table])
+    return cursor.fetchone()[0]
+
+
+def get_strategy(cursor):
+    """Return 'list', 'hash' or None if `features` is not partitioned."""
+    cursor.execute("SELECT partstrat FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [FEATURES_TABLE])
+    row = cursor.fetchone()
+    return {'l': 'list', 'h': 'hash'}.get(row[0]) if row else None
+
+
+def get_partition_tree(cursor):
+    """Return all partitions of `features` (any level) with their bounds, size and estimated row count."""
+    cursor.execute(
+        """
+        SELECT t.relid::regclass::text, t.parentrelid::regclass::text, t.level, t.isleaf,
+               pg_get_expr(c.relpartbound, c.oid), pg_total_relation_size(t.relid), c.reltuples::bigint
+        FROM pg_partition_tree(%s) t
+        JOIN pg_class c ON c.oid = t.relid
+        WHERE t.level > 0
+        ORDER BY t.level, t.relid::regclass::text
+        """,
+        [FEATURES_TABLE],
+    )
+    columns = ('name', 'parent', 'level', 'is_leaf', 'bound', 'size', 'estimated_rows')
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def get_insert_columns(cursor, table=FEATURES_TABLE):
+    """Columns that can be written, i.e. all but generated ones, in table order."""
+    cursor.execute(
+        """
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER'
+        ORDER BY ordinal_position
+        """,
+        [table],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def get_index_definitions(cursor, table):
+    """CREATE INDEX statements of all non-primary-key indexes of a table."""
+    cursor.execute(
+        "SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = to_regclass(%s) AND NOT indisprimary",
+        [table],
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def get_constraint_definitions(cursor, table):
+    """(name, definition) of the foreign key and check constraints of a table."""
+    cursor.execute(
+        """
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = to_regclass(%s) AND contype IN ('f', 'c') AND coninhcount = 0
+        """,
+        [table],
+    )
+    return cursor.fetchall()
+
+
+def get_trigger_definitions(cursor, table):
+    """(name, CREATE TRIGGER statement) of the user-defined triggers of a table."""
+    cursor.execute(
+        "SELECT tgname, pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal",
+        [table],
+    )
+    return cursor.fetchall()
+
+
+def parse_eras(value):
+    """Parse comma-separated era boundaries ('1800,1871,1945') into sorted datetimes."""
+    try:
+        return sorted(parse_at(part) for part in value.split(',') if part.strip())
+    except ValueError as exc:
+        raise PartitioningError(str(exc))
+
+
+def era_bounds(eras):
+    """Turn sorted era boundaries (datetimes) into (from, to) SQL bounds of RANGE partitions."""
+    points = ['MINVALUE', *(f"'{era.isoformat()}'" for era in sorted(eras)), 'MAXVALUE']
+    return list(zip(points, points[1:]))
+
+
+def create_era_partitions(cursor, parent, eras):
+    """
+    Sub-partition `parent` (created with PARTITION BY RANGE (time_from)) by eras.
+    Features without `time_from` go to the `<parent>_enull` default partition.
+    Each era partition gets a primary key on `id`, see the module docstring.
+    """
+    quote = cursor.db.ops.quote_name
+    children = [f'{parent}_e{index}' for index in range(len(eras) + 1)] + [f'{parent}_enull']
+    for child, (lower, upper) in zip(children, era_bounds(eras)):
+        cursor.execute(
+            f"CREATE TABLE {quote(child)} PARTITION OF {quote(parent)} FOR VALUES FROM ({lower}) TO ({upper})"
+        )
+    cursor.execute(f"CREATE TABLE {quote(children[-1])} PARTITION OF {quote(parent)} DEFAULT")
+    for child in children:
+        # Unnamed, so PostgreSQL picks a free name after partitions are renamed by a swap
+        cursor.execute(f"ALTER TABLE {quote(child)} ADD PRIMARY KEY (id)")
+
+
+def create_partition(cursor, name, bound, eras=()):
+    """Create a partition of `features` for `bound` (e.g. "FOR VALUES IN (3)"), sub-partitioned by eras if given."""
+    quote = cursor.db.ops.quote_name
+    sub_partitioning = ' PARTITION BY RANGE (time_from)' if eras else ''
+    cursor.execute(f"CREATE TABLE {quote(name)} PARTITION OF {quote(FEATURES_TABLE)} {bound}{sub_partitioning}")
+    if eras:
+        create_era_partitions(cursor, name, eras)
+
+
+def get_eras(cursor, partition):
+    """Recover the era boundaries of a sub-partitioned partition from its children's bounds."""
+    cursor.execute(
+        """
+        SELECT (regexp_match(pg_get_expr(c.relpartbound, c.oid), 'FROM \\(''([^'']+)''\\)'))[1]::timestamptz
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        """,
+        [partition],
+    )
+    return sorted(row[0] for row in cursor.fetchall() if row[0] is not None)
+
+
+def partition_features(strategy='list', modulus=8, eras=(), connection=None):
+    """
+    Convert `features` into a partitioned table, keeping all rows, indexes, constraints and triggers.
+    Runs in one transaction holding an exclusive lock on `features`.
+    """
+    if strategy not in STRATEGIES:
+        raise PartitioningError(f"Unknown strategy {strategy!r}, expected one of {', '.join(STRATEGIES)}.")
+    connection = connection or default_connection
+    quote = connection.ops.quote_name
+    old_table = f"{FEATURES_TABLE}_unpartitioned"
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            raise PartitioningError("The features table is already partitioned.")
+        cursor.execute(f"LOCK TABLE {quote(FEATURES_TABLE)} IN ACCESS EXCLUSIVE MODE")
+
+        # Captured before the rename, so the statements still refer to `features`
+        indexes = get_index_definitions(cursor, FEATURES_TABLE)
+        constraints = get_constraint_definitions(cursor, FEATURES_TABLE)
+        triggers = get_trigger_definitions(cursor, FEATURES_TABLE)
+        columns = ', '.join(quote(column) for column in get_insert_columns(cursor))
+
+        cursor.execute(f"ALTER TABLE {quote(FEATURES_TABLE)} RENAME TO {quote(old_table)}")
+        cursor.execute(
+            f"CREATE TABLE {quote(FEATURES_TABLE)} (LIKE {quote(old_table)} "
+            f"INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE INCLUDING COMMENTS) "
+            f"PARTITION BY {strategy.upper()} (geodata_id)"
+        )
+
+        if strategy == 'list':
+            cursor.execute("SELECT id FROM geodata ORDER BY id")
+            for (geodata_id,) in cursor.fetchall():
+                create_partition(cursor, layer_partition_name(geodata_id), f"FOR VALUES IN ({int(geodata_id)})", eras)
+            create_partition(cursor, DEFAULT_PARTITION, 'DEFAULT', eras)
+        else:
+            for remainder in range(modulus):
+                create_partition(
+                    cursor, f"{FEATURES_TABLE}_h{remainder}",
+                    f"FOR VALUES WITH (MODULUS {int(modulus)}, REMAINDER {remainder})", eras,
+                )
+
+        # Copy before indexes and triggers exist: a bulk load followed by index builds is faster
+        cursor.execute(
+            f"INSERT INTO {quote(FEATURES_TABLE)} ({columns}) SELECT {columns} FROM {quote(old_table)}"
+        )
+        cursor.execute(f"DROP TABLE {quote(old_table)}")
+
+        # The identity sequence went with the old table; continue the ids from a plain sequence
+        sequence = f"{FEATURES_TABLE}_id_seq"
+        cursor.execute(f"CREATE SEQUENCE {quote(sequence)} OWNED BY {quote(FEATURES_TABLE)}.id")
+        cursor.execute(f"ALTER TABLE {quote(FEATURES_TABLE)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+        cursor.execute(
+            f"SELECT setval('{sequence}', COALESCE(max(id), 0) + 1, false) FROM {quote(FEATURES_TABLE)}"
+        )
+
+        if not eras:
+            cursor.execute(
+                f"ALTER TABLE {quote(FEATURES_TABLE)} ADD CONSTRAINT {quote(f'{FEATURES_TABLE}_pkey')} "
+                f"PRIMARY KEY (id, geodata_id)"
+            )
+        for name, definition in constraints:
+            cursor.execute(f"ALTER TABLE {quote(FEATURES_TABLE)} ADD CONSTRAINT {quote(name)} {definition}")
+        for definition in indexes:
+            cursor.execute(definition)
+        for _, definition in triggers:
+            cursor.execute(definition)
+        cursor.execute(f"ANALYZE {quote(FEATURES_TABLE)}")
+
+
+def create_staging_table(cursor, name, geodata_id, eras=()):
+    """
+    Create a standalone table shaped like a partition of `features` for one dataset,
+    with the same era sub-partitions and a CHECK constraint that makes attaching it instant.
+    """
+    quote = cursor.db.ops.quote_name
+    sub_partitioning = ' PARTITION BY RANGE (time_from)' if eras else ''
+    cursor.execute(
+        f"CREATE TABLE {quote(name)} (LIKE {quote(FEATURES_TABLE)} "
+        f"INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE){sub_partitioning}"
+    )
+    if eras:
+        create_era_partitions(cursor, name, eras)
+    cursor.execute(
+        f"ALTER TABLE {quote(name)} ADD CONSTRAINT {quote(f'{name}_geodata_check')} "
+        f"CHECK (geodata_id IS NOT NULL AND geodata_id = {int(geodata_id)})"
+    )
+
+
+def attach_staging_table(cursor, name, geodata_id, final_name):
+    """Attach a staging table as the partition of a dataset and give it (and its era children) the final name."""
+    quote = cursor.db.ops.quote_name
+    cursor.execute(
+        f"ALTER TABLE {quote(FEATURES_TABLE)} ATTACH PARTITION {quote(name)} FOR VALUES IN ({int(geodata_id)})"
+    )
+    cursor.execute(f"ALTER TABLE {quote(name)} DROP CONSTRAINT {quote(f'{name}_geodata_check')}")
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass(%s)",
+        [name],
+    )
+    for (child,) in cursor.fetchall():
+        cursor.execute(f"ALTER TABLE {quote(child)} RENAME TO {quote(final_name + child[len(name):])}")
+    if name != final_name:
+        cursor.execute(f"ALTER TABLE {quote(name)} RENAME TO {quote(final_name)}")
+
+
+def add_layer_partition(geodata_id, connection=None):
+    """
+    Give a dataset its own partition (list strategy), moving its rows out of the default partition.
+    Returns False if the partition already exists.
+    """
+    connection = connection or default_connection
+    quote = connection.ops.quote_name
+    name = layer_partition_name(geodata_id)
+    staging = f"{name}_new"
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if get_strategy(cursor) != 'list':
+            raise PartitioningError("Per-dataset partitions require the list strategy.")
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+        if cursor.fetchone()[0]:
+            return False
+
+        eras = get_eras(cursor, DEFAULT_PARTITION)
+        create_staging_table(cursor, staging, geodata_id, eras)
+        columns = ', '.join(quote(column) for column in get_insert_columns(cursor))
+        # Moves rows within `features`, derived columns are copied as they are.
+        # Not an edit, so features_history_trigger must not record it.
+        cursor.execute("SELECT set_config('webmap.skip_history', 'on', true)")
+        cursor.execute(
+            f"WITH moved AS (DELETE FROM {quote(DEFAULT_PARTITION)} WHERE geodata_id = %s RETURNING {columns}) "
+            f"INSERT INTO {quote(staging)} ({columns}) SELECT {columns} FROM moved",
+            [geodata_id],
+        )
+        cursor.execute("SELECT set_config('webmap.skip_history', 'off', true)")
+        attach_staging_table(cursor, staging, geodata_id, name)
+    return True
+
+
+def drop_layer_partition(geodata_id, connection=None):
+    """Drop the (empty) partition of a deleted dataset. Returns False if it does not exist or still holds rows."""
+    connection = connection or default_connection
+    quote = connection.ops.quote_name
+    name = layer_partition_name(geodata_id)
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+        if not cursor.fetchone()[0]:
+            return False
+        cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {quote(name)})")
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute(f"DROP TABLE {quote(name)}")
+    return True
+
+
+def record_deletions(cursor, table):
+    """Add a deletion of every row of `table` to features_history (see migration 0014), if it exists."""
+    cursor.execute("SELECT to_regclass('features_history') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return
+    cursor.execute(
+        f"INSERT INTO features_history "
+        f"(feature_id, geodata_id, operation, changed_at, txid, geometry, label_point, data) "
+        f"SELECT f.id, f.geodata_id, 'D', transaction_timestamp(), txid_current(), f.geometry, f.label_point, "
+        f"to_jsonb(f) - '{{geometry,label_point,bbox,centroid,search_vector}}'::text[] "
+        f"FROM {cursor.db.ops.quote_name(table)} f"
+    )
+
+
+def swap_layer_partition(geodata_id, source_table, connection=None):
+    """
+    Replace all features of a dataset with the rows of `source_table` (e.g. imported with ogr2ogr).
+    The source needs a `geometry` column and may provide any other writable feature columns;
+    ids are newly assigned. Rows are loaded and indexed in a staging table, then the old
+    partition is detached and the staging table attached in its place.
+    Returns the number of loaded features.
+    """
+    connection = connection or default_connection
+    quote = connection.ops.quote_name
+    name = layer_partition_name(geodata_id)
+    staging = f"{name}_new"
+
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if get_strategy(cursor) != 'list':
+            raise PartitioningError("Partition swaps require the list strategy.")
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+        if not cursor.fetchone()[0]:
+            add_layer_partition(geodata_id, connection=connection)
+
+        eras = get_eras(cursor, name)
+        create_staging_table(cursor, staging, geodata_id, eras)
+
+        # The triggers of `features` fill `_attributes` and the derived geometry columns and record
+        # the new rows in features_history; they run on the staging table during the load and are
+        # cloned again on attach. Instead of one notification per row, subscribers get a single reload.
+        triggers = [
+            (trigger_name, definition) for trigger_name, definition in get_trigger_definitions(cursor, FEATURES_TABLE)
+            if trigger_name != 'features_notify_trigger'
+        ]
+        for trigger_name, definition in triggers:
+            cursor.execute(definition.replace(
+                f" ON public.{FEATURES_TABLE} ", f" ON {quote(staging)} ", 1
+            ).replace(f" ON {FEATURES_TABLE} ", f" ON {quote(staging)} ", 1))
+
+        source_columns = set(get_insert_columns(cursor, source_table))
+        if 'geometry' not in source_columns:
+            raise PartitioningError(f"{source_table} has no geometry column.")
+        columns = [
+            column for column in get_insert_columns(cursor)
+            if column in source_columns and column not in ('id', 'geodata_id')
+        ]
+        column_list = ', '.join(quote(column) for column in columns)
+        cursor.execute(
+            f"INSERT INTO {quote(staging)} (geodata_id, {column_list}) "
+            f"SELECT %s, {column_list} FROM {quote(source_table)}",
+            [geodata_id],
+        )
+        count = cursor.rowcount
+        for trigger_name, _ in triggers:
+            cursor.execute(f"DROP TRIGGER {quote(trigger_name)} ON {quote(staging)}")
+
+        # Build the indexes before the swap, so attaching only has to adopt them
+        for index, definition in enumerate(get_index_definitions(cursor, name)):
+            _, _, rest = definition.partition(' ON ')
+            _, _, using = rest.partition(' USING ')
+            unique = 'UNIQUE ' if definition.startswith('CREATE UNIQUE') else ''
+            cursor.execute(
+                f"CREATE {unique}INDEX {quote(f'{staging}_idx{index}')} ON {quote(staging)} USING {using}"
+            )
+        cursor.execute(f"ANALYZE {quote(staging)}")
+
+        # Dropping the old partition bypasses the row triggers, record its rows as deleted
+        record_deletions(cursor, name)
+        cursor.execute(f"ALTER TABLE {quote(FEATURES_TABLE)} DETACH PARTITION {quote(name)}")
+        cursor.execute(f"DROP TABLE {quote(name)}")
+        attach_staging_table(cursor, staging, geodata_id, name)
+        notify_reload(cursor, geodata_id)
+    return count
@@ -0,0 +1,193 @@
+"""
+Hand-written SQL of the hot read paths: layer data, features by layer/bbox/time and the layer version.
+With `as_of` the same queries read the row versions of that transaction time from `features_history`.
+
+Every combination of filters maps to one fixed SQL text, so the statements can be
+prepared once per connection and re-executed with new parameters (see webmap/db.py).
+Rows are turned back into unsaved model instances and rendered with the regular serializers,
+or, with orjson installed, selected with GeoJSON geometries and rendered by FeatureRowSerializer.
+"""
+from django.contrib.gis.geos import GEOSGeometry
+from rest_framework.renderers import JSONRenderer
+
+from .models import Feature, GeoData, Layer
+from .serializers import FeatureRowSerializer, serialize_feature_collection
+
+
+LAYER_SQL = """
+SELECT
+    l.id,
+    l.style_config,
+    l.updated_at,
+    g.id AS geodata_id,
+    (SELECT count(*) FROM features f WHERE f.geodata_id = g.id) AS count,
+    (SELECT max(f.updated_at) FROM features f WHERE f.geodata_id = g.id) AS last_update
+FROM layers l
+LEFT JOIN geodata g ON g.layer_id = l.id
+WHERE l.id = %(layer_id)s
+"""
+
+FEATURES_SQL = """
+SELECT
+    f.id, f.geodata_id, {geometry_columns}, f.name, f.description,
+    f.style_color, f.style_opacity, f.style_weight, f._attributes,
+    f.time_from, f.time_to, f.zoom_range, f.area_m2, f.length_m,
+    g.layer_id, l.style_config AS layer_style_config
+FROM {source} f
+JOIN geodata g ON g.id = f.geodata_id
+JOIN layers l ON l.id = g.layer_id
+WHERE {conditions}
+ORDER BY f.id
+"""
+
+# Geometries are read in their text form (hex EWKB), which GEOS parses directly
+GEOMETRY_COLUMNS = 'f.geometry, f.label_point'
+
+# For FeatureRowSerializer: GeoJSON with at most 15 decimals like GDAL writes for the serializers
+# (shortest round-trip digits need PostGIS 3.1), and the bounds of the geometry for webmap/columnar.py
+GEOJSON_COLUMNS = """
+    ST_AsGeoJSON(f.geometry, 15, 0) AS geometry, ST_AsGeoJSON(f.label_point, 15, 0) AS label_point,
+    ST_XMin(f.geometry) AS xmin, ST_YMin(f.geometry) AS ymin,
+    ST_XMax(f.geometry) AS xmax, ST_YMax(f.geometry) AS ymax"""
+
+# Lifetimes of all features of a dataset, for animation frames of layers too large for memory
+FEATURE_TIMES_SQL = """
+SELECT f.id, f.time_from, f.time_to
+FROM features f
+WHERE f.geodata_id = %(geodata_id)s
+ORDER BY f.id
+"""
+
+# The latest row version of each feature at `as_of` that is not a deletion, shaped like
+# `features`. The snapshot columns are unpacked with the current row type of `features`.
+FEATURES_AS_OF_SOURCE = """(
+    SELECT
+        h.feature_id AS id, h.geodata_id, h.geometry, h.label_point,
+        r.name, r.description, r.style_color, r.style_opacity, r.style_weight, r._attributes,
+        r.time_from, r.time_to, r.zoom_range, r.area_m2, r.length_m
+    FROM (
+        SELECT DISTINCT ON (h.geodata_id, h.feature_id) h.*
+        FROM features_history h
+        WHERE h.changed_at <= %(as_of)s AND {conditions}
+        ORDER BY h.geodata_id, h.feature_id, h.changed_at DESC, h.id DESC
+    ) h
+    CROSS JOIN LATERAL jsonb_populate_record(NULL::features, h.data) r
+    WHERE h.operation <> 'D'
+)"""
+
+# Delta sync: the latest row version of every feature of a dataset written by the transactions
+# with IDs in [since, until). Row locks serialize writes to a row, so the highest history ID is its latest version.
+CHANGES_SQL = """
+SELECT
+    h.feature_id AS id, h.geodata_id, h.geometry, h.operation,
+    r.name, r.description, r.style_color, r.style_opacity, r.style_weight, r._attributes,
+    r.time_from, r.time_to, r.zoom_range, h.label_point, r.area_m2, r.length_m,
+    g.layer_id, l.style_config AS layer_style_config
+FROM (
+    SELECT DISTINCT ON (h.feature_id) h.*
+    FROM features_history h
+    WHERE h.geodata_id = %(geodata_id)s AND h.txid >= %(since)s AND h.txid < %(until)s
+    ORDER BY h.feature_id, h.id DESC
+) h
+CROSS JOIN LATERAL jsonb_populate_record(NULL::features, h.data) r
+JOIN geodata g ON g.id = h.geodata_id
+JOIN layers l ON l.id = g.layer_id
+ORDER BY h.feature_id
+"""
+
+# Every transaction with a lower ID has ended, so no change below it can still appear
+CHANGE_CURSOR_SQL = "SELECT txid_snapshot_xmin(txid_current_snapshot()) AS cursor"
+
+TEMPORAL_CONDITIONS = [
+    '(f.time_from IS NULL OR f.time_from <= %(at)s)',
+    '(f.time_to IS NULL OR f.time_to >= %(at)s)',
+]
+
+# Same semantics as InBBoxFilter: the feature's bounding box is contained in the box
+BBOX_CONDITION = 'f.geometry @ ST_MakeEnvelope(%(west)s, %(south)s, %(east)s, %(north)s, 4326)'
+
+
+def build_features_query(geodata_id=None, layer_id=None, at=None, bbox=None, as_of=None, geojson=False):
+    """
+    Return the (sql, params) pair selecting features by geodata or layer, time and (west, south, east, north) bbox,
+    as they are now or, with `as_of`, as they were at that transaction time.
+    With `geojson=True` the rows are meant for FeatureRowSerializer (see GEOJSON_COLUMNS).
+    """
+    conditions = []
+    history_conditions = []
+    params = {}
+    if geodata_id is not None:
+        conditions.append('f.geodata_id = %(geodata_id)s')
+        history_conditions.append('h.geodata_id = %(geodata_id)s')
+        params['geodata_id'] = geodata_id
+    if layer_id is not None:
+        conditions.append('g.layer_id = %(layer_id)s')
+        history_conditions.append('h.geodata_id IN (SELECT id FROM geodata WHERE layer_id = %(layer_id)s)')
+        params['layer_id'] = layer_id
+    if at is not None:
+        conditions += TEMPORAL_CONDITIONS
+        params['at'] = at
+    if bbox is not None:
+        conditions.append(BBOX_CONDITION)
+        params.update(zip(('west', 'south', 'east', 'north'), bbox))
+    source = 'features'
+    if as_of is not None:
+        source = FEATURES_AS_OF_SOURCE.format(conditions=' AND '.join(history_conditions) or 'TRUE')
+        params['as_of'] = as_of
+    sql = FEATURES_SQL.format(
+        geometry_columns=GEOJSON_COLUMNS if geojson else GEOMETRY_COLUMNS,
+        source=source,
+        conditions=' AND '.join(conditions) or 'TRUE',
+    )
+    return sql, params
+
+
+def layer_info_from_row(row):
+    """Add the data version (see Layer.get_data_version) to a row of LAYER_SQL."""
+    row['version'] = Layer.format_data_version(row['updated_at'], row['count'], row['last_update'])
+    return row
+
+
+def features_from_rows(rows):
+    """
+    Build unsaved Feature instances from FEATURES_SQL rows, with geodata and layer attached,
+    so the regular serializers can be used without any further queries.
+    """
+    layers = {}
+    geodata = {}
+    features = []
+    for row in rows:
+        layer = layers.get(row['layer_id'])
+        if layer is None:
+            layer = layers[row['layer_id']] = Layer(id=row['layer_id'], style_config=row['layer_style_config'])
+        dataset = geodata.get(row['geodata_id'])
+        if dataset is None:
+            dataset = geodata[row['geodata_id']] = GeoData(id=row['geodata_id'], layer=layer)
+        features.append(Feature(
+            id=row['id'],
+            geodata=dataset,
+            geometry=GEOSGeometry(row['geometry']),
+            name=row['name'],
+            description=row['description'],
+            style_color=row['style_color'],
+            style_opacity=row['style_opacity'],
+            style_weight=row['style_weight'],
+            _attributes=row['_attributes'],
+            time_from=row['time_from'],
+            time_to=row['time_to'],
+            zoom_range=row['zoom_range'],
+            label_point=GEOSGeometry(row['label_point']) if row['label_point'] else None,
+            area_m2=row['area_m2'],
+            length_m=row['length_m'],
+        ))
+    return features
+
+
+def render_feature_collection(rows, compact=False, geojson=False):
+    """
+    Serialize FEATURES_SQL rows into the JSON bytes of a FeatureCollection.
+    Rows of a `geojson=True` query are rendered by FeatureRowSerializer (see can_render_rows).
+    """
+    if geojson:
+        return FeatureRowSerializer().render(rows)
+    return JSONRenderer().render(serialize_feature_collection(features_from_rows(rows), compact=compact))
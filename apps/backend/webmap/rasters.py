@@ -0,0 +1,342 @@
+"""
+XYZ tiles (PNG or WebP) of raster layers, rendered from local GeoTIFFs with GDAL.
+
+Each tile is one warped read into Web Mercator: GDAL only reads the window of the
+source that covers the tile and picks the overview closest to the tile resolution,
+so low-zoom tiles of a large DEM stay cheap when the GeoTIFF has overviews
+(`gdaladdo -r average dem.tif`). Values are coloured with NumPy according to the
+layer's `style_config`:
+
+    bands       band names (descriptions) or 1-based indexes; one band is coloured
+                with the ramp, three bands are shown as RGB. Default: the first band,
+                or the first three if there are three or more and no colorRamp.
+    colorRamp   name of a ramp in COLOR_RAMPS or a list of hex colours ('terrain')
+    colorScale  'linear' (default) or 'quantile'
+    classes     number of discrete colour classes (default: continuous, 10 for quantile)
+    min, max    value range, per band for RGB (default: range of the data, the 2-98
+                percentile range with `enhance`)
+    gamma       gamma correction of the stretched values (default 1.0)
+    resampling  GDAL resampling of the warp (default 'bilinear')
+
+Reads run in a shared thread pool: GDAL releases the GIL while reading and warping,
+so tiles render in parallel while the pool bounds the memory used by concurrent reads.
+"""
+import functools
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+try:
+    from osgeo import gdal
+except ImportError:  # GDAL's Python bindings are optional, raster tiles are unavailable without them
+    gdal = None
+else:
+    gdal.UseExceptions()
+
+
+TILE_SIZE = 256
+WEB_MERCATOR_HALF_SIZE = 20037508.342789244
+STATISTICS_SAMPLE_SIZE = 1024  # Longest side of the overview read for value statistics
+
+IMAGE_FORMATS = {
+    'png': ('PNG', ['ZLEVEL=6']),
+    'webp': ('WEBP', ['QUALITY=85']),
+}
+
+RESAMPLING_METHODS = (
+    'nearest', 'bilinear', 'cubic', 'cubicspline', 'lanczos', 'average', 'rms', 'mode',
+    'min', 'max', 'med', 'q1', 'q3', 'sum',
+)
+
+COLOR_RAMPS = {
+    'terrain': ['#00a600', '#63c600', '#e6e600', '#e9bd3a', '#ecb176', '#efc2b3', '#f2f2f2'],
+    'viridis': ['#440154', '#3b528b', '#21918c', '#5ec962', '#fde725'],
+    'spectral': ['#d7191c', '#fdae61', '#ffffbf', '#abdda4', '#2b83ba'],
+    'blues': ['#f7fbff', '#6baed6', '#08306b'],
+    'greys': ['#000000', '#ffffff'],
+}
+
+
+class RasterTileError(Exception):
+    """Invalid raster styling or data."""
+
+
+class RasterNotFound(RasterTileError):
+    pass
+
+
+class RasterUnavailable(RasterTileError):
+    pass
+
+
+def mercator_bounds(z, x, y):
+    """Return the (west, south, east, north) bounds of a tile in EPSG:3857 meters."""
+    size = 2 * WEB_MERCATOR_HALF_SIZE / 2 ** z
+    west = -WEB_MERCATOR_HALF_SIZE + x * size
+    north = WEB_MERCATOR_HALF_SIZE - y * size
+    return west, north - size, west + size, north
+
+
+def get_raster_path(geodata):
+    """Return the absolute path of a dataset's GeoTIFF, which must lie below RASTER_ROOT."""
+    if geodata is None or not geodata.raster_path:
+        raise RasterNotFound("The layer has no raster file.")
+    root = Path(settings.RASTER_ROOT).resolve()
+    path = (root / geodata.raster_path).resolve()
+    if root not in path.parents or not path.is_file():
+        raise RasterNotFound("Raster file not found.")
+    return str(path)
+
+
+def get_raster_version(path):
+    """A token that changes whenever the file is replaced or rewritten."""
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def parse_color(value):
+    value = value.lstrip('#')
+    if len(value) == 3:
+        value = ''.join(char * 2 for char in value)
+    try:
+        return [int(value[index:index + 2], 16) for index in (0, 2, 4)]
+    except ValueError:
+        raise RasterTileError(f"Invalid colour {value!r}.")
+
+
+def get_palette(ramp, count):
+    """Sample `count` colours evenly from a named ramp or a list of hex colours, as a (count, 3) uint8 array."""
+    colors = COLOR_RAMPS.get(ramp) if isinstance(ramp, str) else ramp
+    if not colors or not isinstance(colors, list):
+        raise RasterTileError(f"Unknown colour ramp {ramp!r}, expected one of {', '.join(COLOR_RAMPS)} or a list.")
+    stops = np.array([parse_color(color) for color in colors], dtype=np.float64)
+    positions = np.linspace(0, 1, len(stops))
+    samples = np.linspace(0, 1, count)
+    return np.rint(
+        np.stack([np.interp(samples, positions, stops[:, channel]) for channel in range(3)], axis=1)
+    ).astype(np.uint8)
+
+
+def get_classes(style):
+    classes = style.get('classes')
+    if classes is None:
+        return 10 if style.get('colorScale') == 'quantile' else None
+    if not isinstance(classes, int) or not 1 <= classes <= 256:
+        raise RasterTileError("`classes` must be an integer between 1 and 256.")
+    return classes
+
+
+def get_gamma(style):
+    try:
+        gamma = float(style.get('gamma', 1.0))
+    except (TypeError, ValueError):
+        gamma = None
+    if gamma is None or not 0 < gamma < float('inf'):
+        raise RasterTileError("`gamma` must be a positive number.")
+    return gamma
+
+
+def get_resampling(style):
+    resampling = style.get('resampling', 'bilinear')
+    if resampling not in RESAMPLING_METHODS:
+        raise RasterTileError(f"Unknown resampling {resampling!r}, expected one of {', '.join(RESAMPLING_METHODS)}.")
+    return resampling
+
+
+def band_range(style, statistics, index):
+    """
+    The (low, high) stretch range of the index-th styled band. `statistics` (see sample_statistics)
+    is only read for bounds missing from the style.
+    """
+    bounds = []
+    for key, enhanced in (('min', 'p2'), ('max', 'p98')):
+        value = style.get(key)
+        if isinstance(value, list):
+            if index >= len(value):
+                raise RasterTileError(f"`{key}` needs a value for each of the styled bands.")
+            value = value[index]
+        if value is None:
+            value = statistics[index][enhanced if style.get('enhance') else key]
+        try:
+            bounds.append(float(value))
+        except (TypeError, ValueError):
+            raise RasterTileError(f"`{key}` must be a number or a list of numbers.")
+    return tuple(bounds)
+
+
+def stretch(values, low, high, gamma):
+    """Scale values linearly from [low, high] to [0, 1] and apply gamma correction."""
+    scaled = np.clip((values - low) / ((high - low) or 1.0), 0.0, 1.0)
+    return scaled ** (1.0 / gamma) if gamma != 1.0 else scaled
+
+
+def colorize(values, valid, style, statistics):
+    """
+    Turn a (bands, height, width) array of band values into a (4, height, width) RGBA uint8 array.
+    `valid` masks the pixels with data; `statistics` holds the sample_statistics of each band.
+    """
+    gamma = get_gamma(style)
+    rgba = np.zeros((4,) + values.shape[1:], dtype=np.uint8)
+    rgba[3] = np.where(valid, 255, 0)
+
+    if len(values) == 3:
+        for index in range(3):
+            low, high = band_range(style, statistics, index)
+            rgba[index] = np.rint(stretch(values[index], low, high, gamma) * 255)
+        return rgba
+
+    classes = get_classes(style)
+    if style.get('colorScale') == 'quantile':
+        breaks = statistics[0]['quantiles']
+        indexes = np.searchsorted(breaks, values[0], side='right')
+        palette = get_palette(style.get('colorRamp', 'greys'), len(breaks) + 1)
+    else:
+        low, high = band_range(style, statistics, 0)
+        scaled = stretch(values[0], low, high, gamma)
+        count = classes or 256
+        if classes:
+            indexes = np.minimum(np.floor(scaled * classes), classes - 1).astype(np.int64)
+        else:
+            indexes = np.rint(scaled * (count - 1)).astype(np.int64)
+        palette = get_palette(style.get('colorRamp', 'greys'), count)
+    rgba[:3] = np.moveaxis(palette[indexes], -1, 0)
+    return rgba
+
+
+def resolve_bands(dataset, style):
+    """Return the 1-based indexes of the bands to render as a tuple of one or three bands."""
+    requested = style.get('bands')
+    if not requested:
+        if dataset.RasterCount >= 3 and not style.get('colorRamp'):
+            return (1, 2, 3)
+        return (1,)
+
+    names = {dataset.GetRasterBand(index).GetDescription(): index for index in range(1, dataset.RasterCount + 1)}
+    bands = []
+    for band in requested:
+        if isinstance(band, str) and band in names:
+            bands.append(names[band])
+        elif str(band).isdigit() and 1 <= int(band) <= dataset.RasterCount:
+            bands.append(int(band))
+        else:
+            raise RasterTileError(f"Band {band!r} not found.")
+    if len(bands) not in (1, 3):
+        raise RasterTileError("`bands` must name one band (colour ramp) or three bands (RGB).")
+    return tuple(bands)
+
+
+@functools.lru_cache(maxsize=64)
+def sample_statistics(path, version, bands, classes):
+    """
+    Value statistics of the given bands from a read at overview resolution:
+    min, max, 2nd and 98th percentile and the quantile breaks for `classes` classes.
+    `version` (see get_raster_version) is only part of the cache key.
+    """
+    dataset = gdal.Open(path)
+    statistics = []
+    for index in bands:
+        band = dataset.GetRasterBand(index)
+        factor = max(1.0, max(band.XSize, band.YSize) / STATISTICS_SAMPLE_SIZE)
+        values = band.ReadAsArray(
+            buf_xsize=max(1, int(band.XSize / factor)), buf_ysize=max(1, int(band.YSize / factor))
+        ).astype(np.float64).ravel()
+        nodata = band.GetNoDataValue()
+        if nodata is not None:
+            values = values[values != nodata]
+        values = values[np.isfinite(values)]
+        if not values.size:
+            values = np.zeros(1)
+        statistics.append({
+            'min': float(values.min()),
+            'max': float(values.max()),
+            'p2': float(np.percentile(values, 2)),
+            'p98': float(np.percentile(values, 98)),
+            'quantiles': np.quantile(values, np.linspace(0, 1, (classes or 10) + 1)[1:-1]),
+        })
+    return tuple(statistics)
+
+
+def encode_image(rgba, image_format):
+    """Encode a (4, height, width) RGBA uint8 array as PNG or WebP with GDAL."""
+    driver_name, options = IMAGE_FORMATS[image_format]
+    height, width = rgba.shape[1:]
+    image = gdal.GetDriverByName('MEM').Create('', width, height, 4, gdal.GDT_Byte)
+    for index in range(4):
+        image.GetRasterBand(index + 1).WriteArray(rgba[index])
+
+    path = f"/vsimem/webmap-tile-{uuid.uuid4().hex}.{image_format}"
+    gdal.GetDriverByName(driver_name).CreateCopy(path, image, options=options)
+    try:
+        handle = gdal.VSIFOpenL(path, 'rb')
+        try:
+            gdal.VSIFSeekL(handle, 0, os.SEEK_END)
+            size = gdal.VSIFTellL(handle)
+            gdal.VSIFSeekL(handle, 0, os.SEEK_SET)
+            return bytes(gdal.VSIFReadL(1, size, handle))
+        finally:
+            gdal.VSIFCloseL(handle)
+    finally:
+        gdal.Unlink(path)
+
+
+@functools.lru_cache(maxsize=None)
+def empty_tile(image_format):
+    return encode_image(np.zeros((4, TILE_SIZE, TILE_SIZE), dtype=np.uint8), image_format)
+
+
+def read_tile(path, style, z, x, y, image_format='png'):
+    """Warp, colour and encode one tile. Runs in a worker thread of the raster pool."""
+    resampling = get_resampling(style)
+    dataset = gdal.Open(path)
+    bands = resolve_bands(dataset, style)
+    source = dataset
+    if bands != tuple(range(1, dataset.RasterCount + 1)):
+        # A virtual subset, so the warp only reads the styled bands
+        source = gdal.Translate('', dataset, format='VRT', bandList=list(bands))
+
+    warped = gdal.Warp(
+        '', source, format='MEM', dstSRS='EPSG:3857', outputBounds=mercator_bounds(z, x, y),
+        width=TILE_SIZE, height=TILE_SIZE, resampleAlg=resampling, dstAlpha=True,
+    )
+    data = warped.ReadAsArray()
+    values, valid = data[:-1].astype(np.float64), data[-1] > 0
+    if not valid.any():
+        return empty_tile(image_format)
+
+    statistics = sample_statistics(path, get_raster_version(path), bands, get_classes(style))
+    return encode_image(colorize(values, valid, style, statistics), image_format)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The thread pool shared by all raster reads of this process."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'RASTER_TILE_WORKERS', None) or os.cpu_count() or 4,
+                thread_name_prefix='webmap-raster',
+            )
+        return _executor
+
+
+def submit_raster_tile(path, style, z, x, y, image_format='png'):
+    """Schedule a tile on the raster pool and return its Future (e.g. for asyncio.wrap_future)."""
+    if gdal is None:
+        raise RasterUnavailable("Raster tiles need GDAL's Python bindings (osgeo.gdal).")
+    if image_format not in IMAGE_FORMATS:
+        raise RasterTileError(f"Unsupported image format {image_format!r}.")
+    return get_executor().submit(read_tile, path, dict(style or {}), z, x, y, image_format)
+
+
+def render_raster_tile(path, style, z, x, y, image_format='png'):
+    """Render a tile on the raster pool and wait for it."""
+    return submit_raster_tile(path, style, z, x, y, image_format).result()
@@ -0,0 +1,30 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+
+class MVTRenderer(BaseRenderer):
+    """
+    Renderer for Mapbox Vector Tiles.
+    Tile bodies are already encoded by PostGIS; error payloads fall back to JSON.
+    """
+    media_type = 'application/vnd.mapbox-vector-tile'
+    format = 'mvt'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return bytes(data)
+        return JSONRenderer().render(data)
+
+
+class PNGRenderer(MVTRenderer):
+    """Renderer for raster tiles, already encoded by webmap/rasters.py. Error payloads fall back to JSON."""
+    media_type = 'image/png'
+    format = 'png'
+
+
+class WebPRenderer(PNGRenderer):
+    media_type = 'image/webp'
+    format = 'webp'
@@ -0,0 +1,62 @@
+"""
+Full-text search over features.
+
+Features carry a generated, weighted `search_vector` column (see Feature.search_vector):
+    A: name (German and English stemming)
+    B: description (German and English stemming)
+    C: string values of `_attributes` (no stemming)
+The column is backed by a GIN index; queries use prefix matching for type-ahead.
+"""
+import re
+
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, SearchVectorCombinable, SearchVectorField,
+)
+from django.db.models import F, Func
+
+
+SEARCH_CONFIGS = ('german', 'english')
+
+
+class AttributesSearchVector(SearchVectorCombinable, Func):
+    """tsvector of all string values of a JSONB column, with weight C."""
+    function = 'jsonb_to_tsvector'
+    template = "setweight(%(function)s('simple'::regconfig, %(expressions)s, '[\"string\"]'::jsonb), 'C')"
+    output_field = SearchVectorField()
+
+
+def build_search_vector():
+    """Expression of the generated `search_vector` column."""
+    vector = None
+    for field, weight in (('name', 'A'), ('description', 'B')):
+        for config in SEARCH_CONFIGS:
+            part = SearchVector(field, config=config, weight=weight)
+            vector = part if vector is None else vector + part
+    return vector + AttributesSearchVector('_attributes')
+
+
+def build_search_query(text):
+    """
+    Turn user input into a prefix-matching tsquery over all configurations, or None if it has no terms.
+    'berl hauptst' matches 'Berlin' and 'Hauptstadt'.
+    """
+    terms = re.findall(r'\w+', text or '')
+    if not terms:
+        return None
+    raw = ' & '.join(f"{term}:*" for term in terms)
+    query = SearchQuery(raw, config='simple', search_type='raw')
+    for config in SEARCH_CONFIGS:
+        query |= SearchQuery(raw, config=config, search_type='raw')
+    return query
+
+
+def search_features(queryset, text):
+    """Filter a feature queryset by full-text search and order it by relevance."""
+    query = build_search_query(text)
+    if query is None:
+        return queryset
+    return (
+        queryset.filter(search_vector=query)
+        .annotate(search_rank=SearchRank(F('search_vector'), query))
+        .order_by('-search_rank', 'pk')
+    )
@@ -1,7 +1,26 @@
+import json
+import re
+
 from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
 from rest_framework_gis.serializers import GeoFeatureModelSerializer
 from .models import Layer, GeoData, Feature
 
+try:
+    import orjson
+except ImportError:  # orjson is optional, responses are then rendered by FeatureSerializer and JSONRenderer
+    orjson = None
+
+
+# Numbers in the GeoJSON of PostGIS that Python's json module writes differently:
+# integral values (`9` for `9.0`) and values below 1e-4 (`0.00001` for `1e-05`)
+GEOJSON_INTEGER = re.compile(rb'(?<![\d.])(-?\d+)(?=[,\]])')
+GEOJSON_SMALL_NUMBER = re.compile(rb'(?<![\d.])-?0\.0000\d*')
+# Floats that orjson writes differently from Python's json module: positional below 1e-4
+# (`0.00001` for `1e-05`) and exponents without a sign or with one digit (`1e16`, `1e-7` for
+# `1e+16`, `1e-07`), depending on the orjson version. Python always writes e+XX or e-XX.
+ORJSON_FLOAT_MISMATCH = re.compile(rb'(?<![\d.])0\.0000|(?<=[:,\[])-?\d+(?:\.\d+)?e(?![+-]\d\d)')
+
 
 class GeoDataSerializer(serializers.ModelSerializer):
     """ Serializer for GeoData model. """
@@ -33,7 +52,8 @@ class FeatureSerializer(GeoFeatureModelSerializer):
         fields = (
             'id', 'name', 'description', 'geodata', 'attributes', 
             'time_from', 'time_to', 'zoom_range', 'effective_style',
-            'style_color', 'style_opacity', 'style_weight'
+            'style_color', 'style_opacity', 'style_weight',
+            'label_point', 'area_m2', 'length_m'
         )
     
     def get_effective_style(self, obj):
@@ -61,6 +81,224 @@ class FeatureSerializer(GeoFeatureModelSerializer):
         return effective_style
 
 
+class NearestFeatureSerializer(FeatureSerializer):
+    """FeatureSerializer for nearest-neighbour queries, adds the distance to the query point in meters."""
+    distance_m = serializers.FloatField(read_only=True)
+
+    class Meta(FeatureSerializer.Meta):
+        fields = FeatureSerializer.Meta.fields + ('distance_m',)
+
+
+class StylePalette:
+    """
+    Collects the distinct effective styles of a response.
+    Each distinct combination of layer style and feature overrides is merged only once,
+    features then reference the resulting style by its index in `styles`.
+    """
+
+    def __init__(self):
+        self.styles = []
+        self._index_by_style = {}
+        self._index_by_source = {}
+
+    def index_for(self, obj, compute_style):
+        """Return the palette index of the effective style of `obj`, computing it only for unseen inputs."""
+        feature_style = obj.attributes.get('style', {})
+        source_key = (
+            obj.geodata.layer_id if obj.geodata_id else None,
+            obj.style_color,
+            obj.style_opacity,
+            obj.style_weight,
+            json.dumps(feature_style, sort_keys=True, default=str),
+        )
+        index = self._index_by_source.get(source_key)
+        if index is None:
+            style = compute_style(obj)
+            style_key = json.dumps(style, sort_keys=True, default=str)
+            index = self._index_by_style.get(style_key)
+            if index is None:
+                index = len(self.styles)
+                self.styles.append(style)
+                self._index_by_style[style_key] = index
+            self._index_by_source[source_key] = index
+        return index
+
+
+class CompactFeatureSerializer(FeatureSerializer):
+    """
+    Compact variant of FeatureSerializer for large collections.
+    Instead of repeating the effective style and raw style fields on every feature,
+    `style` holds an index into the collection-level `styles` table
+    (provided through the `style_palette` context entry).
+    """
+    style = serializers.SerializerMethodField()
+    attributes = serializers.SerializerMethodField()
+
+    class Meta(FeatureSerializer.Meta):
+        fields = (
+            'id', 'name', 'description', 'geodata', 'attributes',
+            'time_from', 'time_to', 'zoom_range', 'style',
+            'label_point', 'area_m2', 'length_m'
+        )
+
+    def get_attributes(self, obj):
+        """Return the feature attributes without the style, which is part of the palette."""
+        attributes = obj.attributes
+        attributes.pop('style', None)
+        return attributes
+
+    def get_style(self, obj):
+        return self.context['style_palette'].index_for(obj, self.get_effective_style)
+
+
+def serialize_feature_collection(features, context=None, compact=False):
+    """
+    Serialize features into a GeoJSON FeatureCollection dict.
+    With `compact=True` the collection carries a `styles` table referenced by index from each feature.
+    """
+    context = dict(context or {})
+    if not compact:
+        return {
+            'type': 'FeatureCollection',
+            'features': FeatureSerializer(features, many=True, context=context).data
+        }
+
+    palette = context.setdefault('style_palette', StylePalette())
+    data = CompactFeatureSerializer(features, many=True, context=context).data
+    return {
+        'type': 'FeatureCollection',
+        'styles': palette.styles,
+        'features': data
+    }
+
+
+def can_render_rows(compact=False):
+    """Whether a response can be rendered by FeatureRowSerializer, which needs orjson and has no compact variant."""
+    return orjson is not None and not compact
+
+
+def geojson_geometry(text):
+    """The bytes of a GeoJSON geometry from PostGIS, with numbers as FeatureSerializer writes them."""
+    data = GEOJSON_INTEGER.sub(rb'\1.0', text.encode())
+    if b'0.0000' in data:
+        data = GEOJSON_SMALL_NUMBER.sub(lambda match: repr(float(match[0])).encode(), data)
+    return data
+
+
+def _optional(convert, value):
+    return None if value is None else convert(value)
+
+
+class FeatureRowSerializer:
+    """
+    Renders rows of a `geojson=True` features query (see webmap/queries.py) into the same bytes
+    as JSONRenderer renders FeatureSerializer, without model instances, GEOS or DRF fields.
+
+    PostGIS writes the geometries as GeoJSON with at most 15 decimals, like GDAL does for
+    FeatureSerializer, and they are spliced in without being parsed. The layer part of
+    `effective_style` is encoded once per layer and the rest of a feature is encoded by orjson;
+    features orjson would write differently from JSONRenderer (floats below 1e-4 or in exponent
+    notation, integers beyond 64 bits) are rendered with JSONRenderer instead.
+    """
+
+    def __init__(self):
+        self.datetime_field = serializers.DateTimeField()
+        self._layer_styles = {}
+
+    def get_layer_style(self, row):
+        """The style of the row's layer and its JSON bytes."""
+        style = self._layer_styles.get(row['layer_id'])
+        if style is None:
+            layer_style = row['layer_style_config'] or {}
+            style = self._layer_styles[row['layer_id']] = (layer_style, JSONRenderer().render(layer_style))
+        return style
+
+    def to_representation(self, row, load):
+        """
+        The data of FeatureSerializer for `row`, with the GeoJSON bytes of geometries and of
+        the layer style passed through `load`.
+        """
+        # Same precedence as Feature.__init__ and Feature.attributes
+        stored = row['_attributes'] or {}
+        name, description = row['name'], row['description']
+        color, opacity, weight = row['style_color'], row['style_opacity'], row['style_weight']
+        if stored:
+            name = stored.get('name', name)
+            description = stored.get('description', description)
+            stored_style = stored.get('style', {})
+            color = stored_style.get('color', color)
+            opacity = stored_style.get('opacity', opacity)
+            weight = stored_style.get('weight', weight)
+
+        attributes = stored.copy()
+        if name:
+            attributes['name'] = name
+        if description:
+            attributes['description'] = description
+        style = dict(attributes.get('style', {}))
+        if color:
+            style['color'] = color
+        if opacity is not None:
+            style['opacity'] = opacity
+        if weight is not None:
+            style['weight'] = weight
+        if style:
+            attributes['style'] = style
+
+        layer_style, encoded_layer_style = self.get_layer_style(row)
+        if style:
+            effective_style = layer_style.copy()
+            if color:
+                effective_style['color'] = color
+            if opacity is not None:
+                effective_style['opacity'] = opacity
+            if weight is not None:
+                effective_style['weight'] = weight
+            effective_style.update(style)
+        else:
+            effective_style = load(encoded_layer_style)
+
+        return {
+            'id': int(row['id']),
+            'type': 'Feature',
+            'geometry': load(geojson_geometry(row['geometry'])),
+            'properties': {
+                'name': _optional(str, name),
+                'description': _optional(str, description),
+                'geodata': row['geodata_id'],
+                'attributes': attributes,
+                'time_from': _optional(self.datetime_field.to_representation, row['time_from']),
+                'time_to': _optional(self.datetime_field.to_representation, row['time_to']),
+                'zoom_range': _optional(str, row['zoom_range']),
+                'effective_style': effective_style,
+                'style_color': _optional(str, color),
+                'style_opacity': _optional(float, opacity),
+                'style_weight': _optional(float, weight),
+                'label_point': _optional(load, _optional(geojson_geometry, row['label_point'])),
+                'area_m2': _optional(float, row['area_m2']),
+                'length_m': _optional(float, row['length_m']),
+            },
+        }
+
+    def encode(self, row):
+        """The JSON bytes of one feature."""
+        try:
+            data = orjson.dumps(self.to_representation(row, orjson.Fragment))
+        except orjson.JSONEncodeError:
+            data = None
+        if data is None or ORJSON_FLOAT_MISMATCH.search(data):
+            return JSONRenderer().render(self.to_representation(row, json.loads))
+        # JSONRenderer escapes the JavaScript line terminators
+        return data.replace('\u2028'.encode(), rb'\u2028').replace('\u2029'.encode(), rb'\u2029')
+
+    def render(self, rows):
+        """The JSON bytes of a FeatureCollection of `rows`."""
+        return orjson.dumps({
+            'type': 'FeatureCollection',
+            'features': [orjson.Fragment(self.encode(row)) for row in rows],
+        })
+
+
 class FeatureLayerSerializer(serializers.ModelSerializer):
     """ Serializer for a Layer with all its features, for API bulk endpoint. """
     features = serializers.SerializerMethodField()
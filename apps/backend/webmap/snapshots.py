@@ -0,0 +1,120 @@
+"""
+Baked layer snapshots on disk.
+
+`manage.py bake_snapshots` renders layers into static files below
+SNAPSHOT_ROOT and records them in `manifest.json`, keyed by layer version.
+The helpers here read that manifest and serve the files without touching
+the database, so the same tree can also be exposed by a reverse proxy
+(e.g. nginx with `gzip_static`/`brotli_static`).
+"""
+import json
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, Http404
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
+
+from .compression import negotiate_encoding
+
+
+MANIFEST_NAME = 'manifest.json'
+
+# File suffix of the precompressed variant for each content-coding
+ENCODING_SUFFIXES = {
+    'br': '.br',
+    'gzip': '.gz',
+    'identity': '',
+}
+
+CONTENT_TYPES = {
+    '.geojson': 'application/geo+json',
+    '.mvt': 'application/vnd.mapbox-vector-tile',
+}
+
+_manifest_cache = {'mtime': None, 'data': None}
+
+
+def get_snapshot_root():
+    return Path(getattr(settings, 'SNAPSHOT_ROOT', Path(settings.BASE_DIR) / 'snapshots'))
+
+
+def get_manifest_path():
+    return get_snapshot_root() / MANIFEST_NAME
+
+
+def empty_manifest():
+    return {'layers': {}}
+
+
+def load_manifest():
+    """Load the manifest, re-reading it from disk only when it has changed."""
+    path = get_manifest_path()
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return empty_manifest()
+
+    if _manifest_cache['mtime'] != mtime:
+        with open(path, encoding='utf-8') as fh:
+            _manifest_cache['data'] = json.load(fh)
+        _manifest_cache['mtime'] = mtime
+    return _manifest_cache['data']
+
+
+def write_manifest(manifest):
+    """Atomically replace the manifest on disk."""
+    write_file(get_manifest_path(), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+
+def write_file(path, content):
+    """Write `content` to `path` atomically, creating parent directories as needed."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'wb') as fh:
+        fh.write(content)
+    os.replace(tmp_path, path)
+
+
+def write_variants(path, variants):
+    """Write a payload and its precompressed variants (see compression.compress_payload)."""
+    for encoding, content in variants.items():
+        write_file(str(path) + ENCODING_SUFFIXES[encoding], content)
+
+
+def resolve_snapshot(layer_id, name):
+    """Return the absolute path of a file in the current snapshot of a layer, or None."""
+    entry = load_manifest()['layers'].get(str(layer_id))
+    if not entry:
+        return None
+    version = entry['versions'].get(entry['version'])
+    if not version:
+        return None
+    try:
+        return safe_join(get_snapshot_root(), version['path'], name)
+    except ValueError:
+        return None
+
+
+def serve_snapshot(request, layer_id, name):
+    """Serve a baked file, picking the best precompressed variant available on disk."""
+    path = resolve_snapshot(layer_id, name)
+    if path is None:
+        raise Http404("No snapshot for this layer.")
+
+    available = [encoding for encoding, suffix in ENCODING_SUFFIXES.items() if os.path.isfile(path + suffix)]
+    if not available:
+        raise Http404("Snapshot file not found.")
+
+    encoding = negotiate_encoding(request.META.get('HTTP_ACCEPT_ENCODING'), available)
+    if encoding not in available:
+        raise Http404("Snapshot file not available in an acceptable encoding.")
+
+    content_type = CONTENT_TYPES.get(os.path.splitext(path)[1], 'application/octet-stream')
+    response = FileResponse(open(path + ENCODING_SUFFIXES[encoding], 'rb'), content_type=content_type)
+    if encoding != 'identity':
+        response['Content-Encoding'] = encoding
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,164 @@
+"""
+Spatial SQL helpers that GeoDjango does not provide out of the box.
+"""
+import math
+
+from django.contrib.gis.db.models import GeometryField
+from django.contrib.gis.geos import GEOSGeometry, Polygon
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Func, Q, Value
+
+
+# Predicates supported by the spatial search endpoint, relative to the feature:
+# a feature `within` the query geometry, a feature that `contains` it, ...
+SPATIAL_PREDICATES = ('intersects', 'within', 'contains', 'dwithin')
+
+METERS_PER_DEGREE = 111320.0
+
+
+def geometry_value(geometry, srid=4326):
+    """Wrap a GEOS geometry so it can be used as an argument of a database function."""
+    return Value(geometry, output_field=GeometryField(srid=srid))
+
+
+class GeographyKNNDistance(Func):
+    """
+    `a::geography <-> b::geography`, the distance in meters on the sphere.
+    Used in ORDER BY ... LIMIT it performs an index-assisted nearest-neighbour search on the
+    GiST index of `geometry::geography` (migration 0009), correct at the poles and the antimeridian.
+    """
+    arg_joiner = '::geography <-> '
+    template = '(%(expressions)s::geography)'
+    output_field = FloatField()
+
+
+class GeographyDistance(Func):
+    """Minimum distance in meters on the spheroid, computed by casting both arguments to geography."""
+    function = 'ST_Distance'
+    arg_joiner = '::geography, '
+    template = '%(function)s(%(expressions)s::geography)'
+    output_field = FloatField()
+
+
+class GeographyDWithin(Func):
+    """ST_DWithin on geography: True if both geometries are within a distance in meters."""
+    function = 'ST_DWithin'
+    template = '%(function)s(%(expressions)s)'
+    output_field = BooleanField()
+
+    def __init__(self, expression, geometry, distance, **extra):
+        super().__init__(
+            Func(expression, template='(%(expressions)s)::geography'),
+            Func(geometry, template='(%(expressions)s)::geography'),
+            Value(float(distance)),
+            **extra,
+        )
+
+
+def subdivide(geometry, max_vertices=256):
+    """
+    Split a large geometry into pieces of at most `max_vertices` vertices with ST_Subdivide.
+    Many small pieces have tight bounding boxes, so each one can use the GiST index
+    effectively instead of one huge box that matches almost everything.
+    """
+    if geometry.num_points <= max_vertices or geometry.geom_type == 'Point':
+        return [geometry]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT ST_AsEWKB(ST_Subdivide(ST_GeomFromEWKB(%s), %s))",
+            [bytes(geometry.ewkb), max_vertices],
+        )
+        return [GEOSGeometry(bytes(row[0])) for row in cursor.fetchall()]
+
+
+def expand_bbox_by_meters(geometry, distance):
+    """Return the bbox of a 4326 geometry grown by `distance` meters in every direction (conservatively)."""
+    west, south, east, north = geometry.extent
+    delta_lat = distance / METERS_PER_DEGREE
+    max_lat = min(max(abs(south), abs(north)) + delta_lat, 89.0)
+    delta_lon = distance / (METERS_PER_DEGREE * math.cos(math.radians(max_lat)))
+    bbox = Polygon.from_bbox((west - delta_lon, south - delta_lat, east + delta_lon, north + delta_lat))
+    bbox.srid = geometry.srid
+    return bbox
+
+
+def spatial_predicate_condition(geometry, predicate, distance=None, field='geometry', max_vertices=256):
+    """
+    Build a Q object selecting features whose `field` satisfies `predicate` against `geometry`.
+    Large query geometries are subdivided so that the index lookups stay selective.
+    """
+    if predicate not in SPATIAL_PREDICATES:
+        raise ValueError(f"Unknown predicate: {predicate!r}")
+
+    if predicate == 'contains':
+        # The feature must contain the whole query geometry; pieces would not help
+        return Q(**{f'{field}__contains': geometry})
+
+    pieces = subdivide(geometry, max_vertices)
+    if predicate == 'dwithin':
+        if distance is None:
+            raise ValueError("The dwithin predicate requires a distance.")
+        condition = Q()
+        for piece in pieces:
+            # Index-assisted bbox prefilter, then the exact test on the spheroid
+            condition |= Q(**{f'{field}__bboverlaps': expand_bbox_by_meters(piece, distance)}) & Q(
+                GeographyDWithin(field, geometry_value(piece, piece.srid), distance)
+            )
+        return condition
+
+    condition = Q()
+    for piece in pieces:
+        condition |= Q(**{f'{field}__intersects': piece})
+    if predicate == 'within':
+        condition &= Q(**{f'{field}__within': geometry})
+    return condition
+
+
+AGGREGATE_SQL = """
+SELECT
+    p.id,
+    p.name,
+    COUNT(s.id) AS count,
+    COALESCE(SUM(
+        CASE WHEN ST_Dimension(s.geometry) = 1
+        THEN ST_Length(ST_Intersection(s.geometry, p.geometry)::geography) END
+    ), 0) AS length_m,
+    COALESCE(SUM(
+        CASE WHEN ST_Dimension(s.geometry) = 2
+        THEN ST_Area(ST_Intersection(s.geometry, p.geometry)::geography) END
+    ), 0) AS area_m2
+FROM features p
+LEFT JOIN features s
+    ON s.geodata_id = %(source_geodata_id)s
+    AND ST_Intersects(p.geometry, s.geometry)
+    {source_temporal_filter}
+WHERE p.geodata_id = %(polygon_geodata_id)s
+    AND ST_Dimension(p.geometry) = 2
+    {polygon_temporal_filter}
+GROUP BY p.id, p.name
+ORDER BY p.name, p.id
+"""
+
+AGGREGATE_TEMPORAL_FILTER_SQL = """
+    AND ({alias}.time_from IS NULL OR {alias}.time_from <= %(at)s)
+    AND ({alias}.time_to IS NULL OR {alias}.time_to >= %(at)s)
+"""
+
+
+def aggregate_by_polygons(polygon_geodata_id, source_geodata_id, at=None):
+    """
+    Spatial join of a source layer against the polygons of another layer.
+    Returns one row per polygon with the number of intersecting source features,
+    the length of source lines and the area of source polygons inside it (meters on the spheroid).
+    """
+    filters = {'source_temporal_filter': '', 'polygon_temporal_filter': ''}
+    params = {'polygon_geodata_id': polygon_geodata_id, 'source_geodata_id': source_geodata_id}
+    if at is not None:
+        filters['source_temporal_filter'] = AGGREGATE_TEMPORAL_FILTER_SQL.format(alias='s')
+        filters['polygon_temporal_filter'] = AGGREGATE_TEMPORAL_FILTER_SQL.format(alias='p')
+        params['at'] = at
+
+    with connection.cursor() as cursor:
+        cursor.execute(AGGREGATE_SQL.format(**filters), params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
@@ -0,0 +1,137 @@
+"""
+Query-plan regression tests: the filters of FeatureViewSet must keep using the indexes of
+Feature.Meta.indexes. A migration that changes a column type, an index definition or the
+SQL of a filter can silently turn an index scan into a sequential scan over all features,
+which only shows up in production. These tests seed enough rows for the planner to prefer
+the indexes, run EXPLAIN (FORMAT JSON) on the filtered querysets and fail on any
+sequential scan of `features`.
+"""
+import json
+from unittest import skipIf
+
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from .db import execute_all
+from .filters import parse_at
+from .models import Feature, GeoData, Layer
+from .queries import build_features_query
+from .views import FeatureViewSet
+
+
+LAYERS = 50
+FEATURES_PER_LAYER = 1000
+
+# Features of one layer are stored together, points are spread over Germany and every
+# feature is visible for ten years between the years 1000 and 2000
+SEED_SQL = """
+INSERT INTO features (
+    geodata_id, geometry, name, description, style_color, _attributes, zoom_range,
+    time_from, time_to, geom_type, geometry_repaired, created_at, updated_at
+)
+SELECT
+    g.id,
+    ST_SetSRID(ST_MakePoint(
+        5.87 + (i * 7919 %% 10000) / 10000.0 * 9.17,
+        47.27 + (i * 104729 %% 10000) / 10000.0 * 7.79
+    ), 4326),
+    CASE WHEN i %% 500 = 0 THEN 'Burg ' ELSE 'Ort ' END || i,
+    '', '', jsonb_build_object('population', i), '',
+    make_timestamptz(1000 + i * 7 %% 1000, 1, 1, 0, 0, 0, 'UTC'),
+    make_timestamptz(1010 + i * 7 %% 1000, 1, 1, 0, 0, 0, 'UTC'),
+    'Point', false, now(), now()
+FROM geodata g
+CROSS JOIN LATERAL generate_series(1, %(count)s) AS i
+WHERE g.id = ANY(%(geodata_ids)s)
+ORDER BY g.id, i
+"""
+
+
+def plan_nodes(plan):
+    """Yield a plan node and all nodes below it."""
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from plan_nodes(child)
+
+
+@skipIf(settings.FEATURES_PARTITIONING, "Plans of a partitioned features table scan the partitions' own indexes")
+class QueryPlanTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.layers = [Layer(name=f"Plan Layer {index}", layer_type='vector') for index in range(LAYERS)]
+        Layer.objects.bulk_create(cls.layers)
+        geodata = GeoData.objects.bulk_create(
+            [GeoData(name=f"Plan GeoData {layer.name}", layer=layer) for layer in cls.layers]
+        )
+        with connection.cursor() as cursor:
+            # Neither history rows nor their trigger cost matter for the plans
+            cursor.execute("SELECT set_config('webmap.skip_history', 'on', true)")
+            cursor.execute(SEED_SQL, {'count': FEATURES_PER_LAYER, 'geodata_ids': [dataset.pk for dataset in geodata]})
+            cursor.execute("SELECT set_config('webmap.skip_history', 'off', true)")
+            cursor.execute("ANALYZE features")
+            cursor.execute("ANALYZE geodata")
+
+    def filtered_queryset(self, params):
+        """The queryset FeatureViewSet.list would evaluate for a request with `params`."""
+        request = Request(APIRequestFactory().get('/api/features/', params))
+        view = FeatureViewSet(request=request, format_kwarg=None, action='list', kwargs={}, args=())
+        return view.filter_queryset(view.get_queryset())
+
+    def index_names(self, column):
+        """Names of the indexes on `features` whose first column is `column`."""
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Feature._meta.db_table)
+        return {
+            name for name, constraint in constraints.items()
+            if constraint['index'] and constraint['columns'] and constraint['columns'][0] == column
+        }
+
+    def assert_uses_index(self, plan, columns):
+        """Assert that `plan` reads `features` through an index on one of `columns` and never sequentially."""
+        nodes = list(plan_nodes(plan[0]['Plan']))
+        seq_scans = [
+            node for node in nodes if node['Node Type'] == 'Seq Scan' and node['Relation Name'] == 'features'
+        ]
+        self.assertFalse(seq_scans, f"Sequential scan on features:\n{json.dumps(plan, indent=2)}")
+
+        declared = {index.name for index in Feature._meta.indexes}
+        expected = set().union(*(self.index_names(column) for column in columns))
+        self.assertTrue(expected & declared, f"No index of Feature.Meta.indexes covers {', '.join(columns)}")
+        used = {node['Index Name'] for node in nodes if 'Index Name' in node}
+        self.assertTrue(used & expected, f"None of {sorted(expected)} used:\n{json.dumps(plan, indent=2)}")
+
+    def assert_filter_uses_index(self, params, *columns):
+        queryset = self.filtered_queryset(params)
+        self.assert_uses_index(json.loads(queryset.explain(format='json')), columns)
+
+    def test_in_bbox(self):
+        self.assert_filter_uses_index({'in_bbox': '9.0,50.0,10.0,51.0'}, 'geometry')
+
+    def test_time_range(self):
+        self.assert_filter_uses_index(
+            {'time_from__gte': '1800-01-01T00:00:00Z', 'time_from__lte': '1810-01-01T00:00:00Z'}, 'time_from'
+        )
+
+    def test_layer(self):
+        self.assert_filter_uses_index({'geodata__layer': self.layers[7].pk}, 'geodata_id')
+
+    def test_layer_ordering(self):
+        self.assert_filter_uses_index({'geodata__layer': self.layers[7].pk, 'ordering': '-created_at'}, 'geodata_id')
+
+    def test_search(self):
+        self.assert_filter_uses_index({'search': 'Burg'}, 'search_vector')
+
+    def test_hot_query(self):
+        """The prepared query of the map's layer + bbox + time requests (webmap/queries.py)."""
+        sql, params = build_features_query(
+            layer_id=self.layers[7].pk, at=parse_at('1800'), bbox=(9.0, 50.0, 10.0, 51.0)
+        )
+        rows = execute_all('EXPLAIN (FORMAT JSON) ' + sql, params, prepare=False)
+        plan = next(iter(rows[0].values()))
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        self.assert_uses_index(plan, ('geometry', 'geodata_id'))
@@ -1,9 +1,44 @@
-from django.test import TestCase, TransactionTestCase
+import asyncio
+import functools
+import gzip
+import json
+import tempfile
+from io import StringIO
+from unittest import skipIf
+from unittest.mock import patch
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.test import LiveServerTestCase, TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
 from django.core.management import call_command
-from django.contrib.gis.geos import Point
+from django.db import connection, transaction
+from django.contrib.gis.geos import LineString, Point, Polygon
 from rest_framework.test import APITestCase
-from .models import Layer, GeoData, Feature
+from .models import Layer, GeoData, Feature, FeatureHistory, FeatureKeyframe
+from .columnar import LayerStore, get_layer_store, shapely
+from .compression import build_entry, layer_data_cache_key, negotiate_encoding
+from .db import close_async_pools, execute_all, use_async_pools
+from .filters import parse_at
+from .notifications import stop_listener
+from .partitioning import is_partitioned
+from .queries import build_features_query, render_feature_collection
+from .rasters import RasterTileError, colorize, gdal, get_resampling
+from .serializers import ORJSON_FLOAT_MISMATCH, orjson
+from .tilecache import TileCache, reset_tile_cache, tile_key, time_bucket
+from .tiles import lonlat_to_tile
+
+
+# Tile requests of tests use a memory-only tile cache, nothing is written below BASE_DIR
+MEMORY_TILE_CACHE = {'ROOT': ''}
+
+
+def use_memory_tile_cache(test_case):
+    """Start a test with an empty memory-only tile cache and drop it afterwards."""
+    reset_tile_cache()
+    test_case.addCleanup(reset_tile_cache)
 
 
 class ModelTests(TestCase):
@@ -40,6 +75,54 @@ class ModelTests(TestCase):
         self.assertEqual(attributes['name'], 'Sync Test')
         self.assertEqual(attributes['source'], 'manual')
 
+    def test_geometry_type_prefers_stored_value(self):
+        """Test that get_geometry_type uses the trigger-maintained column when it is set."""
+        feature = Feature(geodata=self.geodata, geometry=Point(0, 0))
+        self.assertEqual(feature.get_geometry_type(), 'Point')
+        feature.geom_type = 'MultiPolygon'
+        self.assertEqual(feature.get_geometry_type(), 'MultiPolygon')
+
+    def test_derived_geometry_columns(self):
+        """Test that the trigger installed by the migrations fills and repairs the derived geometry columns."""
+        feature = Feature.objects.create(
+            geodata=self.geodata,
+            geometry=Polygon(((13.0, 52.0), (13.1, 52.0), (13.1, 52.1), (13.0, 52.1), (13.0, 52.0))),
+        )
+        feature.refresh_from_db()
+        self.assertEqual(feature.geom_type, 'Polygon')
+        self.assertEqual(feature.num_points, 5)
+        self.assertIsNotNone(feature.label_point)
+        self.assertGreater(feature.area_m2, 0)
+        self.assertFalse(feature.geometry_repaired)
+
+        # Bow tie, self-intersecting
+        feature.geometry = Polygon(((0, 0), (1, 1), (1, 0), (0, 1), (0, 0)))
+        feature.save()
+        feature.refresh_from_db()
+        self.assertTrue(feature.geometry_repaired)
+        self.assertTrue(feature.geometry.valid)
+        self.assertEqual(feature.geom_type, 'MultiPolygon')
+
+    def test_visible_at(self):
+        """Test that visible_at honours open and closed validity intervals."""
+        Feature.objects.create(
+            geodata=self.geodata, geometry=Point(0, 0), name="Old",
+            time_from=datetime(1000, 1, 1, tzinfo=dt_timezone.utc),
+            time_to=datetime(1500, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        Feature.objects.create(geodata=self.geodata, geometry=Point(0, 0), name="Always")
+        names = set(Feature.objects.visible_at(parse_at('1800')).values_list('name', flat=True))
+        self.assertEqual(names, {"Always"})
+
+    def test_zoom_bounds(self):
+        """Test parsing of zoom_range and zoom band overlap."""
+        feature = Feature(geodata=self.geodata, geometry=Point(0, 0), zoom_range='5-15')
+        self.assertEqual(feature.get_zoom_bounds(), (5, 15))
+        self.assertTrue(feature.is_visible_at_zoom(0, 5))
+        self.assertFalse(feature.is_visible_at_zoom(16, 18))
+        feature.zoom_range = ''
+        self.assertTrue(feature.is_visible_at_zoom(0))
+
 
 class APITests(APITestCase):
 
@@ -77,9 +160,10 @@ class APITests(APITestCase):
         url = reverse('layer-data', kwargs={'pk': self.layer.pk})
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(response.data['type'], 'FeatureCollection')
-        self.assertEqual(len(response.data['features']), 1)
-        self.assertEqual(response.data['features'][0]['properties']['name'], 'API Test Feature')
+        data = response.json()
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual(len(data['features']), 1)
+        self.assertEqual(data['features'][0]['properties']['name'], 'API Test Feature')
 
     def test_feature_effective_style(self):
         """Test that the effective_style is correctly computed in the serializer."""
@@ -95,14 +179,568 @@ class APITests(APITestCase):
         self.assertEqual(response.status_code, 200)
 
         # Find the properties for each feature
-        props_with_color = next(f['properties'] for f in response.data['features'] if f['properties']['name'] == 'API Test Feature')
-        props_no_color = next(f['properties'] for f in response.data['features'] if f['properties']['name'] == 'Feature with no color')
+        features = response.json()['features']
+        props_with_color = next(f['properties'] for f in features if f['properties']['name'] == 'API Test Feature')
+        props_no_color = next(f['properties'] for f in features if f['properties']['name'] == 'Feature with no color')
 
         # Check that the feature's own style is used when present
         self.assertEqual(props_with_color['effective_style']['color'], '#ff0000')
         # Check that the layer's default style is used as a fallback
         self.assertEqual(props_no_color['effective_style']['color'], '#112233')
 
+    def test_feature_at_filter(self):
+        """Test that the `at` filter only returns features visible at that time."""
+        Feature.objects.create(
+            geodata=self.geodata, name='Medieval Feature', geometry=Point(13.4, 52.5),
+            time_from=datetime(1200, 1, 1, tzinfo=dt_timezone.utc),
+            time_to=datetime(1300, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        response = self.client.get(reverse('feature-list'), {'at': '1250'})
+        self.assertEqual(response.status_code, 200)
+        names = {f['properties']['name'] for f in response.data['features']}
+        self.assertEqual(names, {'API Test Feature', 'Medieval Feature'})
+
+        response = self.client.get(reverse('feature-list'), {'at': '1800'})
+        names = {f['properties']['name'] for f in response.data['features']}
+        self.assertEqual(names, {'API Test Feature'})
+
+        response = self.client.get(reverse('feature-list'), {'at': 'not-a-date'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_hot_queries_load_attributes(self):
+        """Test that the hot queries on Django's connection return jsonb attributes as dicts, not as text."""
+        Feature.objects.create(
+            geodata=self.geodata, name='Potsdam', geometry=Point(13.0645, 52.3906),
+            _attributes={'population': 183000, 'style': {'dashArray': '4'}},
+        )
+        rows = execute_all(*build_features_query(geodata_id=self.geodata.pk))
+        self.assertEqual({type(row['_attributes']) for row in rows}, {dict})
+
+        response = self.client.get(reverse('feature-list'), {'in_bbox': '12,52,14,53'})
+        self.assertEqual(response.status_code, 200)
+        potsdam = next(f['properties'] for f in response.data['features'] if f['properties']['name'] == 'Potsdam')
+        self.assertEqual(potsdam['attributes']['population'], 183000)
+        self.assertEqual(potsdam['effective_style'], {'color': '#112233', 'dashArray': '4'})
+
+        response = self.client.get(reverse('layer-data', kwargs={'pk': self.layer.pk}), {'compact': 'true'})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        potsdam = next(f for f in data['features'] if f['properties']['name'] == 'Potsdam')
+        self.assertEqual(potsdam['properties']['attributes'], {'name': 'Potsdam', 'population': 183000})
+        self.assertEqual(data['styles'][potsdam['properties']['style']]['dashArray'], '4')
+
+    def test_layer_store(self):
+        """Test that the in-memory layer store renders the same bytes as the database query."""
+        Feature.objects.create(
+            geodata=self.geodata, name='Medieval Feature', geometry=Point(7.0982, 50.7374),
+            time_from=datetime(1200, 1, 1, tzinfo=dt_timezone.utc),
+            time_to=datetime(1300, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        version = self.layer.get_data_version()
+        store = get_layer_store(self.layer.pk, self.geodata.pk, version)
+        self.assertIs(get_layer_store(self.layer.pk, self.geodata.pk, version), store)
+        for at, bbox in [(None, None), (parse_at('1250'), None), (parse_at('1800'), (12.0, 52.0, 14.0, 53.0))]:
+            rows = execute_all(*build_features_query(geodata_id=self.geodata.pk, at=at, bbox=bbox))
+            self.assertEqual(store.render(at=at, bbox=bbox), render_feature_collection(rows))
+
+        response = self.client.get(reverse('feature-list'), {'geodata__layer': self.layer.pk, 'at': '1250'})
+        names = {f['properties']['name'] for f in response.json()['features']}
+        self.assertEqual(names, {'API Test Feature', 'Medieval Feature'})
+
+    def test_layer_store_attributes(self):
+        """Test that the layer store serves the stored attributes of its features."""
+        Feature.objects.create(
+            geodata=self.geodata, name='Potsdam', geometry=Point(13.0645, 52.3906),
+            _attributes={'population': 183000, 'style': {'dashArray': '4'}},
+        )
+        store = get_layer_store(self.layer.pk, self.geodata.pk, self.layer.get_data_version())
+        features = json.loads(store.render(bbox=(13.0, 52.3, 13.1, 52.4)))['features']
+        self.assertEqual([f['properties']['name'] for f in features], ['Potsdam'])
+        self.assertEqual(features[0]['properties']['attributes']['population'], 183000)
+        self.assertEqual(features[0]['properties']['effective_style'], {'color': '#112233', 'dashArray': '4'})
+
+        response = self.client.get(reverse('feature-list'), {'geodata__layer': self.layer.pk, 'at': '1800'})
+        potsdam = next(f['properties'] for f in response.json()['features'] if f['properties']['name'] == 'Potsdam')
+        self.assertEqual(potsdam['attributes']['population'], 183000)
+
+    @skipIf(shapely is None, "Shapely is not installed")
+    def test_layer_store_spatial_index(self):
+        """Test that bbox requests answered through the STRtree select the same features as a full scan."""
+        for index in range(20):
+            Feature.objects.create(
+                geodata=self.geodata, name=f'Line {index}',
+                geometry=LineString((6 + index * 0.4, 48), (6.5 + index * 0.4, 49 + index * 0.2)),
+            )
+        rows = execute_all(*build_features_query(geodata_id=self.geodata.pk))
+        store = LayerStore(rows)
+        with patch('webmap.columnar.SPATIAL_INDEX_MIN_FEATURES', 0):
+            self.assertTrue(store.uses_spatial_index())
+            for bbox in [(5.0, 47.0, 10.0, 50.0), (13.0, 52.0, 14.0, 53.0), (0.0, 0.0, 1.0, 1.0)]:
+                with_tree = store.render(bbox=bbox)
+                self.assertIsNotNone(store._tree)
+                rows = execute_all(*build_features_query(geodata_id=self.geodata.pk, bbox=bbox))
+                self.assertEqual(with_tree, render_feature_collection(rows))
+
+    @skipIf(orjson is None, "orjson is not installed")
+    def test_feature_row_serializer(self):
+        """Test that FeatureRowSerializer renders the same bytes as FeatureSerializer and JSONRenderer."""
+        Feature.objects.create(
+            geodata=self.geodata, name='Integral', geometry=Point(9, 50), style_opacity=0.5,
+            time_from=datetime(1200, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        Feature.objects.create(
+            geodata=self.geodata, geometry=Polygon(((6.1, 50.0), (6.2, 50.0), (6.2, 50.1), (6.1, 50.0))),
+            _attributes={
+                'name': 'Aus Attributen', 'note': 'Zeile\u2028Trenner', 'style': {'dashArray': '4', 'color': '#00ff00'}
+            },
+        )
+        Feature.objects.create(
+            geodata=self.geodata, name='Tiny', geometry=Point(0.00001, 50.5), _attributes={'tiny': 1e-06}
+        )
+        Feature.objects.create(
+            geodata=self.geodata, name='Exponents', geometry=Point(9.5, 50.5),
+            _attributes={'small': 1e-05, 'large': 1e16, 'huge': -1.5e22, 'style': {'color': '#1e90ff'}},
+        )
+        other_layer = Layer.objects.create(name="Unstyled Layer", layer_type='vector')
+        Feature.objects.create(
+            geodata=GeoData.objects.create(name="Unstyled GeoData", layer=other_layer), name='Unstyled',
+            geometry=LineString((7, 51), (7.5, 51.25)),
+        )
+        for filters in [{'geodata_id': self.geodata.pk}, {'layer_id': other_layer.pk}, {'bbox': (0, 40, 20, 60)}]:
+            rows = execute_all(*build_features_query(geojson=True, **filters))
+            expected = render_feature_collection(execute_all(*build_features_query(**filters)))
+            self.assertEqual(render_feature_collection(rows, geojson=True), expected)
+
+        # Depending on its version orjson writes 1e16 or 1e+16, Python's json module always 1e+16
+        for value in [1e-07, 1e-06, 1e-05, 1e16, -1.5e22]:
+            encoded = orjson.dumps({'value': value})
+            if encoded != json.dumps({'value': value}, separators=(',', ':')).encode():
+                self.assertRegex(encoded, ORJSON_FLOAT_MISMATCH)
+        for encoded in [b'{"value":1e16}', b'[-1.5e22]', b'{"value":1e-7}', b'{"value":0.00001}']:
+            self.assertRegex(encoded, ORJSON_FLOAT_MISMATCH)
+        for encoded in [b'{"value":1e+16}', b'[-1.5e-07]', b'{"color":"#1e90ff"}']:
+            self.assertNotRegex(encoded, ORJSON_FLOAT_MISMATCH)
+
+    def test_frames_endpoint(self):
+        """Test that frames list the features once and encode their visibility per step as runs."""
+        medieval = Feature.objects.create(
+            geodata=self.geodata, name='Medieval Feature', geometry=Point(7.0982, 50.7374),
+            time_from=datetime(1200, 1, 1, tzinfo=dt_timezone.utc),
+            time_to=datetime(1300, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        url = reverse('layer-frames', kwargs={'pk': self.layer.pk})
+        response = self.client.get(url, {'from': '1100', 'to': '1500', 'steps': 3})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['ids'], [self.feature.pk, medieval.pk])
+        self.assertEqual([frame['at'][:4] for frame in data['frames']], ['1100', '1300', '1500'])
+        self.assertEqual([frame['runs'] for frame in data['frames']], [[0, 1, 1], [0, 2], [0, 1, 1]])
+
+        self.assertEqual(self.client.get(url, {'from': '1500', 'to': '1100'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'from': '1100', 'to': '1500', 'steps': 0}).status_code, 400)
+
+    def test_scene_endpoint(self):
+        """Test that /scenes/ returns one FeatureCollection per requested layer, in request order."""
+        other_layer = Layer.objects.create(name="Other Layer", layer_type='vector')
+        other_geodata = GeoData.objects.create(name="Other GeoData", layer=other_layer)
+        Feature.objects.create(geodata=other_geodata, name='Munich', geometry=Point(11.5820, 48.1351))
+
+        response = self.client.get(reverse('scene-list'), {
+            'layers': f'{other_layer.pk},{self.layer.pk}',
+            'in_bbox': '5.8,47.2,15.1,55.1',
+        })
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([c['layer'] for c in data['layers']], [other_layer.pk, self.layer.pk])
+        self.assertEqual(data['layers'][0]['features'][0]['properties']['name'], 'Munich')
+        self.assertEqual(data['layers'][1]['features'][0]['properties']['name'], 'API Test Feature')
+
+        # Like /features/, in_bbox selects the features contained in the box
+        Feature.objects.create(geodata=self.geodata, name='To Paris', geometry=LineString((13.4, 52.5), (2.35, 48.86)))
+        params = {'layers': self.layer.pk, 'in_bbox': '5.8,47.2,15.1,55.1'}
+        data = self.client.get(reverse('scene-list'), params).json()
+        names = [f['properties']['name'] for f in data['layers'][0]['features']]
+        self.assertEqual(names, ['API Test Feature'])
+        features = self.client.get(
+            reverse('feature-list'), {'geodata__layer': self.layer.pk, 'in_bbox': params['in_bbox']}
+        ).json()['features']
+        self.assertEqual(names, [f['properties']['name'] for f in features])
+
+        response = self.client.get(reverse('scene-list'), {'layers': '999999'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_compact_style_palette(self):
+        """Test that compact mode returns each distinct effective style once and references it by index."""
+        for name in ('Red 1', 'Red 2'):
+            Feature.objects.create(geodata=self.geodata, name=name, geometry=Point(13.4, 52.5), style_color='#ff0000')
+        Feature.objects.create(geodata=self.geodata, name='Default', geometry=Point(13.4, 52.5))
+
+        url = reverse('layer-data', kwargs={'pk': self.layer.pk})
+        data = self.client.get(url, {'compact': 'true'}).json()
+        self.assertEqual(len(data['styles']), 2)
+        styles = {f['properties']['name']: data['styles'][f['properties']['style']] for f in data['features']}
+        self.assertEqual(styles['Red 1']['color'], '#ff0000')
+        self.assertEqual(styles['Default']['color'], '#112233')
+
+        properties = data['features'][0]['properties']
+        self.assertNotIn('effective_style', properties)
+        self.assertNotIn('style_color', properties)
+        self.assertNotIn('style', properties['attributes'])
+
+    def test_attribute_filters(self):
+        """Test typed attr.<key>__<op> filters on feature attributes."""
+        Feature.objects.create(
+            geodata=self.geodata, name='Big City', geometry=Point(13.4, 52.5),
+            _attributes={'population': 3669491, 'type': 'capital', 'code': '01'},
+        )
+        Feature.objects.create(
+            geodata=self.geodata, name='Small Town', geometry=Point(11.5, 48.1),
+            _attributes={'population': 5000, 'type': 'town', 'grade': 'inf'},
+        )
+
+        def names(params):
+            response = self.client.get(reverse('feature-list'), params)
+            self.assertEqual(response.status_code, 200)
+            return {f['properties']['name'] for f in response.data['features']}
+
+        self.assertEqual(names({'attr.type': 'capital'}), {'Big City'})
+        self.assertEqual(names({'attr.population__gte': '1000000'}), {'Big City'})
+        self.assertEqual(names({'attr.population__lt': '1000000'}), {'Small Town'})
+        self.assertEqual(names({'attr.type__in': 'capital,town'}), {'Big City', 'Small Town'})
+        self.assertEqual(names({'attr.code': '"01"'}), {'Big City'})
+        self.assertEqual(names({'attr.type__icontains': 'CAP'}), {'Big City'})
+        self.assertEqual(names({'attr.code__exists': 'true'}), {'Big City'})
+        # Non-finite floats are no JSON numbers, such values are matched as strings
+        self.assertEqual(names({'attr.grade': 'inf'}), {'Small Town'})
+        self.assertEqual(names({'attr.type': 'NaN'}), set())
+        self.assertEqual(names({'attr.population__gt': 'Infinity'}), set())
+
+        response = self.client.get(reverse('feature-list'), {'attr.bad key': '1'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_full_text_search(self):
+        """Test prefix full-text search over name, description and attributes, ranked by relevance."""
+        Feature.objects.create(
+            geodata=self.geodata, name='Brandenburger Tor', geometry=Point(13.3777, 52.5163),
+            description='Neoklassizistisches Tor in Berlin',
+        )
+        Feature.objects.create(
+            geodata=self.geodata, name='Elbphilharmonie', geometry=Point(9.9841, 53.5413),
+            _attributes={'architect': 'Herzog & de Meuron'},
+        )
+
+        def names(term):
+            response = self.client.get(reverse('feature-list'), {'search': term})
+            self.assertEqual(response.status_code, 200)
+            return [f['properties']['name'] for f in response.data['features']]
+
+        self.assertEqual(names('brandenb'), ['Brandenburger Tor'])
+        self.assertEqual(names('herzog'), ['Elbphilharmonie'])
+        # Name matches (weight A) rank above description matches (weight B)
+        Feature.objects.create(geodata=self.geodata, name='Berliner Dom', geometry=Point(13.401, 52.519))
+        self.assertEqual(names('berlin')[0], 'Berliner Dom')
+
+    def test_nearest_features(self):
+        """Test k-nearest-neighbour queries with distances in meters and the `at` filter."""
+        Feature.objects.create(geodata=self.geodata, name='Potsdam', geometry=Point(13.0645, 52.3906))
+        Feature.objects.create(
+            geodata=self.geodata, name='Old Potsdam', geometry=Point(13.0600, 52.3900),
+            time_to=datetime(1700, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        Feature.objects.create(geodata=self.geodata, name='Munich', geometry=Point(11.5820, 48.1351))
+
+        response = self.client.get(reverse('feature-list'), {'near': '13.40,52.52', 'k': 2, 'at': '1800'})
+        self.assertEqual(response.status_code, 200)
+        features = response.data['features']
+        self.assertEqual([f['properties']['name'] for f in features], ['API Test Feature', 'Potsdam'])
+        self.assertAlmostEqual(features[1]['properties']['distance_m'], 26000, delta=2000)
+
+        response = self.client.get(reverse('feature-list'), {'near': '13.40,52.52', 'max_distance': 1000})
+        self.assertEqual([f['properties']['name'] for f in response.data['features']], ['API Test Feature'])
+
+    def test_nearest_features_across_antimeridian_and_pole(self):
+        """Test that the nearest feature is found when it is far away in degrees but close on the globe."""
+        Feature.objects.create(geodata=self.geodata, name='Across Antimeridian', geometry=Point(-179.99, 0))
+        Feature.objects.create(geodata=self.geodata, name='Across Pole', geometry=Point(180, 89.95))
+        # Closer in degrees than the features above, but hundreds of kilometers away
+        for index in range(60):
+            Feature.objects.create(geodata=self.geodata, name=f'East {index}', geometry=Point(170 + index * 0.1, 5))
+            Feature.objects.create(geodata=self.geodata, name=f'North {index}', geometry=Point(index * 0.1, 87.5))
+
+        for near, name in [('179.95,0', 'Across Antimeridian'), ('0,89.9', 'Across Pole')]:
+            response = self.client.get(reverse('feature-list'), {'near': near, 'k': 1})
+            self.assertEqual(response.status_code, 200)
+            features = response.data['features']
+            self.assertEqual([f['properties']['name'] for f in features], [name])
+            self.assertLess(features[0]['properties']['distance_m'], 20000)
+
+    def test_spatial_search(self):
+        """Test POST search with a GeoJSON polygon and different predicates."""
+        Feature.objects.create(geodata=self.geodata, name='Munich', geometry=Point(11.5820, 48.1351))
+        brandenburg = {
+            'type': 'Polygon',
+            'coordinates': [[[11.2, 51.3], [14.8, 51.3], [14.8, 53.6], [11.2, 53.6], [11.2, 51.3]]],
+        }
+        url = reverse('feature-spatial-search')
+
+        response = self.client.post(url, {'geometry': brandenburg, 'predicate': 'within'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([f['properties']['name'] for f in response.data['features']], ['API Test Feature'])
+
+        berlin = {'type': 'Point', 'coordinates': [13.40, 52.52]}
+        response = self.client.post(
+            url, {'geometry': berlin, 'predicate': 'dwithin', 'distance': 600000}, format='json'
+        )
+        names = {f['properties']['name'] for f in response.data['features']}
+        self.assertEqual(names, {'API Test Feature', 'Munich'})
+
+        response = self.client.post(url, {'geometry': berlin, 'predicate': 'dwithin'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # Nearest features among those matching the geometry
+        Feature.objects.create(geodata=self.geodata, name='Potsdam', geometry=Point(13.0645, 52.3906))
+        response = self.client.post(
+            f"{url}?near=11.58,48.14&k=2", {'geometry': brandenburg, 'predicate': 'intersects'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        features = response.data['features']
+        self.assertEqual([f['properties']['name'] for f in features], ['Potsdam', 'API Test Feature'])
+        self.assertGreater(features[0]['properties']['distance_m'], 400000)
+
+        for geometry in [{'type': 'Polygon', 'coordinates': 'x'}, {'type': 'Hexagon', 'coordinates': []}]:
+            response = self.client.post(url, {'geometry': geometry}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('geometry', response.data)
+
+    def test_aggregate_endpoint(self):
+        """Test the spatial-join aggregation of a point and a line layer against a polygon layer."""
+        states = Layer.objects.create(name="States", layer_type='vector')
+        states_geodata = GeoData.objects.create(name="States", layer=states)
+        Feature.objects.create(
+            geodata=states_geodata, name='Berlin State',
+            geometry=Polygon.from_bbox((13.0, 52.3, 13.8, 52.7)),
+        )
+        Feature.objects.create(
+            geodata=states_geodata, name='Bavaria',
+            geometry=Polygon.from_bbox((9.0, 47.3, 13.8, 50.5)),
+        )
+        Feature.objects.create(
+            geodata=self.geodata, name='Spree', geometry=LineString((13.0, 52.5), (13.8, 52.5)),
+        )
+
+        url = reverse('layer-aggregate', kwargs={'pk': states.pk})
+        response = self.client.get(url, {'source': self.layer.pk})
+        self.assertEqual(response.status_code, 200)
+        results = {row['name']: row for row in response.json()['results']}
+        self.assertEqual(results['Berlin State']['count'], 2)
+        self.assertAlmostEqual(results['Berlin State']['length_m'], 54000, delta=2000)
+        self.assertEqual(results['Bavaria']['count'], 0)
+
+
+    def test_trajectory_interpolation(self):
+        """Test that moving features are interpolated between keyframes and hold still on structure changes."""
+        moving = Feature.objects.create(geodata=self.geodata, name='Front', geometry=LineString((0, 0), (0, 10)))
+        FeatureKeyframe.objects.create(
+            feature=moving, time=datetime(1800, 1, 1, tzinfo=dt_timezone.utc), geometry=LineString((0, 0), (0, 10))
+        )
+        FeatureKeyframe.objects.create(
+            feature=moving, time=datetime(1900, 1, 1, tzinfo=dt_timezone.utc), geometry=LineString((10, 0), (10, 10))
+        )
+        FeatureKeyframe.objects.create(
+            feature=moving, time=datetime(2000, 1, 1, tzinfo=dt_timezone.utc), geometry=Point(20, 5)
+        )
+        url = reverse('layer-trajectories', kwargs={'pk': self.layer.pk})
+
+        response = self.client.get(url, {'at': '1850-01-01T00:00:00'})
+        self.assertEqual(response.status_code, 200)
+        feature = response.json()['features'][0]
+        self.assertEqual(feature['id'], moving.pk)
+        self.assertEqual(feature['geometry']['type'], 'LineString')
+        self.assertAlmostEqual(feature['geometry']['coordinates'][0][0], 5.0, places=2)
+        self.assertAlmostEqual(feature['properties']['fraction'], 0.5, places=2)
+
+        # LineString -> Point cannot be blended, the line is kept until the next keyframe
+        response = self.client.get(url, {'at': '1950'})
+        feature = response.json()['features'][0]
+        self.assertEqual(feature['geometry']['coordinates'][0], [10.0, 0.0])
+        self.assertIsNone(feature['properties']['keyframe_to'])
+
+        # Before the first keyframe the trajectory does not exist, `at` is required
+        self.assertEqual(self.client.get(url, {'at': '1700'}).json()['features'], [])
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+
+class CompressionTests(APITestCase):
+
+    def setUp(self):
+        self.layer = Layer.objects.create(name="Compression Layer", layer_type='vector')
+        self.geodata = GeoData.objects.create(name="Compression GeoData", layer=self.layer)
+        Feature.objects.create(geodata=self.geodata, name='Berlin', geometry=Point(13.4050, 52.5200))
+
+    def test_negotiate_encoding(self):
+        """Test that the best accepted encoding is chosen."""
+        available = {'identity': b'', 'gzip': b'', 'br': b''}
+        self.assertEqual(negotiate_encoding('gzip, deflate, br', available), 'br')
+        self.assertEqual(negotiate_encoding('gzip;q=1.0, br;q=0.5', available), 'gzip')
+        self.assertEqual(negotiate_encoding('br', {'identity': b'', 'gzip': b''}), 'identity')
+        self.assertEqual(negotiate_encoding('', available), 'identity')
+
+    @override_settings(PRECOMPRESS_MIN_SIZE=0)
+    def test_layer_data_is_served_gzipped(self):
+        """Test that layer data is served precompressed when the client accepts gzip."""
+        url = reverse('layer-data', kwargs={'pk': self.layer.pk})
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        data = json.loads(gzip.decompress(response.content))
+        self.assertEqual(data['features'][0]['properties']['name'], 'Berlin')
+
+        # A conditional request with the same ETag is answered without a body
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(TILE_CACHE=MEMORY_TILE_CACHE)
+class RasterTests(APITestCase):
+
+    def setUp(self):
+        use_memory_tile_cache(self)
+        caches['default'].clear()
+        self.layer = Layer.objects.create(
+            name="Elevation", layer_type='raster',
+            style_config={'colorRamp': ['#000000', '#ffffff'], 'classes': 2, 'min': 0, 'max': 100},
+        )
+        self.geodata = GeoData.objects.create(name="Elevation GeoData", layer=self.layer, raster_path='dem.tif')
+
+    def test_colorize(self):
+        """Test that values are classified into the colour ramp and pixels without data are transparent."""
+        values = np.array([[[10.0, 90.0, 50.0]]])
+        valid = np.array([[True, True, False]])
+        rgba = colorize(values, valid, self.layer.style_config, None)
+        self.assertEqual(rgba[:, 0, 0].tolist(), [0, 0, 0, 255])
+        self.assertEqual(rgba[:, 0, 1].tolist(), [255, 255, 255, 255])
+        self.assertEqual(rgba[3, 0, 2], 0)
+
+        statistics = ({'min': 0.0, 'max': 50.0, 'p2': 0.0, 'p98': 50.0},)
+        rgba = colorize(values, valid, {'colorRamp': 'greys', 'classes': 2}, statistics)
+        self.assertEqual(rgba[:, 0, 0].tolist(), [0, 0, 0, 255])
+        self.assertEqual(rgba[:, 0, 1].tolist(), [255, 255, 255, 255])
+
+        for style in [{'gamma': 'bright'}, {'gamma': 0}, {'min': [0, 10], 'max': 'high'}]:
+            with self.assertRaises(RasterTileError):
+                colorize(values, valid, style, statistics)
+        with self.assertRaises(RasterTileError):
+            colorize(np.zeros((3, 1, 3)), valid, {'min': [0, 0], 'max': [1, 1, 1]}, statistics * 3)
+        with self.assertRaises(RasterTileError):
+            get_resampling({'resampling': 'sharpest'})
+
+    def test_raster_tile_unavailable(self):
+        """Test that raster tile errors are JSON responses, not payloads labelled as images."""
+        with tempfile.TemporaryDirectory() as raster_root, override_settings(RASTER_ROOT=raster_root):
+            open(f"{raster_root}/dem.tif", 'wb').close()
+            url = reverse('layer-raster', kwargs={'pk': self.layer.pk, 'z': 6, 'x': 34, 'y': 21})
+            with patch('webmap.rasters.gdal', None):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertIn('GDAL', response.json()['detail'])
+
+    @skipIf(gdal is None, "GDAL's Python bindings are not installed")
+    def test_raster_tile(self):
+        """Test that tiles are rendered from the GeoTIFF of a raster layer."""
+        from osgeo import osr
+
+        with tempfile.TemporaryDirectory() as raster_root, override_settings(RASTER_ROOT=raster_root):
+            dataset = gdal.GetDriverByName('GTiff').Create(f"{raster_root}/dem.tif", 80, 64, 1, gdal.GDT_Float32)
+            dataset.SetGeoTransform([5.0, 0.125, 0, 55.0, 0, -0.125])  # lon 5-15, lat 47-55
+            srs = osr.SpatialReference()
+            srs.ImportFromEPSG(4326)
+            dataset.SetProjection(srs.ExportToWkt())
+            dataset.GetRasterBand(1).WriteArray(np.tile(np.linspace(0, 100, 80, dtype=np.float32), (64, 1)))
+            dataset = None  # Flush to disk
+
+            z = 6
+            x, y = lonlat_to_tile(13.4050, 52.5200, z)
+            url = reverse('layer-raster', kwargs={'pk': self.layer.pk, 'z': z, 'x': x, 'y': y})
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertTrue(response.content.startswith(b'\x89PNG'))
+
+            self.layer.style_config = {**self.layer.style_config, 'resampling': 'sharpest'}
+            self.layer.save()
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertIn('style_config', response.json())
+
+            self.geodata.raster_path = '../dem.tif'
+            self.geodata.save()
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class TileCacheTests(APITestCase):
+
+    def setUp(self):
+        self.layer = Layer.objects.create(name="Tile Layer", layer_type='vector')
+        self.geodata = GeoData.objects.create(name="Tile GeoData", layer=self.layer)
+        Feature.objects.create(
+            geodata=self.geodata, name='Berlin', geometry=Point(13.4050, 52.5200),
+            time_from=datetime(1237, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        Feature.objects.create(
+            geodata=self.geodata, name='Bonn', geometry=Point(7.0982, 50.7374),
+            time_from=datetime(1949, 1, 1, tzinfo=dt_timezone.utc),
+        )
+
+    def test_time_bucket(self):
+        """Test that times between two boundaries of a layer share a bucket."""
+        boundaries = ([1237, 1949], [1990])
+        self.assertEqual(time_bucket(boundaries, 1500), time_bucket(boundaries, 1900))
+        self.assertNotEqual(time_bucket(boundaries, 1900), time_bucket(boundaries, 1949))
+        self.assertEqual(time_bucket(boundaries, 1990), time_bucket(boundaries, 1960))
+        self.assertNotEqual(time_bucket(boundaries, 1990), time_bucket(boundaries, 1991))
+        self.assertEqual(time_bucket(boundaries, None), 'all')
+
+    def test_eviction(self):
+        """Test that both tiers evict the least recently used tiles once they are full."""
+        content_type = 'application/vnd.mapbox-vector-tile'
+        entries = {y: build_entry(bytes([y]) * 100, content_type) for y in range(3)}
+        keys = {y: tile_key('vector', self.layer.pk, 'v1', 5, 1, y) for y in range(3)}
+        with tempfile.TemporaryDirectory() as root:
+            cache = TileCache(memory_bytes=250, root=root, disk_bytes=250)
+            cache.set(keys[0], entries[0], content_type)
+            cache.set(keys[1], entries[1], content_type)
+            self.assertEqual(cache.get(keys[0], content_type)['variants'], entries[0]['variants'])
+            cache.set(keys[2], entries[2], content_type)
+            self.assertEqual(list(cache._memory), [keys[0], keys[2]])
+            self.assertLessEqual(cache.measure_disk(), 250)
+
+            # A new process reads what is left on disk
+            cache = TileCache(memory_bytes=250, root=root, disk_bytes=250)
+            self.assertEqual(cache.get(keys[2], content_type)['etag'], entries[2]['etag'])
+
+            # A new version replaces the tiles of the old one
+            cache.set(tile_key('vector', self.layer.pk, 'v2', 5, 1, 0), entries[0], content_type)
+            self.assertFalse(TileCache(root=root).has(keys[2], content_type))
+
+    def test_tile_is_cached_per_time_bucket(self):
+        """Test that tiles at times showing the same features are rendered once."""
+        z = 5
+        x, y = lonlat_to_tile(13.4050, 52.5200, z)
+        url = reverse('layer-tile', kwargs={'pk': self.layer.pk, 'z': z, 'x': x, 'y': y})
+        with tempfile.TemporaryDirectory() as root, override_settings(TILE_CACHE={'ROOT': root}):
+            reset_tile_cache()
+            try:
+                first = self.client.get(url, {'at': '1800'})
+                self.assertEqual(first.status_code, 200)
+                with patch('webmap.views.render_vector_tile', side_effect=AssertionError('not cached')):
+                    second = self.client.get(url, {'at': '1900'})
+                self.assertEqual(second.content, first.content)
+                self.assertNotEqual(self.client.get(url, {'at': '1950'})['ETag'], first['ETag'])
+            finally:
+                reset_tile_cache()
 
 class ManagementCommandTests(TransactionTestCase):
 
@@ -118,3 +756,324 @@ class ManagementCommandTests(TransactionTestCase):
         call_command('load_germany_sample_data')
         self.assertTrue(Layer.objects.filter(name="Major Cities").exists())
         self.assertTrue(Feature.objects.filter(name="Berlin").exists())
+
+    def test_bake_snapshots_command(self):
+        """Test that bake_snapshots writes files and a manifest that can be served without the database."""
+        call_command('load_germany_sample_data')
+        layer = Layer.objects.get(name="German Major Cities")
+        with tempfile.TemporaryDirectory() as snapshot_root, override_settings(SNAPSHOT_ROOT=snapshot_root):
+            call_command('bake_snapshots', layer=[layer.pk], steps='1800', zoom_bands='0-5', formats='geojson')
+            with open(f"{snapshot_root}/manifest.json") as fh:
+                manifest = json.load(fh)
+            entry = manifest['layers'][str(layer.pk)]
+            self.assertEqual(entry['version'], layer.get_data_version())
+
+            response = self.client.get(reverse('snapshot', kwargs={'layer_id': layer.pk, 'name': '1800-01-01/0-5.geojson'}))
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(b''.join(response.streaming_content))
+            self.assertIn('Berlin', [f['properties']['name'] for f in data['features']])
+
+    def test_partition_features_command(self):
+        """Test that partitioning keeps the data usable and --sync moves new datasets into own partitions."""
+        call_command('load_germany_sample_data')
+        count = Feature.objects.count()
+        # DDL is transactional: rolling back restores the plain features table for the other tests
+        with transaction.atomic():
+            call_command('partition_features', convert=True, strategy='list', eras='1800', stdout=StringIO())
+            self.assertEqual(Feature.objects.count(), count)
+
+            layer = Layer.objects.create(name="Partitioned Layer", layer_type='vector')
+            geodata = GeoData.objects.create(name="Partitioned GeoData", layer=layer)
+            feature = Feature.objects.create(geodata=geodata, name='Potsdam', geometry=Point(13.0645, 52.3906))
+            dated = Feature.objects.create(
+                geodata=geodata, name='Sanssouci', geometry=Point(13.0384, 52.4043),
+                time_from=datetime(1747, 5, 1, tzinfo=dt_timezone.utc),
+            )
+            out = StringIO()
+            call_command('partition_features', sync=True, stdout=out)
+            self.assertIn(f"features_g{geodata.pk}", out.getvalue())
+            self.assertEqual(Feature.objects.get(pk=feature.pk).name, 'Potsdam')
+            self.assertEqual(Feature.objects.get(pk=dated.pk).name, 'Sanssouci')
+            self.assertEqual(Feature.objects.count(), count + 2)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT conrelid::regclass::text FROM pg_constraint WHERE contype = 'p' "
+                    "AND conrelid::regclass::text LIKE %s ORDER BY 1",
+                    [f"features_g{geodata.pk}%"],
+                )
+                self.assertEqual(
+                    [row[0] for row in cursor.fetchall()],
+                    [f"features_g{geodata.pk}_e0", f"features_g{geodata.pk}_e1", f"features_g{geodata.pk}_enull"],
+                )
+            transaction.set_rollback(True)
+
+        with connection.cursor() as cursor:
+            self.assertFalse(is_partitioned(cursor))
+
+    def test_benchmark_queries_command(self):
+        """Test that benchmark_queries runs the prepared and unprepared hot queries."""
+        call_command('load_germany_sample_data')
+        out = StringIO()
+        call_command('benchmark_queries', iterations=2, warmup=1, stdout=out)
+        for name in ('layer data', 'bbox + at', 'tile + at'):
+            self.assertIn(name, out.getvalue())
+
+    def test_seed_tiles_command(self):
+        """Test that seed_tiles fills the tile cache and skips tiles cached before."""
+        call_command('load_germany_sample_data')
+        layer = Layer.objects.get(name="German Major Cities")
+        with tempfile.TemporaryDirectory() as root, override_settings(TILE_CACHE={'ROOT': root}):
+            reset_tile_cache()
+            try:
+                out = StringIO()
+                call_command('seed_tiles', layer=[layer.pk], zoom='0-4', at='1900', workers=2, stdout=out)
+                self.assertIn('0 failed', out.getvalue())
+
+                out = StringIO()
+                call_command('seed_tiles', layer=[layer.pk], zoom='0-4', at='1900', stdout=out)
+                self.assertIn(' 0 rendered', out.getvalue())
+            finally:
+                reset_tile_cache()
+
+
+
+@override_settings(TILE_CACHE=MEMORY_TILE_CACHE)
+class LoadTestCommandTests(LiveServerTestCase):
+
+    def setUp(self):
+        use_memory_tile_cache(self)
+        layer = Layer.objects.create(name="Load Test Layer", layer_type='vector')
+        geodata = GeoData.objects.create(name="Load Test GeoData", layer=layer)
+        Feature.objects.create(
+            geodata=geodata, name='Berlin', geometry=Point(13.4050, 52.5200),
+            time_from=datetime(1237, 1, 1, tzinfo=dt_timezone.utc),
+        )
+
+    def test_load_test_command(self):
+        """Test that load_test runs all sessions against a live server and reports them."""
+        out = StringIO()
+        call_command(
+            'load_test', url=f"{self.live_server_url}/api/", users=2, duration=2, ramp_up=0, think_time=0,
+            sample_interval=0.5, seed=1, stdout=out,
+        )
+        output = out.getvalue()
+        self.assertIn(' 0 errors', output)
+        self.assertIn('p99 ms', output)
+        self.assertIn('Database connections', output)
+
+
+class HistoryTests(TransactionTestCase):
+    """History rows carry the transaction start time, so each edit needs its own transaction."""
+
+    def setUp(self):
+        Feature.objects.all().delete()
+        GeoData.objects.all().delete()
+        Layer.objects.all().delete()
+        FeatureHistory.objects.all().delete()
+        caches['default'].clear()
+        self.layer = Layer.objects.create(name="History Layer", layer_type='vector')
+        self.geodata = GeoData.objects.create(name="History GeoData", layer=self.layer)
+
+    def test_as_of(self):
+        """Test that edits and deletes are recorded and `as_of` returns the features as they were stored."""
+        berlin = Feature.objects.create(geodata=self.geodata, name='Berlin', geometry=Point(13.4050, 52.5200))
+        bonn = Feature.objects.create(geodata=self.geodata, name='Bonn', geometry=Point(7.0982, 50.7374))
+        before_edits = FeatureHistory.objects.latest('id').changed_at.isoformat()
+
+        berlin.name = 'Berlin (Ost)'
+        berlin.geometry = Point(13.4, 52.5)
+        berlin.save()
+        bonn.delete()
+        operations = list(
+            FeatureHistory.objects.filter(feature_id__in=[berlin.pk, bonn.pk]).order_by('id')
+            .values_list('feature_id', 'operation')
+        )
+        self.assertEqual(operations, [(berlin.pk, 'I'), (bonn.pk, 'I'), (berlin.pk, 'U'), (bonn.pk, 'D')])
+
+        url = reverse('layer-data', kwargs={'pk': self.layer.pk})
+        response = self.client.get(url, {'as_of': before_edits})
+        self.assertEqual(response.status_code, 200)
+        features = json.loads(response.content)['features']
+        self.assertEqual([f['properties']['name'] for f in features], ['Berlin', 'Bonn'])
+        self.assertEqual(features[0]['geometry']['coordinates'], [13.4050, 52.5200])
+
+        response = self.client.get(url)
+        self.assertEqual([f['properties']['name'] for f in json.loads(response.content)['features']], ['Berlin (Ost)'])
+
+        response = self.client.get(
+            reverse('feature-list'), {'geodata__layer': self.layer.pk, 'as_of': before_edits, 'in_bbox': '6,50,8,51'}
+        )
+        self.assertEqual([f['properties']['name'] for f in response.json()['features']], ['Bonn'])
+
+        response = self.client.get(reverse('feature-list'), {'as_of': before_edits, 'search': 'Berlin'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('as_of', response.json())
+
+    def test_changes(self):
+        """Test that delta sync returns changed features, tombstones of deleted ones and a new cursor."""
+        berlin = Feature.objects.create(geodata=self.geodata, name='Berlin', geometry=Point(13.4050, 52.5200))
+        bonn = Feature.objects.create(geodata=self.geodata, name='Bonn', geometry=Point(7.0982, 50.7374))
+        url = reverse('layer-changes', kwargs={'pk': self.layer.pk})
+
+        data = self.client.get(url).json()
+        self.assertEqual([f['properties']['name'] for f in data['features']], ['Berlin', 'Bonn'])
+        self.assertEqual(data['deleted'], [])
+        cursor = data['cursor']
+
+        data = self.client.get(url, {'since': cursor}).json()
+        self.assertEqual((data['features'], data['deleted']), ([], []))
+
+        berlin.name = 'Berlin (Ost)'
+        berlin.save()
+        bonn.delete()
+        potsdam = Feature.objects.create(
+            geodata=self.geodata, name='Potsdam', geometry=Point(13.0645, 52.3906),
+            _attributes={'population': 183000, 'style': {'dashArray': '4'}},
+        )
+        data = self.client.get(url, {'since': cursor}).json()
+        self.assertEqual([f['id'] for f in data['features']], [berlin.pk, potsdam.pk])
+        self.assertEqual(data['features'][0]['properties']['name'], 'Berlin (Ost)')
+        self.assertEqual(data['features'][1]['properties']['attributes']['population'], 183000)
+        self.assertEqual(data['features'][1]['properties']['effective_style'], {'dashArray': '4'})
+
+        data = self.client.get(url, {'since': cursor, 'compact': 'true'}).json()
+        self.assertEqual(data['features'][1]['properties']['attributes'], {'name': 'Potsdam', 'population': 183000})
+        self.assertEqual(data['styles'][data['features'][1]['properties']['style']], {'dashArray': '4'})
+        self.assertEqual(data['deleted'], [bonn.pk])
+        self.assertGreater(int(data['cursor']), int(cursor))
+
+        response = self.client.get(url, {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+def closing_async_pools(test):
+    """Pool connections like under ASGI and close the pools at the end, each test runs in its own event loop."""
+    @functools.wraps(test)
+    async def wrapper(self, *args, **kwargs):
+        use_async_pools()
+        try:
+            await test(self, *args, **kwargs)
+        finally:
+            use_async_pools(False)
+            await close_async_pools()
+    return wrapper
+
+
+@override_settings(TILE_CACHE=MEMORY_TILE_CACHE)
+class AsyncViewTests(TransactionTestCase):
+    """The async endpoints read through their own connection pool, so the data must be committed."""
+
+    def setUp(self):
+        use_memory_tile_cache(self)
+        Feature.objects.all().delete()
+        GeoData.objects.all().delete()
+        Layer.objects.all().delete()
+        caches['default'].clear()
+        self.layer = Layer.objects.create(name="Async Layer", layer_type='vector', style_config={'color': '#112233'})
+        self.geodata = GeoData.objects.create(name="Async GeoData", layer=self.layer)
+        Feature.objects.create(
+            geodata=self.geodata, name='Berlin', geometry=Point(13.4050, 52.5200),
+            time_from=datetime(1237, 1, 1, tzinfo=dt_timezone.utc),
+        )
+        Feature.objects.create(
+            geodata=self.geodata, name='Bonn', geometry=Point(7.0982, 50.7374), style_color='#ff0000',
+            time_from=datetime(1949, 1, 1, tzinfo=dt_timezone.utc),
+        )
+
+    @closing_async_pools
+    async def test_async_layer_data_matches_sync(self):
+        """Test that the async layer data endpoint returns the same bytes as the sync one."""
+        url = reverse('async-layer-data', kwargs={'layer_id': self.layer.pk})
+        response = await self.async_client.get(url, {'at': '1800'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([f['properties']['name'] for f in json.loads(response.content)['features']], ['Berlin'])
+
+        await caches['default'].aclear()
+        sync_url = reverse('layer-data', kwargs={'pk': self.layer.pk})
+        sync_response = await sync_to_async(self.client.get)(sync_url, {'at': '1800'})
+        self.assertEqual(response.content, sync_response.content)
+
+    async def test_async_views_without_pools(self):
+        """Test that outside ASGI (e.g. runserver) the async views keep no pool on their short-lived loop."""
+        url = reverse('async-layer-data', kwargs={'layer_id': self.layer.pk})
+        with patch('webmap.db.get_async_pool') as get_async_pool:
+            response = await self.async_client.get(url, {'at': '1800'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([f['properties']['name'] for f in json.loads(response.content)['features']], ['Berlin'])
+        get_async_pool.assert_not_called()
+
+    @closing_async_pools
+    async def test_async_layer_data_shares_cache_key(self):
+        """Test that the sync and async layer data views cache under the same key, including `as_of`."""
+        params = {'at': '1800', 'as_of': '2100-01-01T00:00:00Z'}
+        with (
+            patch('webmap.async_views.layer_data_cache_key', wraps=layer_data_cache_key) as async_key,
+            patch('webmap.views.layer_data_cache_key', wraps=layer_data_cache_key) as sync_key,
+        ):
+            url = reverse('async-layer-data', kwargs={'layer_id': self.layer.pk})
+            response = await self.async_client.get(url, params)
+            await caches['default'].aclear()
+            sync_url = reverse('layer-data', kwargs={'pk': self.layer.pk})
+            sync_response = await sync_to_async(self.client.get)(sync_url, params)
+        self.assertEqual(async_key.call_args, sync_key.call_args)
+        self.assertEqual(response.content, sync_response.content)
+        self.assertEqual([f['properties']['name'] for f in json.loads(response.content)['features']], ['Berlin'])
+
+        response = await self.async_client.get(url, {'as_of': 'not-a-date'})
+        self.assertEqual(response.status_code, 400)
+
+    @closing_async_pools
+    async def test_async_feature_list(self):
+        """Test the layer, bbox and time filters of the async feature list."""
+        url = reverse('async-feature-list')
+        response = await self.async_client.get(url, {'geodata__layer': self.layer.pk, 'in_bbox': '12,52,14,53'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([f['properties']['name'] for f in json.loads(response.content)['features']], ['Berlin'])
+
+        response = await self.async_client.get(url, {'at': 'not-a-date'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('at', json.loads(response.content))
+
+    @closing_async_pools
+    async def test_async_tile(self):
+        """Test that the async tile endpoint renders a non-empty tile and rejects invalid coordinates."""
+        z = 5
+        x, y = lonlat_to_tile(13.4050, 52.5200, z)
+        response = await self.async_client.get(
+            reverse('async-layer-tile', kwargs={'layer_id': self.layer.pk, 'z': z, 'x': x, 'y': y})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content)
+
+        response = await self.async_client.get(
+            reverse('async-layer-tile', kwargs={'layer_id': self.layer.pk, 'z': 1, 'x': 5, 'y': 0})
+        )
+        self.assertEqual(response.status_code, 404)
+
+    @closing_async_pools
+    async def test_feature_events(self):
+        """Test that feature writes are pushed to subscribed event streams."""
+        other_layer = await Layer.objects.acreate(name="Other Layer", layer_type='vector')
+        other_geodata = await GeoData.objects.acreate(name="Other GeoData", layer=other_layer)
+        response = await self.async_client.get(reverse('async-feature-events'), {'layers': str(self.layer.pk)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        try:
+            self.assertTrue((await anext(stream)).startswith(b'retry:'))
+            await Feature.objects.acreate(geodata=other_geodata, name='Wien', geometry=Point(16.37, 48.21))
+            feature = await Feature.objects.acreate(geodata=self.geodata, name='Köln', geometry=Point(6.96, 50.94))
+
+            chunk = b''
+            while not chunk.startswith(b'event:'):
+                chunk = await asyncio.wait_for(anext(stream), timeout=10)
+            self.assertTrue(chunk.startswith(b'event: change\n'))
+            event = json.loads(chunk.split(b'data: ', 1)[1])
+            self.assertEqual(event['feature_id'], feature.pk)
+            self.assertEqual(event['layer_id'], self.layer.pk)
+            self.assertEqual(event['operation'], 'insert')
+        finally:
+            await stream.aclose()
+            await asyncio.to_thread(stop_listener, 10)
+
+        response = await self.async_client.get(reverse('async-feature-events'), {'layers': 'x'})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,332 @@
+"""
+Two-tier cache of rendered tiles: an in-process LRU for hot tiles in front of a
+size-capped directory shared by all worker processes.
+
+Entries are the precompressed entries of webmap/compression.py, so a hit costs
+neither a PostGIS/GDAL render nor a compression pass. On disk every encoding is a
+file of its own (`<y>-<bucket>.mvt`, `.mvt.gz`, `.mvt.br`), laid out like the baked
+snapshots. Files are evicted least recently used first once TILE_CACHE['DISK_BYTES']
+is exceeded, and a new layer version replaces the directory of the previous one.
+
+Tiles are keyed by layer version, z/x/y and a time bucket instead of the raw `at`:
+the features visible at `at` only change at the `time_from`/`time_to` values of the
+layer, so all times between two consecutive values share one tile. Scrubbing a time
+slider therefore hits the cache for every position between two events of the layer.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import threading
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from pathlib import Path
+
+from django.conf import settings
+
+from .compression import build_entry, response_for_entry
+from .db import execute_one, fetch_one
+from .snapshots import ENCODING_SUFFIXES, write_file
+
+
+logger = logging.getLogger(__name__)
+
+TILE_EXTENSIONS = {
+    'application/vnd.mapbox-vector-tile': 'mvt',
+    'image/png': 'png',
+    'image/webp': 'webp',
+}
+
+TIME_BOUNDARIES_SQL = """
+SELECT
+    COALESCE(array_agg(DISTINCT f.time_from ORDER BY f.time_from) FILTER (WHERE f.time_from IS NOT NULL), '{}')
+        AS time_from,
+    COALESCE(array_agg(DISTINCT f.time_to ORDER BY f.time_to) FILTER (WHERE f.time_to IS NOT NULL), '{}')
+        AS time_to
+FROM features f
+WHERE f.geodata_id = %(geodata_id)s
+"""
+
+TIME_BOUNDARIES_CACHE_SIZE = 256
+
+_time_boundaries = OrderedDict()
+_time_boundaries_lock = threading.Lock()
+
+
+def time_bucket(boundaries, at):
+    """
+    Return a token shared by all times at which the same features are visible.
+    `boundaries` is the pair of sorted distinct time_from and time_to values of the layer.
+    """
+    if at is None:
+        return 'all'
+    time_from, time_to = boundaries
+    # Visible: time_from <= at (a prefix of time_from) and not time_to < at (a prefix of time_to)
+    return f"{bisect_right(time_from, at)}-{bisect_left(time_to, at)}"
+
+
+def _cached_boundaries(geodata_id, version):
+    with _time_boundaries_lock:
+        boundaries = _time_boundaries.get((geodata_id, version))
+        if boundaries is not None:
+            _time_boundaries.move_to_end((geodata_id, version))
+        return boundaries
+
+
+def _store_boundaries(geodata_id, version, row):
+    boundaries = (list(row['time_from']), list(row['time_to']))
+    with _time_boundaries_lock:
+        _time_boundaries[(geodata_id, version)] = boundaries
+        while len(_time_boundaries) > TIME_BOUNDARIES_CACHE_SIZE:
+            _time_boundaries.popitem(last=False)
+    return boundaries
+
+
+def get_time_bucket(geodata_id, version, at):
+    """Time bucket of `at` for a dataset at a layer version, see time_bucket."""
+    if at is None:
+        return 'all'
+    boundaries = _cached_boundaries(geodata_id, version)
+    if boundaries is None:
+        row = execute_one(TIME_BOUNDARIES_SQL, {'geodata_id': geodata_id})
+        boundaries = _store_boundaries(geodata_id, version, row)
+    return time_bucket(boundaries, at)
+
+
+async def aget_time_bucket(geodata_id, version, at):
+    """Async variant of get_time_bucket, reading through the async pool."""
+    if at is None:
+        return 'all'
+    boundaries = _cached_boundaries(geodata_id, version)
+    if boundaries is None:
+        row = await fetch_one(TIME_BOUNDARIES_SQL, {'geodata_id': geodata_id})
+        boundaries = _store_boundaries(geodata_id, version, row)
+    return time_bucket(boundaries, at)
+
+
+def tile_key(kind, layer_id, version, z, x, y, bucket='all', image_format=None):
+    """Cache key of a tile; `kind` separates e.g. vector from raster tiles of the same layer."""
+    return (kind, int(layer_id), str(version), int(z), int(x), int(y), str(bucket), image_format or '')
+
+
+def entry_size(entry):
+    return sum(len(variant) for variant in entry['variants'].values())
+
+
+class TileCache:
+    """In-process LRU of tile entries (capped in bytes) backed by an optional size-capped directory."""
+
+    def __init__(self, memory_bytes=64 * 1024 ** 2, root=None, disk_bytes=1024 ** 3):
+        self.memory_bytes = memory_bytes
+        self.root = Path(root) if root else None
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_usage = 0
+        self._disk_usage = None  # Measured on first write
+        self._versions = {}  # (kind, layer_id) -> version directory last written by this process
+        self._lock = threading.Lock()
+        self._disk_lock = threading.Lock()
+
+    def get_path(self, key, content_type):
+        """Path of the identity variant of a tile on disk."""
+        kind, layer_id, version, z, x, y, bucket, _ = key
+        directory = self.root / kind / str(layer_id) / self.version_dir(version) / str(z) / str(x)
+        return directory / f"{y}-{bucket}.{TILE_EXTENSIONS[content_type]}"
+
+    @staticmethod
+    def version_dir(version):
+        return hashlib.sha1(version.encode('utf-8')).hexdigest()[:12]
+
+    def get(self, key, content_type):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+        entry = self.read_disk(key, content_type)
+        if entry is not None:
+            self.remember(key, entry)
+        return entry
+
+    def has(self, key, content_type):
+        """Whether a tile is cached in either tier, without loading it."""
+        with self._lock:
+            if key in self._memory:
+                return True
+        return self.root is not None and self.get_path(key, content_type).is_file()
+
+    def set(self, key, entry, content_type):
+        self.remember(key, entry)
+        self.write_disk(key, entry, content_type)
+
+    def get_or_render(self, key, render, content_type):
+        """Return the entry of a tile, calling `render()` for its raw bytes on a miss in both tiers."""
+        entry = self.get(key, content_type)
+        if entry is None:
+            entry = build_entry(render(), content_type)
+            self.set(key, entry, content_type)
+        return entry
+
+    def remember(self, key, entry):
+        size = entry_size(entry)
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_usage -= entry_size(previous)
+            self._memory[key] = entry
+            self._memory_usage += size
+            while self._memory_usage > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_usage -= entry_size(evicted)
+
+    def read_disk(self, key, content_type):
+        if self.root is None:
+            return None
+        path = self.get_path(key, content_type)
+        variants = {}
+        for encoding, suffix in ENCODING_SUFFIXES.items():
+            try:
+                with open(f"{path}{suffix}", 'rb') as fh:
+                    variants[encoding] = fh.read()
+            except FileNotFoundError:
+                continue
+        if 'identity' not in variants:
+            return None
+        try:
+            os.utime(path)  # Recently used, see evict()
+        except OSError:
+            pass
+        return {
+            'content_type': content_type,
+            'etag': '"%s"' % hashlib.sha1(variants['identity']).hexdigest(),
+            'variants': variants,
+        }
+
+    def write_disk(self, key, entry, content_type):
+        if self.root is None:
+            return
+        path = self.get_path(key, content_type)
+        try:
+            self.replace_old_version(key)
+            written = 0
+            for encoding, content in entry['variants'].items():
+                write_file(f"{path}{ENCODING_SUFFIXES[encoding]}", content)
+                written += len(content)
+        except OSError:
+            # A full disk or a concurrent writer of the same tile only costs a cache miss
+            logger.warning("Could not write tile %s to the disk cache", path, exc_info=True)
+            return
+        with self._disk_lock:
+            if self._disk_usage is None:
+                self._disk_usage = self.measure_disk()
+            else:
+                self._disk_usage += written
+            if self._disk_usage > self.disk_bytes:
+                self._disk_usage = self.evict()
+
+    def replace_old_version(self, key):
+        """Remove the directories of other versions the first time a layer version is written."""
+        kind, layer_id, version = key[:3]
+        directory = self.version_dir(version)
+        if self._versions.get((kind, layer_id)) == directory:
+            return
+        layer_root = self.root / kind / str(layer_id)
+        if layer_root.is_dir():
+            for child in layer_root.iterdir():
+                if child.name != directory:
+                    shutil.rmtree(child, ignore_errors=True)
+        self._versions[(kind, layer_id)] = directory
+        with self._disk_lock:
+            self._disk_usage = None  # Re-measured on the next write
+
+    def scan_disk(self):
+        """Yield (path, stat) of all files, skipping those deleted meanwhile by other workers."""
+        for path in self.root.rglob('*'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.is_file():
+                yield path, stat
+
+    def measure_disk(self):
+        return sum(stat.st_size for _, stat in self.scan_disk())
+
+    def evict(self):
+        """Delete the least recently used tiles until the cache uses 90% of its cap. Returns the new usage."""
+        tiles = {}
+        for path, stat in self.scan_disk():
+            base = str(path)
+            for suffix in ('.gz', '.br', '.tmp'):
+                if base.endswith(suffix):
+                    base = base[:-len(suffix)]
+            tile = tiles.setdefault(base, {'paths': [], 'size': 0, 'used': 0})
+            tile['paths'].append(path)
+            tile['size'] += stat.st_size
+            tile['used'] = max(tile['used'], stat.st_mtime)
+
+        usage = sum(tile['size'] for tile in tiles.values())
+        target = self.disk_bytes * 0.9
+        for tile in sorted(tiles.values(), key=lambda tile: tile['used']):
+            if usage <= target:
+                break
+            for path in tile['paths']:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            usage -= tile['size']
+        return usage
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_usage = 0
+        if self.root is not None:
+            shutil.rmtree(self.root, ignore_errors=True)
+        self._versions.clear()
+        self._disk_usage = None
+
+
+_tile_cache = None
+_tile_cache_lock = threading.Lock()
+
+
+def get_tile_cache():
+    """The tile cache of this process, configured by TILE_CACHE."""
+    global _tile_cache
+    with _tile_cache_lock:
+        if _tile_cache is None:
+            config = getattr(settings, 'TILE_CACHE', {})
+            _tile_cache = TileCache(
+                memory_bytes=config.get('MEMORY_BYTES', 64 * 1024 ** 2),
+                root=config.get('ROOT'),
+                disk_bytes=config.get('DISK_BYTES', 1024 ** 3),
+            )
+        return _tile_cache
+
+
+def reset_tile_cache():
+    """Drop the cache of this process, e.g. after changing TILE_CACHE in tests."""
+    global _tile_cache
+    with _tile_cache_lock:
+        _tile_cache = None
+
+
+def tile_response(request, key, render, content_type):
+    """Serve a tile from the tile cache, rendering it with `render()` on a miss."""
+    return response_for_entry(request, get_tile_cache().get_or_render(key, render, content_type))
+
+
+async def atile_response(request, key, render, content_type):
+    """Async variant of tile_response, `render` is a coroutine function; disk access runs in worker threads."""
+    cache = get_tile_cache()
+    entry = await asyncio.to_thread(cache.get, key, content_type)
+    if entry is None:
+        raw = await render()
+        entry = await asyncio.to_thread(build_entry, raw, content_type)
+        await asyncio.to_thread(cache.set, key, entry, content_type)
+    return response_for_entry(request, entry)
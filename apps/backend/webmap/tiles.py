@@ -0,0 +1,108 @@
+"""
+Vector tile (MVT) generation for feature layers.
+
+Tiles are rendered in PostGIS with ST_AsMVT, so only the features that touch
+the tile are read and clipped. Coordinates follow the XYZ (slippy map) scheme.
+"""
+import math
+
+from .db import execute_one
+
+
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+MAX_ZOOM = 22
+MAX_LATITUDE = 85.0511287798
+
+
+TILE_SQL = """
+WITH bounds AS (
+    SELECT
+        ST_TileEnvelope(%(z)s, %(x)s, %(y)s) AS geom_3857,
+        ST_Transform(ST_TileEnvelope(%(z)s, %(x)s, %(y)s, margin => %(margin)s), 4326) AS geom_4326
+),
+mvtgeom AS (
+    SELECT
+        f.id,
+        ST_AsMVTGeom(ST_Transform(f.geometry, 3857), bounds.geom_3857, %(extent)s, %(buffer)s, true) AS geom,
+        f.name,
+        f.style_color,
+        f.style_opacity,
+        f.style_weight,
+        f.zoom_range,
+        to_json(f.time_from) #>> '{{}}' AS time_from,
+        to_json(f.time_to) #>> '{{}}' AS time_to
+    FROM features f, bounds
+    WHERE f.geodata_id = %(geodata_id)s
+      AND f.geometry && bounds.geom_4326
+      {temporal_filter}
+)
+SELECT ST_AsMVT(mvtgeom.*, %(layer_name)s, %(extent)s, 'geom', 'id') AS tile
+FROM mvtgeom
+WHERE mvtgeom.geom IS NOT NULL
+"""
+
+TEMPORAL_FILTER_SQL = """
+      AND (f.time_from IS NULL OR f.time_from <= %(at)s)
+      AND (f.time_to IS NULL OR f.time_to >= %(at)s)
+"""
+
+
+def is_valid_tile(z, x, y):
+    """Return True if z/x/y addresses an existing XYZ tile."""
+    return 0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def lonlat_to_tile(lon, lat, z):
+    """Return the x/y index of the tile at zoom `z` containing lon/lat."""
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_bounds(z, x, y):
+    """Return the (west, south, east, north) bounds of a tile in EPSG:4326."""
+    n = 2 ** z
+
+    def lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def tiles_for_bbox(bbox, z):
+    """Yield (x, y) for every tile at zoom `z` intersecting a (west, south, east, north) bbox."""
+    west, south, east, north = bbox
+    min_x, min_y = lonlat_to_tile(west, north, z)
+    max_x, max_y = lonlat_to_tile(east, south, z)
+    for x in range(min_x, max_x + 1):
+        for y in range(min_y, max_y + 1):
+            yield x, y
+
+
+def build_tile_query(geodata_id, z, x, y, at=None, layer_name=None):
+    """Return the (sql, params) pair that renders one vector tile."""
+    sql = TILE_SQL.format(temporal_filter=TEMPORAL_FILTER_SQL if at is not None else '')
+    params = {
+        'geodata_id': geodata_id,
+        'z': z,
+        'x': x,
+        'y': y,
+        'extent': MVT_EXTENT,
+        'buffer': MVT_BUFFER,
+        'margin': MVT_BUFFER / MVT_EXTENT,
+        'layer_name': layer_name or f"geodata_{geodata_id}",
+    }
+    if at is not None:
+        params['at'] = at
+    return sql, params
+
+
+def render_vector_tile(layer, z, x, y, at=None):
+    """Render a single MVT tile for a layer, optionally restricted to features visible `at` a time."""
+    sql, params = build_tile_query(layer.geodata.pk, z, x, y, at=at, layer_name=f"layer_{layer.pk}")
+    # Prepared once per connection, later tiles only bind new parameters
+    row = execute_one(sql, params)
+    return bytes(row['tile']) if row and row['tile'] is not None else b''
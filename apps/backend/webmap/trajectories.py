@@ -0,0 +1,219 @@
+"""
+Moving features: geometries interpolated between time-stamped keyframes (FeatureKeyframe).
+
+All keyframes of a layer are packed once per layer version into flat NumPy arrays
+(keyframe times, coordinate offsets and one coordinate buffer), so the state of
+every trajectory at a point in time is computed with a handful of vectorized
+operations instead of a Python loop over features and vertices:
+
+    1. a binary search finds the keyframes before and after `at` for all trajectories,
+    2. consecutive keyframes with the same geometry structure are blended vertex by vertex,
+       others keep the earlier geometry until the next keyframe.
+
+A trajectory exists from its first to its last keyframe; the feature's own
+time_from/time_to still apply on top of that.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.contrib.gis.db.models.functions import AsGeoJSON
+from django.db.models import Count, Max
+
+from .models import FeatureKeyframe
+
+
+def flatten_coordinates(coordinates):
+    """Split nested GeoJSON coordinates into a flat list of [x, y] positions and their nesting shape."""
+    if coordinates and isinstance(coordinates[0], (int, float)):
+        return [coordinates[:2]], None
+    if not coordinates or isinstance(coordinates[0][0], (int, float)):
+        return [position[:2] for position in coordinates], len(coordinates)
+    positions, shape = [], []
+    for child in coordinates:
+        child_positions, child_shape = flatten_coordinates(child)
+        positions.extend(child_positions)
+        shape.append(child_shape)
+    return positions, shape
+
+
+def unflatten_coordinates(shape, positions, start=0):
+    """Inverse of flatten_coordinates, returns (coordinates, index of the next position)."""
+    if shape is None:
+        return positions[start], start + 1
+    if isinstance(shape, int):
+        return positions[start:start + shape], start + shape
+    coordinates = []
+    for child_shape in shape:
+        child, start = unflatten_coordinates(child_shape, positions, start)
+        coordinates.append(child)
+    return coordinates, start
+
+
+def ragged_arange(starts, counts):
+    """Concatenation of arange(start, start + count) for all pairs, without a Python loop."""
+    total = int(counts.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = np.cumsum(counts)
+    return np.arange(total, dtype=np.int64) - np.repeat(ends - counts, counts) + np.repeat(starts, counts)
+
+
+def to_epoch(value):
+    """Seconds since the epoch as int, for aware datetimes of any year."""
+    return int(value.timestamp())
+
+
+class TrajectorySet:
+    """The keyframes of all moving features of a layer, packed into NumPy arrays."""
+
+    def __init__(self, keyframes):
+        """`keyframes` is an iterable of (feature_id, time, GeoJSON geometry dict), ordered by feature and time."""
+        feature_ids, trajectory_index, times = [], [], []
+        offsets, counts, structure_keys = [], [], []
+        self.types, self.shapes, self.static_geometries = [], [], {}
+        positions = []
+        structures = {}
+
+        for feature_id, time, geometry in keyframes:
+            if not feature_ids or feature_ids[-1] != feature_id:
+                feature_ids.append(feature_id)
+            keyframe = len(times)
+            trajectory_index.append(len(feature_ids) - 1)
+            times.append(to_epoch(time))
+            offsets.append(len(positions))
+
+            if 'coordinates' in geometry:
+                keyframe_positions, shape = flatten_coordinates(geometry['coordinates'])
+                key = structures.setdefault(json.dumps([geometry['type'], shape]), len(structures))
+            else:
+                # GeometryCollections are never interpolated
+                keyframe_positions, shape, key = [], None, -1 - keyframe
+                self.static_geometries[keyframe] = geometry
+            positions.extend(keyframe_positions)
+            counts.append(len(keyframe_positions))
+            structure_keys.append(key)
+            self.types.append(geometry['type'])
+            self.shapes.append(shape)
+
+        self.feature_ids = np.array(feature_ids, dtype=np.int64)
+        self.trajectory_index = np.array(trajectory_index, dtype=np.int64)
+        self.times = np.array(times, dtype=np.int64)
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.counts = np.array(counts, dtype=np.int64)
+        self.coordinates = np.array(positions, dtype=np.float64).reshape(-1, 2)
+
+        # Keyframe ranges [start, end) of each trajectory
+        boundaries = np.flatnonzero(np.diff(self.trajectory_index)) + 1
+        self.starts = np.concatenate(([0], boundaries)).astype(np.int64) if len(times) else np.empty(0, np.int64)
+        self.ends = np.concatenate((boundaries, [len(times)])).astype(np.int64) if len(times) else np.empty(0, np.int64)
+
+        # A keyframe can be blended into the next one if both belong to the same
+        # trajectory and have the same geometry type and structure
+        structure_keys = np.array(structure_keys, dtype=np.int64)
+        same = (
+            (self.trajectory_index[:-1] == self.trajectory_index[1:])
+            & (structure_keys[:-1] == structure_keys[1:])
+        )
+        self.interpolatable = np.append(same, False)
+
+        # Keyframes sorted by (trajectory, time) as one int64 key, so all trajectories
+        # can be searched with a single searchsorted call
+        self.base = int(self.times.min()) if len(times) else 0
+        self.span = int(self.times.max()) - self.base + 2 if len(times) else 1
+        self.search_keys = self.trajectory_index * self.span + (self.times - self.base)
+
+    def __len__(self):
+        return len(self.feature_ids)
+
+    def interpolate(self, at):
+        """
+        Return the state of every trajectory that exists at `at` as a list of dicts:
+        feature_id, geometry (GeoJSON dict), keyframe_from, keyframe_to (epoch seconds) and fraction.
+        """
+        if not len(self):
+            return []
+        t = to_epoch(at)
+        visible = np.flatnonzero((self.times[self.starts] <= t) & (t <= self.times[self.ends - 1]))
+        if not len(visible):
+            return []
+
+        upper = np.searchsorted(self.search_keys, visible * self.span + (t - self.base), side='right')
+        lower = upper - 1  # Last keyframe at or before `at`, exists since the trajectory is visible
+        blend = (upper < self.ends[visible]) & self.interpolatable[lower]
+        upper = np.where(blend, upper, lower)
+        duration = self.times[upper] - self.times[lower]
+        fraction = np.where(blend & (duration > 0), (t - self.times[lower]) / np.maximum(duration, 1), 0.0)
+
+        counts = self.counts[lower]
+        weights = np.repeat(fraction, counts)[:, None]
+        coordinates = (
+            self.coordinates[ragged_arange(self.offsets[lower], counts)] * (1.0 - weights)
+            + self.coordinates[ragged_arange(self.offsets[upper], counts)] * weights
+        ).tolist()
+
+        states = []
+        position = 0
+        for index, trajectory in enumerate(visible.tolist()):
+            keyframe = int(lower[index])
+            count = int(counts[index])
+            if keyframe in self.static_geometries:
+                geometry = self.static_geometries[keyframe]
+            else:
+                geometry = {
+                    'type': self.types[keyframe],
+                    'coordinates': unflatten_coordinates(
+                        self.shapes[keyframe], coordinates[position:position + count]
+                    )[0],
+                }
+            position += count
+            states.append({
+                'feature_id': int(self.feature_ids[trajectory]),
+                'geometry': geometry,
+                'keyframe_from': int(self.times[keyframe]),
+                'keyframe_to': int(self.times[upper[index]]) if blend[index] else None,
+                'fraction': float(fraction[index]),
+            })
+        return states
+
+
+def get_keyframe_version(layer):
+    """A token that changes whenever keyframes of the layer are added, changed or removed."""
+    stats = FeatureKeyframe.objects.filter(feature__geodata__layer=layer).aggregate(
+        count=Count('id'), last_update=Max('updated_at')
+    )
+    last_update = stats['last_update'].timestamp() if stats['last_update'] else 0
+    return f"{stats['count']}-{last_update:.6f}"
+
+
+def load_trajectory_set(layer):
+    rows = (
+        FeatureKeyframe.objects.filter(feature__geodata__layer=layer)
+        .annotate(geojson=AsGeoJSON('geometry'))
+        .order_by('feature_id', 'time')
+        .values_list('feature_id', 'time', 'geojson')
+    )
+    return TrajectorySet((feature_id, time, json.loads(geojson)) for feature_id, time, geojson in rows)
+
+
+_trajectory_sets = OrderedDict()
+_trajectory_sets_lock = threading.Lock()
+
+
+def get_trajectory_set(layer, version):
+    """Return the packed trajectories of a layer, rebuilt only when `version` changes (LRU over layers)."""
+    with _trajectory_sets_lock:
+        entry = _trajectory_sets.get(layer.pk)
+        if entry is not None and entry[0] == version:
+            _trajectory_sets.move_to_end(layer.pk)
+            return entry[1]
+
+    trajectories = load_trajectory_set(layer)
+    with _trajectory_sets_lock:
+        _trajectory_sets[layer.pk] = (version, trajectories)
+        _trajectory_sets.move_to_end(layer.pk)
+        while len(_trajectory_sets) > getattr(settings, 'TRAJECTORY_CACHE_LAYERS', 32):
+            _trajectory_sets.popitem(last=False)
+    return trajectories
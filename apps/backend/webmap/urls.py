@@ -1,14 +1,24 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from . import views
+from . import async_views, views
 
 # Create a router and register our viewsets with it.
 router = DefaultRouter()
 router.register(r'layers', views.LayerViewSet, basename='layer')
 router.register(r'geodata', views.GeoDataViewSet, basename='geodata')
 router.register(r'features', views.FeatureViewSet, basename='feature')
+router.register(r'scenes', views.SceneViewSet, basename='scene')
 
 # The API URLs are now determined automatically by the router.
 urlpatterns = [
+    # Async variants of the hot read endpoints, served efficiently under ASGI (geodjango/asgi.py)
+    path('async/layers/<int:layer_id>/data/', async_views.layer_data, name='async-layer-data'),
+    path(
+        'async/layers/<int:layer_id>/tiles/<int:z>/<int:x>/<int:y>/',
+        async_views.layer_tile, name='async-layer-tile'
+    ),
+    path('async/features/', async_views.feature_list, name='async-feature-list'),
+    path('async/events/', async_views.feature_events, name='async-feature-events'),
+    path('snapshots/<int:layer_id>/<path:name>', views.snapshot, name='snapshot'),
     path('', include(router.urls)),
 ]
@@ -1,13 +1,53 @@
 from rest_framework import viewsets, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, NotFound, ValidationError
 from rest_framework.response import Response
 from rest_framework.renderers import JSONRenderer
-from rest_framework.permissions import IsAuthenticatedOrReadOnly
+from rest_framework.permissions import AllowAny, IsAuthenticatedOrReadOnly
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework_gis.filters import InBBoxFilter
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.gis.gdal import GDALException
+from django.contrib.gis.geos import GEOSException, GEOSGeometry
 from django.db.models import Prefetch
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
 from .models import Layer, GeoData, Feature
-from .serializers import LayerSerializer, GeoDataSerializer, FeatureSerializer, FeatureLayerSerializer
+from .columnar import from_microseconds, frame_times, get_layer_store, is_storable, time_columns, visibility_runs
+from .compression import build_cache_key, layer_data_cache_key, precompressed_response
+from .db import execute_all, execute_one
+from .filters import AttributeFilterBackend, FeatureFilterSet, FeatureSearchFilter, NearestFilter, get_at_param
+from .rasters import (
+    RasterNotFound, RasterTileError, RasterUnavailable, get_raster_path, get_raster_version, render_raster_tile,
+)
+from .renderers import MVTRenderer, PNGRenderer, WebPRenderer
+from .queries import (
+    CHANGE_CURSOR_SQL, CHANGES_SQL, FEATURE_TIMES_SQL, LAYER_SQL, build_features_query, features_from_rows,
+    layer_info_from_row, render_feature_collection,
+)
+from .snapshots import serve_snapshot
+from .spatial import SPATIAL_PREDICATES, aggregate_by_polygons, spatial_predicate_condition
+from .tilecache import get_time_bucket, tile_key, tile_response
+from .tiles import is_valid_tile, render_vector_tile
+from .trajectories import get_keyframe_version, get_trajectory_set
+from .serializers import (
+    LayerSerializer, GeoDataSerializer, FeatureSerializer, FeatureLayerSerializer,
+    CompactFeatureSerializer, NearestFeatureSerializer, StylePalette, can_render_rows, serialize_feature_collection,
+)
+
+
+def is_compact_request(request):
+    """Return True if the client asked for the compact style palette (`?compact=true`)."""
+    return request.query_params.get('compact', '').lower() in ('1', 'true', 'yes')
+
+
+class ServiceUnavailable(APIException):
+    status_code = 503
+    default_detail = 'Service temporarily unavailable.'
+    default_code = 'service_unavailable'
 
 
 class LayerViewSet(viewsets.ModelViewSet):
@@ -24,16 +64,248 @@ class LayerViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Layer.objects.all().order_by('name').select_related('geodata')
 
+    def handle_exception(self, exc):
+        # Tile actions negotiate an image or MVT renderer, but their error payloads are JSON
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        if renderer is not None and renderer.render_style == 'binary':
+            self.request.accepted_renderer = JSONRenderer()
+            self.request.accepted_media_type = JSONRenderer.media_type
+        return super().handle_exception(exc)
+
     @action(detail=True, url_path='data', renderer_classes=[JSONRenderer])
     def data(self, request, pk=None):
+        """
+        Return all features of the layer as a FeatureCollection.
+        Supports the `at=` temporal filter and `compact=true` for a deduplicated style table.
+        `as_of=<transaction time>` returns the features as they were stored at that time.
+        """
         layer = self.get_object()
-        features = layer.geodata.features.all()
-        serializer = FeatureSerializer(features, many=True, context={'request': request})
-        feature_collection = {
-            'type': 'FeatureCollection',
-            'features': serializer.data
-        }
-        return Response(feature_collection)
+        at = get_at_param(request)
+        as_of = get_at_param(request, 'as_of')
+        compact = is_compact_request(request)
+        info = layer_info_from_row(execute_one(LAYER_SQL, {'layer_id': layer.pk}))
+
+        def render():
+            if as_of is None and not compact and is_storable(info['count']):
+                # Every new `at` of a time slider is answered from memory, see webmap/columnar.py
+                return get_layer_store(layer.pk, layer.geodata.pk, info['version']).render(at=at)
+            # Prepared hot query, see webmap/queries.py
+            geojson = can_render_rows(compact)
+            rows = execute_all(
+                *build_features_query(geodata_id=layer.geodata.pk, at=at, as_of=as_of, geojson=geojson)
+            )
+            return render_feature_collection(rows, compact=compact, geojson=geojson)
+
+        # Payloads are compressed once per layer version and reused across requests
+        cache_key = layer_data_cache_key(layer.pk, info['version'], at, compact, as_of)
+        return precompressed_response(request, cache_key, render)
+
+    @action(detail=True, url_path='changes', renderer_classes=[JSONRenderer])
+    def changes(self, request, pk=None):
+        """
+        Delta sync: the features written since the `since=` cursor of an earlier response as a
+        FeatureCollection, the IDs of features deleted since then in `deleted` and the `cursor`
+        for the next request. Without `since` all features are returned.
+        Example: /api/layers/{id}/changes/?since=7731
+        """
+        layer = self.get_object()
+        since = request.query_params.get('since') or '0'
+        if not since.isdigit():
+            raise ValidationError({'since': 'Expected a cursor returned by an earlier request.'})
+        since = int(since)
+        until = max(execute_one(CHANGE_CURSOR_SQL)['cursor'], since)
+        rows = execute_all(CHANGES_SQL, {'geodata_id': layer.geodata.pk, 'since': since, 'until': until})
+        collection = serialize_feature_collection(
+            features_from_rows(row for row in rows if row['operation'] != 'D'), compact=is_compact_request(request)
+        )
+        collection['deleted'] = [row['id'] for row in rows if row['operation'] == 'D']
+        collection['cursor'] = str(until)
+        # Not cached: `until` moves with every committed transaction, so no response would be served twice
+        return Response(collection)
+
+    @action(detail=True, url_path='aggregate', renderer_classes=[JSONRenderer])
+    def aggregate(self, request, pk=None):
+        """
+        Aggregate another layer against the polygons of this layer, e.g. cities or river length per state.
+        Example: /api/layers/{states}/aggregate/?source={rivers}&at=1900
+        Results are cached per pair of layer versions.
+        """
+        layer = self.get_object()
+        try:
+            source = self.get_queryset().get(pk=int(request.query_params.get('source', '')))
+        except ValueError:
+            raise ValidationError({'source': 'The ID of the layer to aggregate is required.'})
+        except Layer.DoesNotExist:
+            raise NotFound("Source layer not found.")
+        if not hasattr(layer, 'geodata') or not hasattr(source, 'geodata'):
+            raise NotFound("Both layers need geodata.")
+        at = get_at_param(request)
+
+        def render():
+            results = aggregate_by_polygons(layer.geodata.pk, source.geodata.pk, at=at)
+            return JSONRenderer().render({
+                'polygon_layer': layer.pk,
+                'source_layer': source.pk,
+                'at': at.isoformat() if at else None,
+                'results': results,
+            })
+
+        versions = Layer.get_data_versions([layer, source])
+        cache_key = build_cache_key(
+            'layer-aggregate', layer.pk, versions[layer.pk], source.pk, versions[source.pk], at
+        )
+        return precompressed_response(request, cache_key, render)
+
+    @action(detail=True, url_path='trajectories', renderer_classes=[JSONRenderer])
+    def trajectories(self, request, pk=None):
+        """
+        Return the moving features of the layer (features with keyframes) with their geometry
+        interpolated at the required `at=` time. Example: /api/layers/{id}/trajectories/?at=1813-10-16
+        Each feature carries `keyframe_from`, `keyframe_to` and `fraction` in its properties.
+        """
+        layer = self.get_object()
+        at = get_at_param(request)
+        if at is None:
+            raise ValidationError({'at': 'A point in time is required.'})
+        keyframe_version = get_keyframe_version(layer)
+
+        def render():
+            states = get_trajectory_set(layer, keyframe_version).interpolate(at)
+            features = {
+                feature.pk: feature
+                for feature in layer.geodata.features.filter(pk__in=[state['feature_id'] for state in states])
+                .visible_at(at)
+                .select_related('geodata__layer')
+            }
+            states = [state for state in states if state['feature_id'] in features]
+            collection = serialize_feature_collection([features[state['feature_id']] for state in states])
+            for data, state in zip(collection['features'], states):
+                data['geometry'] = state['geometry']
+                data['properties']['keyframe_from'] = self.format_epoch(state['keyframe_from'])
+                data['properties']['keyframe_to'] = self.format_epoch(state['keyframe_to'])
+                data['properties']['fraction'] = state['fraction']
+            return JSONRenderer().render(collection)
+
+        cache_key = build_cache_key('layer-trajectories', layer.pk, layer.get_data_version(), keyframe_version, at)
+        return precompressed_response(request, cache_key, render)
+
+    @staticmethod
+    def format_epoch(value):
+        if value is None:
+            return None
+        return (datetime(1970, 1, 1, tzinfo=dt_timezone.utc) + timedelta(seconds=value)).isoformat()
+
+    @action(detail=True, url_path='frames', renderer_classes=[JSONRenderer])
+    def frames(self, request, pk=None):
+        """
+        Visibility of all features at `steps` evenly spaced times from `from` to `to`, for timeline animations.
+        Example: /api/layers/{id}/frames/?from=1800&to=1900&steps=100
+        `ids` lists the features once, in the order of /data/. The `runs` of each frame are the alternating
+        lengths of hidden and visible features in that order, starting with hidden: [0, 3, 2, 1] shows
+        the first three features and the last one. Geometries are loaded once from /data/ without `at`.
+        """
+        layer = self.get_object()
+        start, end = get_at_param(request, 'from'), get_at_param(request, 'to')
+        if start is None or end is None:
+            raise ValidationError({'from': 'Both `from` and `to` are required.'})
+        if end < start:
+            raise ValidationError({'to': 'Must not be before `from`.'})
+        max_steps = getattr(settings, 'FRAMES_MAX_STEPS', 1000)
+        try:
+            steps = int(request.query_params.get('steps', 100))
+        except ValueError:
+            steps = 0
+        if not 1 <= steps <= max_steps:
+            raise ValidationError({'steps': f'Expected an integer between 1 and {max_steps}.'})
+        info = layer_info_from_row(execute_one(LAYER_SQL, {'layer_id': layer.pk}))
+
+        def render():
+            if is_storable(info['count']):
+                store = get_layer_store(layer.pk, layer.geodata.pk, info['version'])
+                feature_ids, time_from, time_to = store.feature_ids, store.time_from, store.time_to
+            else:
+                feature_ids, time_from, time_to = time_columns(
+                    execute_all(FEATURE_TIMES_SQL, {'geodata_id': layer.geodata.pk})
+                )
+            times = frame_times(start, end, steps)
+            return JSONRenderer().render({
+                'ids': feature_ids.tolist(),
+                'frames': [
+                    {'at': from_microseconds(t).isoformat(), 'runs': runs}
+                    for t, runs in zip(times, visibility_runs(time_from, time_to, times))
+                ],
+            })
+
+        cache_key = build_cache_key('layer-frames', layer.pk, info['version'], start, end, steps)
+        return precompressed_response(request, cache_key, render)
+
+    @action(
+        detail=True,
+        url_path=r'tiles/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)',
+        renderer_classes=[MVTRenderer, JSONRenderer],
+    )
+    def tile(self, request, pk=None, z=None, x=None, y=None):
+        """Return a Mapbox Vector Tile of the layer. Supports the `at=` temporal filter."""
+        layer = self.get_object()
+        z, x, y = int(z), int(x), int(y)
+        if not is_valid_tile(z, x, y):
+            raise NotFound("Tile coordinates out of range.")
+
+        at = get_at_param(request)
+        version = layer.get_data_version()
+        # Two-tier tile cache; all times showing the same features share a tile
+        key = tile_key('vector', layer.pk, version, z, x, y, get_time_bucket(layer.geodata.pk, version, at))
+        return tile_response(
+            request, key, lambda: render_vector_tile(layer, z, x, y, at=at), content_type=MVTRenderer.media_type
+        )
+
+    @action(
+        detail=True,
+        url_path=r'raster/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)',
+        renderer_classes=[PNGRenderer, WebPRenderer, JSONRenderer],
+    )
+    def raster(self, request, pk=None, z=None, x=None, y=None):
+        """
+        Return an XYZ tile of a raster layer, rendered from its GeoTIFF (`GeoData.raster_path`)
+        with the colour ramp of its `style_config` (see webmap/rasters.py).
+        PNG by default, WebP with `?format=webp` or `Accept: image/webp`.
+        """
+        layer = self.get_object()
+        z, x, y = int(z), int(x), int(y)
+        if not is_valid_tile(z, x, y):
+            raise NotFound("Tile coordinates out of range.")
+        if layer.layer_type not in ('raster', 'tile'):
+            raise NotFound("Not a raster layer.")
+        try:
+            path = get_raster_path(getattr(layer, 'geodata', None))
+        except RasterNotFound as exc:
+            raise NotFound(str(exc))
+
+        image_format = 'webp' if request.accepted_renderer.format == 'webp' else 'png'
+        # Style changes update the layer, file changes the raster version
+        version = f"{layer.updated_at.timestamp():.6f}-{get_raster_version(path)}"
+        key = tile_key('raster', layer.pk, version, z, x, y, image_format=image_format)
+        try:
+            response = tile_response(
+                request, key,
+                lambda: render_raster_tile(path, layer.style_config, z, x, y, image_format),
+                content_type=f"image/{image_format}",
+            )
+        except RasterUnavailable as exc:
+            raise ServiceUnavailable(str(exc))
+        except RasterTileError as exc:
+            raise ValidationError({'style_config': str(exc)})
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+
+
+def snapshot(request, layer_id, name):
+    """
+    Serve a file from the baked snapshot of a layer (see `manage.py bake_snapshots`).
+    Only the manifest on disk is consulted, the database is never hit.
+    """
+    return serve_snapshot(request, layer_id, name)
 
 
 class GeoDataViewSet(viewsets.ModelViewSet):
@@ -58,19 +330,224 @@ class FeatureViewSet(viewsets.ReadOnlyModelViewSet):
     Example: /api/features/?in_bbox=-180,-90,180,90
     A viewset for viewing and editing feature instances.
     Supports bounding box, temporal, and text search filters.
+    Attributes can be filtered with typed `attr.<key>__<op>=` parameters,
+    e.g. /api/features/?attr.type=capital&attr.population__gte=1000000
+    Nearest features: /api/features/?near=13.40,52.52&k=5&max_distance=50000&at=1800
+    Past edits: /api/features/?geodata__layer=3&as_of=2026-09-01T12:00:00Z (layer, bbox and time filters only)
     """
     queryset = Feature.objects.select_related('geodata__layer').all()
     serializer_class = FeatureSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     bbox_filter_field = 'geometry'
-    filter_backends = (InBBoxFilter, DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter)
-    
-    filterset_fields = {
-        'geodata__layer': ['exact'],
-        'time_from': ['gte', 'lte', 'exact'], 
-        'time_to': ['gte', 'lte', 'exact'],
-    }
+    filter_backends = (
+        InBBoxFilter, DjangoFilterBackend, AttributeFilterBackend, FeatureSearchFilter, filters.OrderingFilter,
+        NearestFilter,  # Must stay last, it slices the queryset
+    )
     
-    search_fields = ['name', 'description', '_attributes']
+    filterset_class = FeatureFilterSet
     
-    ordering_fields = ['created_at', 'updated_at', 'time_from', 'time_to']
+    ordering_fields = ['created_at', 'updated_at', 'time_from', 'time_to', 'area_m2', 'length_m', 'num_points']
+
+    def get_serializer_class(self):
+        if self.request is not None and self.request.query_params.get(NearestFilter.near_param):
+            return NearestFeatureSerializer
+        return super().get_serializer_class()
+
+    # Requests using only these parameters are answered by a prepared hot query
+    hot_query_params = {'geodata__layer', 'at', 'in_bbox', 'compact', 'format', 'as_of'}
+
+    def list(self, request, *args, **kwargs):
+        """List features, with a deduplicated `styles` table when `compact=true` is given."""
+        hot_filters = self.get_hot_filters(request)
+        if hot_filters is None and request.query_params.get('as_of'):
+            raise ValidationError({
+                'as_of': f"Can only be combined with {', '.join(sorted(self.hot_query_params - {'as_of'}))}."
+            })
+        if hot_filters is not None:
+            response = self.get_store_response(request, hot_filters)
+            if response is not None:
+                return response
+            rows = execute_all(*build_features_query(**hot_filters))
+            return Response(serialize_feature_collection(
+                features_from_rows(rows), self.get_serializer_context(), compact=is_compact_request(request)
+            ))
+        if not is_compact_request(request):
+            return super().list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(serialize_feature_collection(queryset, self.get_serializer_context(), compact=True))
+
+    def get_hot_filters(self, request):
+        """
+        Return the arguments of build_features_query for the map's hot filters (layer, bbox, time),
+        or None if the request uses any other parameter and needs the filter backends.
+        """
+        if not set(request.query_params) <= self.hot_query_params:
+            return None
+        layer_id = request.query_params.get('geodata__layer')
+        if layer_id:
+            try:
+                layer_id = int(layer_id)
+            except ValueError:
+                return None  # Let the filterset report the error
+        bbox = InBBoxFilter().get_filter_bbox(request)
+        return {
+            'layer_id': layer_id or None,
+            'at': get_at_param(request),
+            'bbox': bbox.extent if bbox is not None else None,
+            'as_of': get_at_param(request, 'as_of'),
+        }
+
+    def get_store_response(self, request, hot_filters):
+        """
+        Answer a single-layer request from the in-memory layer store (see webmap/columnar.py),
+        or return None if the request or the layer is not suited for it.
+        """
+        if (
+            hot_filters['layer_id'] is None or hot_filters['as_of'] is not None
+            or is_compact_request(request) or request.accepted_renderer.format != 'json'
+        ):
+            return None
+        info = execute_one(LAYER_SQL, {'layer_id': hot_filters['layer_id']})
+        if info is None or info['geodata_id'] is None or not is_storable(info['count']):
+            return None
+        info = layer_info_from_row(info)
+        store = get_layer_store(info['id'], info['geodata_id'], info['version'])
+        return HttpResponse(
+            store.render(at=hot_filters['at'], bbox=hot_filters['bbox']), content_type='application/json'
+        )
+
+    @action(detail=False, methods=['post'], url_path='search', permission_classes=[AllowAny])
+    def spatial_search(self, request):
+        """
+        Select features with an arbitrary GeoJSON geometry, e.g. a state outline or a river corridor.
+        Body: {"geometry": {...}, "predicate": "intersects|within|contains|dwithin", "distance": <meters>}
+        The usual filters (at, geodata__layer, attr.*, ...) are given in the query string.
+        """
+        geometry = self.parse_query_geometry(request.data.get('geometry'))
+        predicate = request.data.get('predicate', 'intersects')
+        if predicate not in SPATIAL_PREDICATES:
+            raise ValidationError({'predicate': f"Must be one of: {', '.join(SPATIAL_PREDICATES)}."})
+
+        distance = request.data.get('distance')
+        if predicate == 'dwithin':
+            try:
+                distance = float(distance)
+            except (TypeError, ValueError):
+                raise ValidationError({'distance': 'A distance in meters is required for dwithin.'})
+            if distance < 0:
+                raise ValidationError({'distance': 'Must not be negative.'})
+
+        condition = spatial_predicate_condition(
+            geometry, predicate, distance=distance,
+            max_vertices=getattr(settings, 'SPATIAL_SEARCH_SUBDIVIDE_VERTICES', 256),
+        )
+        # Filtered before the backends, so NearestFilter only ranks features matching the geometry
+        queryset = self.filter_queryset(self.get_queryset().filter(condition))
+        if is_compact_request(request):
+            return Response(serialize_feature_collection(queryset, self.get_serializer_context(), compact=True))
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    def parse_query_geometry(self, value):
+        """Parse the GeoJSON geometry of a spatial search request."""
+        if not isinstance(value, dict):
+            raise ValidationError({'geometry': 'A GeoJSON geometry object is required.'})
+        try:
+            geometry = GEOSGeometry(json.dumps(value))
+        except (GDALException, GEOSException, ValueError, TypeError) as exc:
+            raise ValidationError({'geometry': f'Invalid GeoJSON geometry: {exc}'})
+        if geometry.srid is None:
+            geometry.srid = 4326
+        max_points = getattr(settings, 'SPATIAL_SEARCH_MAX_POINTS', 100000)
+        if geometry.num_points > max_points:
+            raise ValidationError({'geometry': f'Geometries may have at most {max_points} vertices.'})
+        if not geometry.valid:
+            geometry = geometry.make_valid()
+        return geometry
+
+
+class SceneViewSet(viewsets.ViewSet):
+    """
+    API endpoint that returns the features of several layers in one response, for storymap scenes.
+    All layers share the same filters and are fetched with a single query.
+    Example: /api/scenes/?layers=1,2,3&at=1800&in_bbox=5.8,47.2,15.1,55.1&zoom=7
+    With `compact=true` the scene carries one `styles` table shared by all layers.
+    """
+    permission_classes = [IsAuthenticatedOrReadOnly]
+    renderer_classes = [JSONRenderer]
+
+    def get_layer_ids(self, request):
+        value = request.query_params.get('layers', '')
+        try:
+            layer_ids = list(dict.fromkeys(int(part) for part in value.split(',') if part.strip()))
+        except ValueError:
+            raise ValidationError({'layers': 'Expected a comma-separated list of layer IDs.'})
+        if not layer_ids:
+            raise ValidationError({'layers': 'At least one layer ID is required.'})
+        max_layers = getattr(settings, 'SCENE_MAX_LAYERS', 50)
+        if len(layer_ids) > max_layers:
+            raise ValidationError({'layers': f'At most {max_layers} layers can be requested at once.'})
+        return layer_ids
+
+    def get_zoom(self, request):
+        value = request.query_params.get('zoom')
+        if value in (None, ''):
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValidationError({'zoom': 'Expected an integer zoom level.'})
+
+    def list(self, request):
+        layer_ids = self.get_layer_ids(request)
+        at = get_at_param(request)
+        bbox = InBBoxFilter().get_filter_bbox(request)
+        zoom = self.get_zoom(request)
+        compact = is_compact_request(request)
+
+        layers = {layer.pk: layer for layer in Layer.objects.filter(pk__in=layer_ids)}
+        missing = [layer_id for layer_id in layer_ids if layer_id not in layers]
+        if missing:
+            raise NotFound(f"Unknown layers: {', '.join(str(layer_id) for layer_id in missing)}")
+
+        def render():
+            # One query for all layers instead of one request per layer
+            features = Feature.objects.filter(geodata__layer__in=layer_ids).select_related('geodata__layer')
+            if at is not None:
+                features = features.visible_at(at)
+            if bbox is not None:
+                features = features.filter(geometry__contained=bbox)  # Same semantics as InBBoxFilter
+            if zoom is not None:
+                features = [feature for feature in features if feature.is_visible_at_zoom(zoom)]
+            features = list(features)
+
+            context = {'request': request}
+            if compact:
+                context['style_palette'] = StylePalette()
+                serializer = CompactFeatureSerializer(features, many=True, context=context)
+            else:
+                serializer = FeatureSerializer(features, many=True, context=context)
+            collections = {
+                layer_id: {'type': 'FeatureCollection', 'layer': layer_id, 'features': []}
+                for layer_id in layer_ids
+            }
+            for feature, data in zip(features, serializer.data):
+                collections[feature.geodata.layer_id]['features'].append(data)
+
+            scene = {
+                'type': 'Scene',
+                'at': at.isoformat() if at else None,
+            }
+            if compact:
+                # Shared by all layers of the scene
+                scene['styles'] = context['style_palette'].styles
+            scene['layers'] = [collections[layer_id] for layer_id in layer_ids]
+            return JSONRenderer().render(scene)
+
+        versions = Layer.get_data_versions(list(layers.values()))
+        cache_key = build_cache_key(
+            'scene',
+            [(layer_id, versions[layer_id]) for layer_id in layer_ids],
+            at, bbox.extent if bbox is not None else None, zoom, compact,
+        )
+        return precompressed_response(request, cache_key, render)
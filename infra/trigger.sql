@@ -36,6 +36,12 @@ BEGIN
     -- Merge the generated attributes with existing ones, generated ones take precedence
     NEW._attributes := NEW._attributes || attributes_json;
 
+    -- Keep updated_at current for edits made outside Django (e.g. in QGIS),
+    -- so cached layer payloads are invalidated
+    IF TG_OP = 'UPDATE' OR NEW.updated_at IS NULL THEN
+        NEW.updated_at := now();
+    END IF;
+
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
@@ -47,3 +53,150 @@ DROP TRIGGER IF EXISTS features_sync_trigger ON features;
 CREATE TRIGGER features_sync_trigger
 BEFORE INSERT OR UPDATE ON features
 FOR EACH ROW EXECUTE FUNCTION sync_feature_attributes();
+
+
+-- Derived geometry columns, computed once on write instead of per request.
+-- Invalid geometries are repaired with ST_MakeValid. Also installed by migration 0010.
+CREATE OR REPLACE FUNCTION compute_feature_geometry_metrics()
+RETURNS TRIGGER AS $$
+DECLARE
+    dimension integer;
+BEGIN
+    IF NEW.geometry IS NULL THEN
+        NEW.geom_type := '';
+        NEW.num_points := NULL;
+        NEW.bbox := NULL;
+        NEW.centroid := NULL;
+        NEW.label_point := NULL;
+        NEW.area_m2 := NULL;
+        NEW.length_m := NULL;
+        NEW.geometry_repaired := false;
+        RETURN NEW;
+    END IF;
+
+    -- Repair invalid geometries and remember that we did
+    NEW.geometry_repaired := NOT ST_IsValid(NEW.geometry);
+    IF NEW.geometry_repaired THEN
+        NEW.geometry := ST_MakeValid(NEW.geometry);
+    END IF;
+
+    dimension := ST_Dimension(NEW.geometry);
+
+    NEW.geom_type := substr(ST_GeometryType(NEW.geometry), 4);  -- 'ST_Polygon' -> 'Polygon'
+    NEW.num_points := ST_NPoints(NEW.geometry);
+    NEW.bbox := ST_Envelope(NEW.geometry);
+    NEW.centroid := ST_Centroid(NEW.geometry);
+
+    IF NEW.geom_type IN ('Polygon', 'MultiPolygon') THEN
+        -- Pole of inaccessibility: the label stays inside concave polygons
+        NEW.label_point := (ST_MaximumInscribedCircle(NEW.geometry)).center;
+    ELSE
+        NEW.label_point := ST_PointOnSurface(NEW.geometry);
+    END IF;
+
+    IF dimension = 2 THEN
+        NEW.area_m2 := ST_Area(NEW.geometry::geography);
+        NEW.length_m := ST_Perimeter(NEW.geometry::geography);
+    ELSIF dimension = 1 THEN
+        NEW.area_m2 := 0;
+        NEW.length_m := ST_Length(NEW.geometry::geography);
+    ELSE
+        NEW.area_m2 := 0;
+        NEW.length_m := 0;
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS features_geometry_trigger ON features;
+
+CREATE TRIGGER features_geometry_trigger
+BEFORE INSERT OR UPDATE OF geometry ON features
+FOR EACH ROW EXECUTE FUNCTION compute_feature_geometry_metrics();
+
+
+-- Append-only edit history for `as_of=` reads (table: features_history).
+-- Also installed by migration 0014; kept here so re-running this file restores it.
+CREATE OR REPLACE FUNCTION record_feature_history()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Rows moved between partitions (webmap/partitioning.py) are not edits
+    IF current_setting('webmap.skip_history', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN
+        RETURN NULL;
+    END IF;
+
+    -- A feature moved to another dataset is deleted from the old one
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.geodata_id IS DISTINCT FROM NEW.geodata_id) THEN
+        INSERT INTO features_history (feature_id, geodata_id, operation, changed_at, txid, geometry, label_point, data)
+        VALUES (
+            OLD.id, OLD.geodata_id, 'D', transaction_timestamp(), txid_current(), OLD.geometry, OLD.label_point,
+            to_jsonb(OLD) - '{geometry,label_point,bbox,centroid,search_vector}'::text[]
+        );
+    END IF;
+
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO features_history (feature_id, geodata_id, operation, changed_at, txid, geometry, label_point, data)
+        VALUES (
+            NEW.id, NEW.geodata_id,
+            CASE WHEN TG_OP = 'UPDATE' AND OLD.geodata_id = NEW.geodata_id THEN 'U' ELSE 'I' END,
+            transaction_timestamp(), txid_current(), NEW.geometry, NEW.label_point,
+            to_jsonb(NEW) - '{geometry,label_point,bbox,centroid,search_vector}'::text[]
+        );
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS features_history_trigger ON features;
+
+CREATE TRIGGER features_history_trigger
+AFTER INSERT OR UPDATE OR DELETE ON features
+FOR EACH ROW EXECUTE FUNCTION record_feature_history();
+
+
+-- Live change events on the `feature_changes` channel (webmap/notifications.py).
+-- Also installed by migration 0015.
+CREATE OR REPLACE FUNCTION notify_feature_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Rows moved between partitions (webmap/partitioning.py) are not edits
+    IF current_setting('webmap.skip_history', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP = 'UPDATE' AND OLD IS NOT DISTINCT FROM NEW THEN
+        RETURN NULL;
+    END IF;
+
+    -- A feature moved to another dataset is deleted from the old one
+    IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.geodata_id IS DISTINCT FROM NEW.geodata_id) THEN
+        PERFORM pg_notify('feature_changes', json_build_object(
+            'layer_id', (SELECT layer_id FROM geodata WHERE id = OLD.geodata_id),
+            'geodata_id', OLD.geodata_id,
+            'feature_id', OLD.id,
+            'operation', 'delete'
+        )::text);
+    END IF;
+
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM pg_notify('feature_changes', json_build_object(
+            'layer_id', (SELECT layer_id FROM geodata WHERE id = NEW.geodata_id),
+            'geodata_id', NEW.geodata_id,
+            'feature_id', NEW.id,
+            'operation', CASE WHEN TG_OP = 'UPDATE' AND OLD.geodata_id = NEW.geodata_id THEN 'update' ELSE 'insert' END
+        )::text);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS features_notify_trigger ON features;
+
+CREATE TRIGGER features_notify_trigger
+AFTER INSERT OR UPDATE OR DELETE ON features
+FOR EACH ROW EXECUTE FUNCTION notify_feature_change();